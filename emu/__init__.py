@@ -16,25 +16,30 @@
 # along with emu.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import print_function
 
-import calendar
-import getpass
+# Every emu command imports this module, so modules which are only
+# needed by some commands (e.g. humanize, tempfile, and template
+# lookups) are imported where they are used, keeping startup fast.
+import bisect
 import os
 import re
-import shlex
-import shutil
 import signal
+import stat
 import subprocess
 import sys
+import threading
 import time
+from collections import OrderedDict
+from collections import namedtuple
 from configparser import ConfigParser as _ConfigParser
 from datetime import datetime
+from itertools import chain
+from itertools import islice
 from optparse import OptionParser
 from os import path
 from sys import exit
 
 from emu import io
 from emu.lockfile import LockFile
-from pkg_resources import resource_filename
 
 
 def colourise(string, colour):
@@ -123,9 +128,9 @@ def lookup_emu_program(command):
   Raises:
       InvalidEmuCommand: If the command does not exist.
   """
-  # TODO: Use a more robust mechanism than using "which", since this
-  # will fail if the scripts have not been installed into the
-  # environment path.
+  # Note that cli.lookup() looks alongside the "emu" program first,
+  # so that commands are found if the scripts have not been installed
+  # into the environment path.
   script = "emu-" + command
   script_path = which(script)
   if not script_path:
@@ -218,12 +223,18 @@ def can_traverse_up(dirpath, barriers=[]):
           and not any(issubdir(dirpath, barrier) for barrier in barriers))
 
 
+# Source directories found by find_source_dir(), keyed by the absolute
+# path of the starting directory and the barriers:
+_source_dirs = {}
+
+
 def find_source_dir(dirpath, barriers=[]):
   """
   Walk up a tree to find a source's root directory.
 
   Attempt to determine the source directory by iterating up the
-  directory tree starting at a given base.
+  directory tree starting at a given base. Results are cached for the
+  lifetime of the process.
 
   Arguments:
 
@@ -239,12 +250,15 @@ def find_source_dir(dirpath, barriers=[]):
 
       SourceNotFoundError: If no source is found.
   """
-  if issource(dirpath):
-    return path.abspath(dirpath)
-  elif can_traverse_up(dirpath, barriers=barriers):
-    return find_source_dir(path.join(dirpath, os.pardir))
-  else:
-    raise SourceNotFoundError(dirpath)
+  key = (path.abspath(dirpath), tuple(barriers))
+  if key not in _source_dirs:
+    if issource(dirpath):
+      _source_dirs[key] = path.abspath(dirpath)
+    elif can_traverse_up(dirpath, barriers=barriers):
+      _source_dirs[key] = find_source_dir(path.join(dirpath, os.pardir))
+    else:
+      raise SourceNotFoundError(dirpath)
+  return _source_dirs[key]
 
 
 def isprocess(pid, error=False):
@@ -297,8 +311,9 @@ def _parse_snapshot_id(string, sink):
   if id_match:
     # If there's an ID, then match it:
     id = SnapshotID(sink.name, id_match)
-    snapshot = Util.get_snapshot_by_id(id, sink.snapshots())
-    return snapshot.nth_parent(n_index, error=True)
+    if id_match not in sink.index:
+      raise SnapshotNotFoundError(id)
+    return Snapshot(id, sink).nth_parent(n_index, error=True)
 
   elif head_match:
     # Calculate the HEAD index and traverse:
@@ -359,17 +374,15 @@ def _parse_arg(arg, source, accept_sink_names=True):
   if branch_match:
 
     # We start from the indicated node and work back, stopping
-    # if/when we reach the terminating snapshot.
-    node = src.parent()
-    while node and node != dst:
-      snapshots.append(node)
-      node = node.parent()
-
-    # If the last snapshot doesn't match the terminating
-    # snapshot, then we were unable to create a branch
-    # history.
-    if dst and snapshots[-1].parent() != dst:
+    # if/when we reach the terminating snapshot. If the terminating
+    # snapshot is not an ancestor, then we are unable to create a
+    # branch history.
+    names = sink.index.ancestry().between(src.name,
+                                          dst.name if dst else None)
+    if names is None:
       raise InvalidBranchError(src, dst)
+    snapshots += [Snapshot(SnapshotID(sink.name, name), sink)
+                  for name in names]
 
   if dst:
     snapshots.append(dst)
@@ -386,21 +399,44 @@ class Parser(OptionParser):
     # Instantiate superclass
     OptionParser.__init__(self, add_help_option=False)
 
+    # Commands parse their arguments first, so this is where the
+    # interrupt handler is installed:
+    signal.signal(signal.SIGINT, _sigint_handler)
+
     # Allow overriding of default handlers:
     self.set_conflict_handler("resolve")
 
-    # Set default parser arguments:
+    # Set default parser arguments. The default source directory is
+    # found after parsing, and only if "-S" is not given:
+    self.source_dir_arg = source_dir_arg
     if source_dir_arg:
       self.add_option("-S", "--source-dir", action="store", type="string",
-                      dest="source_dir",
-                      default=find_source_dir(os.getcwd()))
+                      dest="source_dir", default=None)
     self.add_option("--version", action="callback",
                     callback=print_version_and_quit)
     self.add_option("-v", "--verbose", action="callback",
-                    callback=lambda *_: io.enable_verbose_messages)
+                    callback=lambda *_: io.enable_verbose_messages())
     self.add_option("-h", "--help", action="callback",
                     callback=Util.help_and_quit)
 
+  def parse_args(self, args=None, values=None):
+    """
+    Parse command line arguments.
+
+    Arguments:
+        args (list of str, optional): Arguments to parse. Defaults to
+          sys.argv[1:].
+
+    Returns:
+        Tuple(optparse.Values, list of str): Options and positional
+          arguments.
+    """
+    options, args = OptionParser.parse_args(self, args, values)
+    if self.source_dir_arg and options.source_dir is None:
+      options.source_dir = find_source_dir(os.getcwd())
+    self._options, self._args = options, args
+    return options, args
+
   def options(self, *options):
     """
     Set/Get the parser options.
@@ -465,9 +501,35 @@ class Parser(OptionParser):
         else:
           raise e
 
+  def iter_snapshots(self, source, limit=0):
+    """
+    Iterate over the snapshots identified by the arguments, in the
+    same order as parse_snapshots().
+
+    If the arguments only name sinks, or there are none, snapshots
+    are generated lazily from the sink indexes, newest first, so
+    that only the snapshots which are consumed are created. Otherwise
+    the arguments are resolved by parse_snapshots().
+
+    Arguments:
+        source (Source): The source.
+        limit (int, optional): If greater than zero, the maximum
+          number of snapshots to generate.
+
+    Returns:
+        Iterable of Snapshot: Snapshots.
+    """
+    if all(":" not in arg for arg in self.args()):
+      sinks = {sink.name: sink for sink in self.parse_sinks(source)}
+      snapshots = chain.from_iterable(
+          sinks[name].snapshots(reverse=True) for name in sorted(sinks))
+    else:
+      snapshots = self.parse_snapshots(source, require=True)
+    return islice(snapshots, limit if limit > 0 else None)
+
   def parse_snapshots(self, source, accept_sink_names=True,
                       accept_no_args=True, single_arg=False,
-                      require=False, error=True):
+                      require=False, error=True, ordered=False):
     """
     Parse the arguments for snapshot identifiers.
 
@@ -477,7 +539,9 @@ class Parser(OptionParser):
     a sink is only named, then a list of all of its snapshots will
     be used, instead of having to identify a single one. 'If
     'accept_no_args' is True, then a list of all sinks will be
-    used if no arguments are provided.
+    used if no arguments are provided. If 'ordered' is True, then
+    snapshots are returned in the order that they are named,
+    including duplicates.
     """
     try:
       return self._snapshots
@@ -517,12 +581,14 @@ class Parser(OptionParser):
                                    "specified using "
                                    "<sink>:<snapshot>")
 
-        # Cast to set and back to remove duplicates:
-        snapshots = list(set(snapshots))
+        if not ordered:
+          # Cast to set and back to remove duplicates:
+          snapshots = list(set(snapshots))
 
-        # Sort the snapshots into reverse chronological order:
-        snapshots.sort()
-        snapshots.reverse()
+          # Sort the snapshots alphabetically by sink, and into reverse
+          # chronological order within each sink:
+          snapshots.sort(reverse=True)
+          snapshots.sort(key=lambda snapshot: snapshot.id.sink_name)
 
         self._snapshots = snapshots
         return self._snapshots
@@ -590,6 +656,8 @@ class Source:
     exclude = ["/.emu"]
     exclude_from = [os.path.join(self.path, ".emu", "excludes")]
 
+    Util.readable(snapshot.tree, error=err_cb)
+
     with self.lock.acquire(replace_stale=True, force=force):
       with sink.lock.acquire(replace_stale=True, force=force):
         # Perform file transfer:
@@ -601,6 +669,46 @@ class Source:
     io.printf("Source restored from {0}"
               .format(colourise(snapshot.name, Colours.SNAPSHOT_NEW)))
 
+  def push(self, sinks, jobs=1, **options):
+    """
+    Push a new snapshot to each of a list of sinks.
+
+    When more than one job is requested, sinks are pushed to
+    concurrently from a pool of worker processes. The output of each
+    push is buffered and printed once that push has completed, so that
+    the output of different sinks is not interleaved.
+
+    Arguments:
+        sinks (list of Sink): Sinks to push to.
+        jobs (int, optional): Maximum number of concurrent pushes.
+        **options: Keyword arguments to Sink.push().
+
+    Returns:
+        int: Zero if every push succeeded, else non-zero.
+    """
+    status = 0
+
+    if jobs <= 1 or len(sinks) <= 1:
+      for sink in sinks:
+        status = max(status, sink.push(**options))
+      return status
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(sinks))) as executor:
+      futures = [executor.submit(_push_worker, self.path, sink.name, options)
+                 for sink in sinks]
+      for future in as_completed(futures):
+        name, ret, output = future.result()
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        if ret:
+          io.error("{}: push failed".format(colourise(name, Colours.ERROR)))
+        status = max(status, ret)
+
+    return status
+
+
   # sinks() - Get a source's sinks
   #
   # Returns a list of Sink objects.
@@ -671,11 +779,62 @@ class Source:
     return Source(sourcedir)
 
 
+def _push_worker(source_path, sink_name, options):
+  """
+  Push to a sink from a worker process.
+
+  The standard output and error file descriptors are redirected to a
+  temporary file for the duration of the push, so that the output of
+  subprocesses is also captured.
+
+  Returns:
+      Tuple(str, int, str): The sink name, exit status, and output.
+  """
+  import tempfile
+  import traceback
+
+  saved_fds = [os.dup(1), os.dup(2)]
+  with tempfile.TemporaryFile() as output:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(output.fileno(), 1)
+    os.dup2(output.fileno(), 2)
+    try:
+      sink = Sink(sink_name, Source(source_path))
+      status = sink.push(**options)
+      # Don't return until rotated snapshots have been deleted:
+      if sink.reaper:
+        sink.reaper.join()
+    except SystemExit as e:
+      if e.code is None or isinstance(e.code, int):
+        status = e.code or 0
+      else:
+        print(e.code, file=sys.stderr)
+        status = 1
+    except Exception:
+      traceback.print_exc()
+      status = 1
+    finally:
+      sys.stdout.flush()
+      sys.stderr.flush()
+      for fd, saved_fd in zip((1, 2), saved_fds):
+        os.dup2(saved_fd, fd)
+        os.close(saved_fd)
+
+    output.seek(0)
+    return sink_name, status, output.read().decode(errors="replace")
+
+
 #####################
 # Emu snapshot sink #
 #####################
 class Sink:
 
+  # The minimum ratio of free space on the device, see rotate():
+  MIN_FREE_RATIO = .05
+  # Suffix of the files which record the size of trash entries:
+  TRASH_SIZE_SUFFIX = ".size"
+
   def __init__(self, name, source):
 
     def err_cb(e):
@@ -684,7 +843,7 @@ class Sink:
       else:
         io.fatal("Non-existent or malformed emu sink.")
 
-    self.name = name
+    self.name = sys.intern(name)
     self.source = source
     self.path = Util.read(f"{self.source.path}/.emu/sinks/{self.name}",
                           error=err_cb)
@@ -695,50 +854,69 @@ class Sink:
     Util.readable(os.path.join(self.path, ".emu", "nodes"), error=err_cb)
 
     config_path = os.path.join(self.path, ".emu", "config")
-    self.config = SinkConfig(config_path)
+    self.config = SinkConfig.cached(config_path)
+
+    # Cache of trash entry sizes, see pending_trash_space:
+    self._trash_sizes = {}
+    # Background trash reaper thread, see empty_trash_in_background:
+    self.reaper = None
+
+  @property
+  def index(self):
+    """
+    The sink's snapshot index, brought up to date with the nodes directory.
+
+    Returns:
+        SnapshotIndex: Index.
+    """
+    try:
+      return self._index.load()
+    except AttributeError:
+      self._index = SnapshotIndex(self)
+      return self._index.load()
 
-  def snapshots(self):
+  def snapshots(self, reverse=False):
     """
     Iterate over all snapshots.
 
+    Arguments:
+        reverse (bool, optional): If True, iterate from newest to
+          oldest.
+
     Returns:
-        Iterable
+        Iterable: Snapshots from oldest to newest.
     """
-    ids = Util.ls(os.path.join(self.path, ".emu", "nodes"), must_exist=True)
-    for id in ids:
-      yield Snapshot(SnapshotID(self.name, id), self)
+    names = self.index.names()
+    for name in reversed(names) if reverse else names:
+      yield Snapshot(SnapshotID(self.name, name), self)
 
   def snapshot_names(self):
-    return sorted(Util.ls(os.path.join(self.path, ".emu", "nodes"),
-                          must_exist=True))
+    return self.index.names()
 
   def head(self):
     """
     Get the current sink head
 
-    Returns the snapshot pointed to by the HEAD file, or None if headless.
+    Returns the most recent snapshot, or None if headless.
     """
-    # no snapshots
-    if not len(self.snapshot_names()):
+    name = self.index.head()
+    if name is None:
       return None
 
-    return Snapshot(SnapshotID(self.name, self.snapshot_names()[-1]), self)
+    return Snapshot(SnapshotID(self.name, name), self)
 
   def tail(self):
     """
-    Return the oldest snapshot in the current branch.
-
-    Traverse each snapshot's parent until we reach a null pointer, starting
-    from the HEAD.
+    Return the oldest snapshot in the sink.
 
     Returns:
-        Snapshot: Tail
+        Snapshot: Tail, or None if the sink has no snapshots.
     """
-    # no snapshots
-    if not len(self.snapshot_names()):
+    name = self.index.tail()
+    if name is None:
       return None
 
-    return Snapshot(SnapshotID(self.name, self.snapshot_names()[0]), self)
+    return Snapshot(SnapshotID(self.name, name), self)
 
   def rotate(self, force=False, dry_run=False):
     """
@@ -749,69 +927,570 @@ class Sink:
       exist for the same day, the most recent one is kept.
     * Weekly snapshots are kept for all previous months. Where multiple
       snapshots exist for the same week, the most recent one is kept.
-    * Snapshots are removed, starting with the oldest, until at least 20% of
+    * Snapshots are removed, starting with the oldest, until at least 5% of
       the total storage space on the partition containing the sink is free.
     """
-    snapshot = self.head()
+    plan = self.plan_rotation()
+    for line in plan.report():
+      io.printf(line)
+    victims = plan.remove
+
+    needed = (self.MIN_FREE_RATIO * self.device_capacity -
+              self.free_space_on_device)
+    if needed <= 0:
+      self.remove_snapshots(victims, dry_run=dry_run, force=force)
+      return
 
-    now = datetime.now()
-    current_day = now.day
-    current_week = now.isocalendar()[1]
+    # Remove snapshots from the tail of HEAD's branch until at least 5%
+    # of the space on the drive is projected to be available. The
+    # projection uses the recorded disk usage of snapshots, so that
+    # all of the victims are removed in a single batch. Snapshots
+    # without recorded usage are measured, once each:
+    index = self.index
+    store = self.store_inodes()
+    sizes = self.freed_space(victims, store=store)
+    freed = sum(sizes.values())
+    tail = [name for name in reversed(index.ancestry().branch[1:])
+            if name not in sizes]
+    count = 0
+    for name in tail:
+      if freed >= needed:
+        break
+      # Adding a victim can also free files which it shares with its
+      # removed parent, which are counted against the parent:
+      parent = index.get(name).parent
+      before = sizes.get(parent, 0)
+      self.freed_space([name], freed=sizes, store=store)
+      freed += sizes[name] + sizes.get(parent, 0) - before
+      victims.append(name)
+      count += 1
+
+    if count:
+      io.printf("{}: available space is {:.0%}, removing {} snapshot{}".format(
+          colourise(self.name, Colours.OK), self.free_space_ratio, count,
+          "" if count == 1 else "s"))
+    self.remove_snapshots(victims, dry_run=dry_run, force=force, sizes=sizes)
+
+  def plan_rotation(self, now=None):
+    """
+    Plan a rotation of the snapshots in the HEAD's branch.
 
-    while snapshot:
-      diff = now - snapshot.node.date
-      parent = snapshot.parent()
+    See rotate() for the retention strategy. Planning reads only the
+    sink index, and makes no changes.
 
-      if diff.days < 1:
-        hours_ago = diff.seconds // 3600
-        io.printf(f"skipping snapshot {snapshot} from {hours_ago} hours ago")
-      elif diff.days < 31:
-        days_ago = diff.days
-        if current_day != snapshot.node.date.day:
-          io.printf(
-              f"skipping last snapshot {snapshot} from {days_ago} days ago")
-          current_day = snapshot.node.date.day
-        else:
-          io.printf(f"removing snapshot {snapshot} from {days_ago} days ago")
-          snapshot.destroy(dry_run=dry_run, force=force)
+    Arguments:
+        now (datetime, optional): The time to plan the rotation for.
+          Defaults to the current time.
+
+    Returns:
+        RotationPlan: The plan.
+    """
+    index = self.index
+    return RotationPlan.create(
+        (index.get(name) for name in index.ancestry().branch),
+        now or datetime.now())
+
+  def remove_snapshots(self, snapshots, dry_run=False, force=False,
+                       sizes=None):
+    """
+    Destroy a batch of snapshots.
+
+    The sink is locked once for the whole batch. Parent references
+    of the remaining snapshots are re-allocated to their nearest
+    surviving ancestor, so that each remaining node file is rewritten
+    at most once, and the index is written once.
+
+    Arguments:
+        snapshots (iterable of Snapshot or str): Snapshots or snapshot
+          names to destroy.
+        dry_run (bool, optional): If True, don't make any actual changes.
+        force (bool, optional): If True, ignore locks.
+        sizes (dict of str to int, optional): The space which deleting
+          each snapshot will free, see freed_space(). If not provided,
+          it is taken from the recorded disk usage of the snapshots.
+    """
+    from emu import manifest
+    from emu import usage
+
+    names = [getattr(s, "name", s) for s in snapshots]
+
+    for name in names:
+      io.printf("{}: removing snapshot {}".format(
+          colourise(self.name, Colours.OK),
+          colourise(name, Colours.SNAPSHOT_DELETE))
+      )
+
+    # We don't actually need to modify anything on a dry run:
+    if dry_run or not names:
+      return
+
+    with self.lock.acquire(replace_stale=True, force=force):
+      index = self.index
+      names = [name for name in names if name in index]
+      removed = set(names)
+      head = index.head()
+      # The space which deleting each tree will free, see trash(). No
+      # trees are walked while the sink is locked:
+      if sizes is None:
+        sizes = self.freed_space(names)
+
+      # The disk usage of the neighbours of removed snapshots changes:
+      stale = set()
+      for name in names:
+        parent = index.get(name).parent
+        while parent in removed:
+          parent = index.get(parent).parent
+        if parent:
+          stale.add(parent)
+
+      # Re-allocate parent references from all surviving snapshots:
+      for entry in list(index.entries()):
+        if entry.name in removed or entry.parent not in removed:
+          continue
+        stale.add(entry.name)
+        parent = entry.parent
+        while parent in removed:
+          parent = index.get(parent).parent
+        snapshot = Snapshot(SnapshotID(self.name, entry.name), self)
+        snapshot.node.parent(value=parent)
+        index.update(entry.name, parent=parent)
+
+        # Re-encode manifests which are deltas against a removed
+        # snapshot, oldest first so that new bases are already valid:
+        child_manifest = snapshot.manifest
+        if (child_manifest.exists and
+            child_manifest.header()[0] in removed):
+          child_manifest.rebase(parent or None)
+
+      for name in stale:
+        node = Snapshot(SnapshotID(self.name, name), self).node
+        if node.has_section(usage.SECTION):
+          usage.write(node, usage.read(node)._replace(stale=True))
+          node.flush()
+
+      # Move snapshot trees into the trash and delete nodes. The trees
+      # are deleted later by empty_trash():
+      for name in names:
+        self.trash(os.path.join(self.path, name), size=sizes.get(name))
+        Util.rm(f"{self.path}/.emu/nodes/{name}", must_exist=True, error=True)
+        manifest.Manifest(self.manifests_dir, name).remove()
+        index.remove(name)
+      index.flush()
+
+      # If HEAD was removed, then point to the new HEAD:
+      if head in removed:
+        Util.rm(os.path.join(self.path, "Latest"))
+        if index.head():
+          Util.ln_s(index.head(), os.path.join(self.path, "Latest"))
+
+  def freed_space(self, snapshots, freed=None, store=None):
+    """
+    Estimate the space which removing a batch of snapshots would free.
+
+    The estimate uses the recorded disk usage of snapshots, so no
+    trees are walked. Removing a snapshot frees its exclusive size.
+    If its child is removed too, then the files which are shared by
+    only the two of them are freed as well, and are counted against
+    the parent.
+
+    Arguments:
+        snapshots (iterable of Snapshot or str): Snapshots or snapshot
+          names to remove.
+        freed (dict of str to int, optional): An estimate to add the
+          snapshots to, which is updated in place.
+        store (set of int, optional): The inodes of the sink's dedup
+          store, see store_inodes(). If provided, snapshots without
+          recorded usage are measured. Otherwise their size is None.
+
+    Returns:
+        dict of str to int: The number of bytes freed by removing
+          each snapshot, or None if it is not known.
+    """
+    index = self.index
+    freed = {} if freed is None else freed
+
+    def figure(name):
+      return Snapshot(SnapshotID(self.name, name), self).usage
+
+    for name in (getattr(s, "name", s) for s in snapshots):
+      if name not in index or name in freed:
+        continue
+      usage = figure(name)
+      if usage is not None:
+        freed[name] = usage.exclusive
+      elif store is not None:
+        freed[name] = Util.du(os.path.join(self.path, name), exclusive=True,
+                              store=store)
       else:
-        weeks_ago = diff.days // 7
-        if current_week != snapshot.node.date.isocalendar()[1]:
-          io.printf(
-              f"skipping last snapshot {snapshot} from {weeks_ago} weeks ago")
-          current_week = snapshot.node.date.isocalendar()[1]
-        else:
-          io.printf(f"removing snapshot {snapshot} from {weeks_ago} weeks ago")
-          snapshot.destroy(dry_run=dry_run, force=force)
+        freed[name] = None
+      if usage is None:
+        continue
+
+      # Files shared by a removed snapshot and its removed child are
+      # counted against the parent:
+      parent = index.get(name).parent
+      parent_usage = figure(parent) if parent in freed else None
+      if parent_usage:
+        freed[parent] += max(
+            0, parent_usage.shared_child - usage.shared_child)
+      for child in list(freed):
+        child_usage = (figure(child) if index.get(child).parent == name
+                       else None)
+        if child_usage:
+          freed[name] += max(0, usage.shared_child - child_usage.shared_child)
+
+    return freed
+
+  def store_inodes(self):
+    """
+    The inodes of the sink's dedup store, see dedup.Store.inodes().
+
+    Returns:
+        set of int: Inode numbers.
+    """
+    from emu import dedup
+
+    return dedup.Store(self.path).inodes()
+
+  @property
+  def manifests_dir(self):
+    return os.path.join(self.path, ".emu", "manifests")
+
+  @property
+  def trash_dir(self):
+    return os.path.join(self.path, ".emu", "trash")
+
+  def trash(self, path, size=None):
+    """
+    Move a snapshot tree into the sink's trash.
+
+    This is a single rename, so it is fast regardless of the size of
+    the tree. Symbolic links are deleted immediately. The number of
+    bytes which deleting the tree will free is recorded alongside it,
+    see pending_trash_space.
 
-      snapshot = parent
+    Arguments:
+        path (str): Path of the tree to trash.
+        size (int, optional): The number of bytes which deleting the
+          tree will free. If not provided, nothing is recorded, and
+          the tree is measured by pending_trash_space when needed.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+      Util.rm(path, must_exist=True, error=True)
+      return
+
+    Util.mkdir(self.trash_dir, mode=0o700, error=True)
+    name = os.path.basename(path)
+    dst = os.path.join(self.trash_dir, name)
+    i = 0
+    while os.path.lexists(dst):
+      i += 1
+      dst = os.path.join(self.trash_dir, f"{name}.{i}")
+
+    # Record the size before the tree becomes visible to reapers:
+    if size is not None:
+      Util.write(dst + self.TRASH_SIZE_SUFFIX, f"{size}\n")
+
+    try:
+      os.rename(path, dst)
+      io.verbose("Trashed '{0}'".format(path))
+    except OSError as e:
+      Util.rm(dst + self.TRASH_SIZE_SUFFIX, must_exist=False)
+      io.fatal("Failed to move '{0}' to trash. {1}"
+               .format(colourise(path, Colours.ERROR), e))
+
+  def empty_trash(self, dry_run=False):
+    """
+    Delete the contents of the sink's trash.
 
-    # delete snapshots, starting with the oldest, until at least 5% of the
-    # space on the drive is available
-    while len(list(self.snapshots())) > 1 and self.free_space_ratio < .05:
-      snapshot = self.tail()
-      print(f"available space is {self.free_space_ratio:.0%}, " +
-            f"removing {snapshot}")
-      snapshot.destroy(dry_run=dry_run, force=force)
+    Trash entries are claimed by renaming them before deletion, so
+    that concurrent reapers don't collide. Entries claimed by a
+    process which is no longer running are resumed.
+
+    Arguments:
+        dry_run (bool, optional): If True, don't make any actual changes.
+
+    Returns:
+        int: The number of trash entries deleted.
+    """
+    from emu import dedup
+
+    prefix = ".reaping-"
+    claim = f"{prefix}{os.getpid()}-"
+    count = 0
+
+    for name in Util.ls(self.trash_dir):
+      path = os.path.join(self.trash_dir, name)
+      if name.endswith(self.TRASH_SIZE_SUFFIX):
+        continue
+
+      if name.startswith(prefix):
+        pid, _, entry = name[len(prefix):].partition("-")
+        if (pid.isdigit() and int(pid) != os.getpid() and
+            isprocess(int(pid))):
+          continue  # Owned by a running reaper.
+        name = entry
 
-      # break manually on a dry-run to prevent infinite loop:
       if dry_run:
-        break
+        io.printf("Would delete trash '{0}'".format(name))
+        continue
+
+      claimed = os.path.join(self.trash_dir, claim + name)
+      try:
+        os.rename(path, claimed)
+      except FileNotFoundError:
+        continue  # Claimed by another reaper.
+
+      Util.rm(claimed, error=True, jobs=self.removal_jobs)
+      Util.rm(os.path.join(self.trash_dir, name + self.TRASH_SIZE_SUFFIX))
+      self._trash_sizes.pop(name, None)
+      count += 1
+      io.verbose("Deleted trash '{0}'".format(name))
+
+    # Remove store entries which were only linked from deleted trees:
+    if count:
+      dedup.Store(self.path).sweep()
+
+    return count
+
+  @property
+  def removal_jobs(self):
+    """
+    The number of threads used to delete snapshot trees.
+
+    Set by the "jobs" property of the "Trash" section of the sink
+    config.
+    """
+    from emu import removal
+
+    return self.config.getint("Trash", "jobs",
+                              fallback=removal.DEFAULT_JOBS)
+
+  @property
+  def dedup_enabled(self):
+    """
+    Whether new files are deduplicated against the sink's
+    content-addressed store.
+
+    Set by the "enabled" property of the "Dedup" section of the sink
+    config.
+    """
+    return self.config.getboolean("Dedup", "enabled", fallback=False)
+
+  @property
+  def transfer_engine(self):
+    """
+    The engine used to transfer files to the sink, either "rsync" or
+    "native".
+
+    Set by the "engine" property of the "Transfer" section of the sink
+    config. The native engine only supports sinks on the same host as
+    the source.
+    """
+    engine = self.config.get("Transfer", "engine", fallback="rsync")
+    if engine not in ["rsync", "native"]:
+      io.fatal("{}: unknown transfer engine '{}'".format(self.name, engine))
+    return engine
+
+  @property
+  def link_dest_policy(self):
+    """
+    The policy used to select link destinations, one of
+    linkdest.POLICIES.
+
+    Set by the "link-dest" property of the "Transfer" section of the
+    sink config.
+    """
+    from emu import linkdest
+
+    policy = self.config.get("Transfer", "link-dest",
+                             fallback=linkdest.DEFAULT_POLICY)
+    if policy not in linkdest.POLICIES:
+      io.fatal("{}: unknown link-dest policy '{}'".format(self.name, policy))
+    return policy
+
+  @property
+  def link_dest_max(self):
+    """
+    The maximum number of link destinations of a push.
+
+    Set by the "link-dest-max" property of the "Transfer" section of
+    the sink config.
+    """
+    from emu import linkdest
+
+    return self.config.getint("Transfer", "link-dest-max",
+                              fallback=linkdest.DEFAULT_MAX)
+
+  @property
+  def log_path(self):
+    """
+    The path of the log of rsync output for pushes to the sink.
+    """
+    return os.path.join(self.source.path, ".emu", "logs", self.name + ".log")
+
+  @property
+  def status_path(self):
+    """
+    The path of the status file of a push to the sink.
+    """
+    return os.path.join(self.path, ".emu", "progress")
+
+  @property
+  def status(self):
+    """
+    The status of the push to the sink which is in progress, or None.
+    """
+    from emu import progress
+
+    return progress.Status.read(self.status_path)
+
+  def rsync_output(self, status=None):
+    """
+    Create a consumer of rsync output for a push to the sink.
+
+    The interval between summary lines is set by the
+    "summary-interval" property of the "Transfer" section of the sink
+    config.
+
+    Arguments:
+        status (progress.Status, optional): Status to publish the
+          progress of the transfer to.
+
+    Returns:
+        progress.RsyncOutput: Output consumer.
+    """
+    from emu import progress
+
+    interval = self.config.getfloat("Transfer", "summary-interval",
+                                    fallback=progress.SUMMARY_INTERVAL)
+    return progress.RsyncOutput(self.name, self.log_path, interval=interval,
+                                status=status)
+
+  def transfer(self, src, dst, paths=None, link_dest=None, archive=True,
+               owner=True, exclude=None, exclude_from=None, dry_run=False,
+               error=False, status=None):
+    """
+    Transfer a directory tree to the sink using the sink's engine.
+
+    Arguments:
+        src (str): Source directory.
+        dst (str): Destination directory.
+        paths (list of str, optional): If provided, transfer only these
+          paths, relative to 'src', into an existing destination.
+          Otherwise, extraneous and excluded files are deleted from the
+          destination.
+        link_dest (list of str, optional): Directories to hardlink
+          unchanged files from.
+        status (progress.Status, optional): Status to publish the
+          progress of an rsync transfer to.
+
+    Returns:
+        transfer.TransferStats or transfer.RsyncStats: Statistics of
+          the transfer.
+    """
+    from emu import transfer
+
+    if self.transfer_engine == "native":
+      jobs = self.config.getint("Transfer", "jobs",
+                                fallback=transfer.DEFAULT_JOBS)
+      return Util.transfer(src, dst, paths=paths, link_dest=link_dest,
+                           archive=archive, owner=owner, exclude=exclude,
+                           exclude_from=exclude_from, delete=paths is None,
+                           dry_run=dry_run, jobs=jobs, error=error)
+
+    def _rsync(**kwargs):
+      # The changes of a dry run are shown rather than logged:
+      if dry_run:
+        stats = transfer.RsyncStats()
+        stats.elapsed = Util.rsync(src + "/", dst, dry_run=True, **kwargs)
+        return stats
+      return Util.rsync(src + "/", dst, output=self.rsync_output(status),
+                        **kwargs)
+
+    if paths is None:
+      return _rsync(archive=archive, owner=owner, link_dest=link_dest,
+                    exclude=exclude, exclude_from=exclude_from,
+                    delete=True, delete_excluded=True, error=error)
+
+    import tempfile
+
+    with tempfile.NamedTemporaryFile("w", prefix="emu-files-from-",
+                                     suffix=".txt") as files_from:
+      for path in paths:
+        # Prefix paths so that none are read as comments:
+        print("./" + path, file=files_from)
+      files_from.flush()
+
+      return _rsync(archive=archive, owner=owner, link_dest=link_dest,
+                    exclude=exclude, exclude_from=exclude_from,
+                    args=["--files-from", files_from.name,
+                          "--ignore-missing-args"],
+                    error=error)
+
+  def empty_trash_in_background(self):
+    """
+    Empty the sink's trash in a background thread.
+
+    The thread is not a daemon, so the process waits for it to
+    complete before exiting.
+
+    Returns:
+        threading.Thread: The reaper thread.
+    """
+    thread = threading.Thread(target=self.empty_trash,
+                              name=f"emu-reaper-{self.name}")
+    thread.start()
+    self.reaper = thread
+    return thread
+
+  @property
+  def pending_trash_space(self):
+    """
+    The number of bytes which will be freed by emptying the trash.
+
+    The size of each trash entry is recorded when it is trashed.
+    Entries without a recorded size are measured once, counting only
+    the files which are not hardlinked from outside of the trash.
+    """
+    prefix = ".reaping-"
+    total = 0
+    for entry in Util.ls(self.trash_dir):
+      if entry.endswith(self.TRASH_SIZE_SUFFIX):
+        continue
+      # Entries which are being deleted are claimed by renaming them:
+      name = entry
+      if name.startswith(prefix):
+        name = name[len(prefix):].partition("-")[2]
+
+      if name not in self._trash_sizes:
+        try:
+          size = int(Util.read(
+              os.path.join(self.trash_dir, name + self.TRASH_SIZE_SUFFIX),
+              error=False))
+        except (OSError, ValueError):
+          size = Util.du(os.path.join(self.trash_dir, entry),
+                         exclusive=True, store=self.store_inodes())
+        self._trash_sizes[name] = size
+      total += self._trash_sizes[name]
+    return total
 
   @property
   def used_space_on_device(self):
     statvfs = os.statvfs(self.path)
-    return (statvfs.f_blocks - statvfs.f_bavail) * statvfs.f_bsize
+    return ((statvfs.f_blocks - statvfs.f_bavail) * statvfs.f_bsize -
+            self.pending_trash_space)
 
   @property
   def free_space_on_device(self):
     statvfs = os.statvfs(self.path)
-    return statvfs.f_bavail * statvfs.f_bsize
+    return statvfs.f_bavail * statvfs.f_bsize + self.pending_trash_space
 
   @property
   def free_space_ratio(self):
     statvfs = os.statvfs(self.path)
-    return statvfs.f_bavail / statvfs.f_blocks
+    pending_blocks = self.pending_trash_space / statvfs.f_bsize
+    return (statvfs.f_bavail + pending_blocks) / statvfs.f_blocks
 
   @property
   def device_capacity(self):
@@ -821,19 +1500,26 @@ class Sink:
   @property
   def is_inprogress(self):
     """ return true if new snapshot is in progress """
-    return os.path.exists(
-        os.path.join(self.path, ".emu", "new")) and self.lock.islocked
+    return (os.path.exists(os.path.join(self.path, "new")) and
+            self.lock.islocked and not self.lock.isstale)
 
   def push(self, force=False, ignore_errors=False, archive=True,
-           owner=False, dry_run=False):
+           owner=False, dry_run=False, full=False):
 
+    rotate_start = time.time()
     self.rotate(force=force, dry_run=dry_run)
+    timings = {"rotate": time.time() - rotate_start}
+
+    # Delete rotated snapshots while the transfer runs:
+    if not dry_run:
+      self.empty_trash_in_background()
 
     prefix = colourise(self.name, Colours.OK)
     io.printf(f"{prefix}: pushing snapshot")
 
     Snapshot.create(self, force=force, ignore_errors=ignore_errors,
-                    archive=archive, owner=owner, dry_run=dry_run)
+                    archive=archive, owner=owner, dry_run=dry_run, full=full,
+                    timings=timings)
 
     return 0
 
@@ -875,6 +1561,28 @@ class Sink:
         io.printf("Deleted orphan node file '{0}'"
                   .format(colourise(path, Colours.RED)))
 
+    # Check for orphan manifests:
+    nodes = Util.ls(os.path.join(self.path, ".emu", "nodes"))
+    for f in Util.ls(self.manifests_dir):
+      if f not in nodes:
+        path = os.path.join(self.manifests_dir, f)
+
+        if not dry_run:
+          Util.rm(path, must_exist=True)
+        io.printf("Deleted orphan manifest '{0}'"
+                  .format(colourise(path, Colours.RED)))
+
+    # Delete trashed snapshot trees:
+    self.empty_trash(dry_run=dry_run)
+
+    # Rebuild the snapshot index from the node files:
+    if not dry_run:
+      self.index.rebuild()
+      io.verbose("Rebuilt snapshot index '{}'".format(self.index.path))
+
+    # Recompute stale disk usage, now that the trash is empty:
+    self.update_usage(dry_run=dry_run)
+
     # Delete broken symlinks in sink:
     for f in Util.ls(self.path):
       path = "{0}/{1}".format(self.path, f)
@@ -896,6 +1604,56 @@ class Sink:
     io.printf("Sink {0} is clean."
               .format(colourise(self.name, Colours.BLUE)))
 
+  def update_usage(self, dry_run=False):
+    """
+    Recompute the disk usage of snapshots whose figures are stale.
+
+    Each stale snapshot tree is walked once, and compared against its
+    parent's manifest.
+
+    Arguments:
+        dry_run (bool, optional): If True, don't make any actual changes.
+
+    Returns:
+        int: The number of snapshots updated.
+    """
+    from emu import usage
+
+    stale = [s for s in self.snapshots() if os.path.isdir(s.tree) and
+             s.usage is not None and s.usage.stale]
+    store = self.store_inodes() if stale else ()
+
+    for snapshot in stale:
+      io.verbose("Updating disk usage of snapshot {}"
+                 .format(colourise(snapshot.name, Colours.SNAPSHOT)))
+      if dry_run:
+        continue
+
+      parent = snapshot.parent()
+      accounting = usage.account(
+          snapshot.tree, usage.entries(parent) if parent else None,
+          store=store)
+      usage.write(snapshot.node, accounting.usage(
+          shared_child=snapshot.usage.shared_child)._replace(stale=True))
+      snapshot.node.flush()
+
+    # Shared sizes are symmetric, so fill in the parents' figures once
+    # all of the children are up to date:
+    for snapshot in stale:
+      if dry_run:
+        continue
+      children = self.index.children(snapshot.name)
+      child_usage = None
+      if children:
+        child = Snapshot(SnapshotID(self.name, children[-1]), self)
+        child_usage = child.usage
+      shared_child = child_usage.shared_parent if child_usage else 0
+      usage.write(snapshot.node, snapshot.usage._replace(
+          shared_child=shared_child, stale=False))
+      snapshot.node.flush()
+
+    return len(stale)
+
   def __str__(self):
     return "{0}  {1}".format(self.name, self.path)
 
@@ -977,54 +1735,101 @@ class Sink:
 # Source snapshot class #
 #########################
 class Snapshot:
+  """
+  A lightweight, immutable handle to a snapshot.
+
+  Creating a snapshot handle performs no I/O. Metadata which is
+  recorded in the sink index (such as the parent) is read from there,
+  and the node file is only parsed when the node is accessed.
+  """
+
+  __slots__ = ("id", "sink", "_node")
 
   def __init__(self, id: 'SnapshotID', sink: Sink):
+    object.__setattr__(self, "id", id)
+    object.__setattr__(self, "sink", sink)
 
-    def err_cb(e):
-      io.fatal("Non-existent or malformed snapshot '{0}'".format(self.id))
+  def __setattr__(self, name, value):
+    raise AttributeError("Snapshot is immutable")
 
-    node_path = os.path.join(sink.path, ".emu", "nodes", id.snapshot_name)
-    Util.readable(node_path, error=err_cb)
+  @property
+  def name(self):
+    return self.id.snapshot_name
 
-    self.id = id
-    self.sink = sink
+  @property
+  def tree(self):
+    return os.path.join(self.sink.path, self.id.snapshot_name)
 
-    self.node = Node(node_path)
-    self.name = self.node.name()
+  @property
+  def node(self):
+    """
+    The snapshot's node, parsed on first access.
+    """
+    try:
+      return self._node
+    except AttributeError:
 
-    # Temporary sanity check until the id==name refactor is complete:
-    if self.name != self.id.snapshot_name:
-      print(f"WTF {self.name} != {self.id.snapshot_name}")
-      sys.exit(100)
+      def err_cb(e):
+        io.fatal("Non-existent or malformed snapshot '{0}'".format(self.id))
 
-    self.tree = os.path.join(sink.path, self.name)
+      node_path = os.path.join(self.sink.path, ".emu", "nodes", self.name)
+      Util.readable(node_path, error=err_cb)
+      object.__setattr__(self, "_node", Node.cached(node_path))
+      return self._node
 
-    # Sanity checks:
-    Util.readable(self.tree, error=err_cb)
+  @property
+  def manifest(self):
+    """
+    The snapshot's manifest of files.
+
+    Returns:
+        manifest.Manifest: Manifest.
+    """
+    from emu import manifest
+
+    return manifest.Manifest(self.sink.manifests_dir, self.name)
+
+  @property
+  def usage(self):
+    """
+    The snapshot's disk usage, as recorded when it was created.
+
+    Returns:
+        usage.Usage: Usage, or None if it was not recorded.
+    """
+    from emu import usage
+
+    return usage.read(self.node)
+
+  @property
+  def entry(self):
+    """
+    The snapshot's sink index entry, or None if not indexed.
+    """
+    return self.sink.index.get(self.name)
 
   def nth_parent(self, n, truncate=False, error=False):
     """
     Return the nth parent of snapshot
 
-    Traverse each snapshot's parent until we have travelled 'n' nodes from
-    the starting point.
+    Resolved using the sink's ancestry, without reading any node files.
 
     Returns:
         Snapshot: nth parent.
     """
-    parent = self.parent()
-
     try:
       if n > 0:
-        if parent:
-          return parent.nth_parent(n - 1, truncate=truncate,
-                                   error=error)
+        ancestry = self.sink.index.ancestry()
+        name = ancestry.nth_parent(self.name, n)
+        if name:
+          return Snapshot(SnapshotID(self.sink.name, name), self.sink)
         elif not truncate:
           id = SnapshotID(self.sink.name,
                           self.id.snapshot_name + Util.n_index_to_tilde(n))
           raise SnapshotNotFoundError(id)
         else:
-          return self
+          return Snapshot(SnapshotID(self.sink.name,
+                                     ancestry.root(self.name)), self.sink)
       else:
         return self
 
@@ -1045,54 +1850,38 @@ class Snapshot:
     Returns:
         Iterable: Snapshots from newest to oldest
     """
-    node = self
-    while node:
-      yield node
-      node = node.parent()
+    for name in self.sink.index.ancestry().ancestors(self.name):
+      yield Snapshot(SnapshotID(self.sink.name, name), self.sink)
 
   def nth_child(self, n, truncate=False, error=False):
     """
     Return the nth child of snapshot
 
-    Traverse each snapshot's child until we have travelled 'n' nodes from
-    the starting point.
+    Resolved using the sink's ancestry, without reading any node files.
+    The snapshot must be in the branch of the sink's HEAD.
 
     Returns:
         Snapshot: nth child of snapshot.
     """
-    head = self.sink.head()
+    index = self.sink.index
 
-    if not head:
+    if not len(index):
       id = SnapshotID(self.sink.name, "HEAD")
       raise SnapshotNotFoundError(id)
 
-    branch = list(head.branch())
-
-    # Iterate over snapshots in order to get the index of self:
-    index_of_self = None
-    i = 0
-    for snapshot in branch:
-      if snapshot == self:
-        index_of_self = i
-        break
-      else:
-        i += 1
-
-    try:
-      if index_of_self == None:
-        # If we have no "index_of_self", then the snapshot is not
-        # in the branch:
-        raise SnapshotNotFoundError(self.id)
+    ancestry = index.ancestry()
 
-      if n >= len(branch):
-        # Out of range check:
-        raise IndexError
+    if ancestry.depth(self.name) is None:
+      # The snapshot is not in the branch:
+      raise SnapshotNotFoundError(self.id)
 
-      return branch[index_of_self - n]
-    except IndexError:
+    name = ancestry.nth_child(self.name, n)
+    if not name:
       id = SnapshotID(self.sink.name, "TAIL~{0}".format(n))
       raise SnapshotNotFoundError(id)
 
+    return Snapshot(SnapshotID(self.sink.name, name), self.sink)
+
   def parent(self, value=None, delete=False):
     """
     Get/set snapshot's parent.
@@ -1102,7 +1891,8 @@ class Snapshot:
     elif delete:
       self.node.parent(value="")
     else:
-      parent_id = self.node.parent()
+      entry = self.entry
+      parent_id = entry.parent if entry else self.node.parent()
 
       if parent_id:
         return Snapshot(SnapshotID(self.sink.name, parent_id), self.sink)
@@ -1116,45 +1906,7 @@ class Snapshot:
     If 'dry_run' is True, don't make any actual changes. If 'force' is
     True, ignore locks.
     """
-    io.printf("{}: removing snapshot {}".format(
-        colourise(self.sink.name, Colours.OK),
-        colourise(self.name, Colours.SNAPSHOT_DELETE))
-    )
-
-    sink = self.sink
-
-    # We don't actually need to modify anything on a dry run:
-    if dry_run:
-      return
-
-    with sink.lock.acquire(replace_stale=True, force=force):
-
-      # If current snapshot is HEAD, then set parent HEAD:
-      head = sink.head()
-      if head and head.id == self.id:
-        Util.rm(os.path.join(sink.path, "Latest"))
-
-        if len(self.sink.snapshot_names()) >= 2:
-          new_head = Snapshot(
-              SnapshotID(sink.name, self.sink.snapshot_names()[-2]), sink)
-          Util.ln_s(new_head.name, os.path.join(sink.path, "Latest"))
-
-      # Re-allocate parent references from all other snapshots:
-      new_parent = self.parent()
-      for snapshot in sink.snapshots():
-        parent = snapshot.parent()
-        if parent and parent.id == self.id:
-          if new_parent:
-            snapshot.parent(value=new_parent)
-          else:
-            snapshot.parent(delete=True)
-
-      # Delete snapshot files:
-      Util.rm(os.path.join(sink.path, self.name),
-              must_exist=True, error=True)
-      Util.rm(self.tree, must_exist=True, error=True)
-      Util.rm(f"{sink.path}/.emu/nodes/{self.id.snapshot_name}",
-              must_exist=True, error=True)
+    self.sink.remove_snapshots([self], dry_run=dry_run, force=force)
 
   @property
   def date(self):
@@ -1193,20 +1945,62 @@ class Snapshot:
     except AttributeError:
       return False
 
-  def __le__(self, other):
-    try:
-      return self.id <= other.id
-    except AttributeError:
-      return False
+  def __le__(self, other):
+    try:
+      return self.id <= other.id
+    except AttributeError:
+      return False
+
+  # journal_changes() - Look up the source changes since a sink's HEAD
+  #
+  # Returns a tuple of the changed paths, or None if the source must
+  # be scanned in full, and the journal position to record in the new
+  # snapshot, or None if no watcher is running.
+  @staticmethod
+  def journal_changes(sink, full=False):
+    from emu import journal
+
+    src_journal = journal.Journal(sink.source.path)
+    head = sink.head()
+
+    if full or head is None or not os.path.isdir(head.tree):
+      return src_journal.since()
+
+    node = head.node
+    if not node.has_section("Journal"):
+      return src_journal.since()
+
+    # Changes to excludes are not recorded in the journal:
+    excludes = os.path.join(sink.source.path, ".emu", "excludes")
+    if str(os.stat(excludes).st_mtime_ns) != node.get("Journal", "excludes"):
+      io.verbose("journal: excludes have changed")
+      return src_journal.since()
+
+    return src_journal.since(node.get("Journal", "generation"),
+                             node.getint("Journal", "offset"))
 
   # create() - Create a new snapshot
   #
   # If 'force' is True, ignore locks. If 'dry_run' is True, don't
   # make any actual changes. If 'resume' is True then don't perform
-  # the file transfer from source to staging area.
+  # the file transfer from source to staging area. If 'full' is True,
+  # scan the entire source even if a journal of changes is available.
+  # The elapsed time of each phase is added to the 'timings' dict, and
+  # recorded in the new node along with the transfer statistics.
   @staticmethod
   def create(sink, resume=False, transfer_from_source=True, force=False,
-             ignore_errors=False, archive=True, owner=True, dry_run=False):
+             ignore_errors=False, archive=True, owner=True, dry_run=False,
+             full=False, timings=None):
+    import getpass
+
+    import humanize
+
+    from emu import dedup
+    from emu import journal
+    from emu import linkdest
+    from emu import manifest
+    from emu import progress
+    from emu import usage
 
     # If two snapshots are created in the same second then their IDs will be
     # identical. To prevent this, we need to wait until the timestamp will
@@ -1216,13 +2010,12 @@ class Snapshot:
       date = Date()
       id = SnapshotID(sink.name, date.snapshotfmt())
 
-      try:
-        # See if a snapshot with that ID already exists:
-        Util.get_snapshot_by_id(id, sink.snapshots())
+      # See if a snapshot with that ID already exists:
+      if id.snapshot_name in sink.index:
         # If id does, wait for a bit and try again:
         time.sleep(0.5)
         return _get_unique_id()
-      except SnapshotNotFoundError:
+      else:
         # If the ID is unique, return it:
         return (id, date)
 
@@ -1251,10 +2044,19 @@ class Snapshot:
     exclude = ["/.emu"]
     exclude_from = [os.path.join(source.path, ".emu", "excludes")]
     link_dests = []
-
-    # lock the sink and source
-    with source.lock.acquire(replace_stale=True, force=force):
-      with sink.lock.acquire(replace_stale=True, force=force):
+    link_dest_names = []
+    journal_position = None
+    transfer_stats = None
+    timings = {} if timings is None else timings
+    # Publish the progress of the push, for the monitor:
+    status = progress.Status(None if dry_run else sink.status_path, sink.name)
+
+    # Lock the sink. The source lock is shared, so that snapshots can
+    # be pushed to multiple sinks concurrently:
+    lock_start = time.time()
+    with source.lock.acquire(replace_stale=True, force=force, shared=True):
+      with sink.lock.acquire(replace_stale=True, force=force), status:
+        timings["lock"] = time.time() - lock_start
 
         # Ignore rsync errors if required:
         if ignore_errors:
@@ -1262,66 +2064,194 @@ class Snapshot:
         else:
           rsync_error = err_cb
 
+        changes = None
         if not resume:
-          # Use up to 20 of the most recent snapshots as link
-          # destinations:
-          for snapshot in list(sink.snapshots())[-20:]:
-            link_dests.append(snapshot.tree)
+          changes, journal_position = Snapshot.journal_changes(sink, full)
+          excludes_mtime = os.stat(exclude_from[0]).st_mtime_ns
+
+          if changes is not None:
+            # Transfer only the changed paths with HEAD as the link
+            # destination, on top of a hardlinked clone of the rest of
+            # HEAD which is made from its manifest:
+            io.verbose("{}: incremental push of {} changed paths"
+                       .format(colourise(sink.name, Colours.INFO),
+                               len(changes)))
+            head = sink.head()
+            if not dry_run:
+              journal.stage(head.tree, staging_area, changes,
+                            entries=usage.entries(head))
+            link_dest_names = [head.name]
+          else:
+            # Use the snapshots most likely to hold unchanged files as
+            # link destinations:
+            link_dest_names = linkdest.select(
+                sink.index.ancestry().branch, sink.path,
+                policy=sink.link_dest_policy, max=sink.link_dest_max)
+          link_dests = [os.path.join(sink.path, name)
+                        for name in link_dest_names]
 
           # Perform file transfer:
-          transfer_time = Util.rsync(source.path + "/",
-                                     staging_area, archive=archive,
-                                     owner=owner, dry_run=dry_run,
-                                     link_dest=link_dests, exclude=exclude,
-                                     exclude_from=exclude_from, delete=True,
-                                     delete_excluded=True, error=rsync_error)
+          status.update(phase="transfer")
+          transfer_stats = sink.transfer(source.path, staging_area,
+                                         paths=changes, archive=archive,
+                                         owner=owner, dry_run=dry_run,
+                                         link_dest=link_dests,
+                                         exclude=exclude,
+                                         exclude_from=exclude_from,
+                                         error=rsync_error, status=status)
+          timings["transfer"] = transfer_stats.elapsed
 
           # Print "transfer complete" message:
-          if transfer_time > 10:
+          if transfer_stats.elapsed > 10:
             io.printf("{}: file transfer complete ({:.2f}s), "
                       "creating snapshot."
                       .format(colourise(sink.name, Colours.INFO),
-                              transfer_time))
+                              transfer_stats.elapsed))
 
         # Assert that we have a staging area to work with:
         if not dry_run:
           Util.readable(staging_area, error=err_cb)
 
+        # Link new files to identical files in previous snapshots:
+        dedup_stats = None
+        if not dry_run and sink.dedup_enabled:
+          jobs = sink.config.getint("Dedup", "jobs",
+                                    fallback=dedup.DEFAULT_JOBS)
+          dedup_start = time.time()
+          status.update(phase="dedup")
+          dedup_stats = dedup.Store(sink.path).dedup(
+              staging_area, jobs=jobs, paths=changes)
+          timings["dedup"] = time.time() - dedup_start
+          if dedup_stats.linked:
+            io.printf("{}: deduplicated {} files, saving {}"
+                      .format(colourise(sink.name, Colours.INFO),
+                              dedup_stats.linked,
+                              humanize.naturalsize(dedup_stats.bytes_saved)))
+
         id, date = _get_unique_id()
         name = date.snapshotfmt()
         tree = os.path.join(sink.path, name)
 
         if not dry_run:
           # Move tree into position
+          move_start = time.time()
+          status.update(phase="move")
           Util.mv(staging_area, tree, must_exist=True, error=err_cb)
+          timings["move"] = time.time() - move_start
 
         # Get parent node ID:
-        if sink.head():
-          head_id = sink.head().id.snapshot_name
-        else:
-          head_id = ""
+        index = sink.index
+        head_id = index.head() or ""
 
         if not dry_run:
+          # Record the contents and disk usage of the new snapshot. If
+          # it was staged from HEAD, then only the changed paths are
+          # walked, provided that HEAD's manifest and usage are
+          # complete. Otherwise the whole tree is walked:
+          head = sink.head()
+          head_usage = head.usage if head else None
+          store = sink.store_inodes()
+          if (changes is not None and head.manifest.exists and
+              head_usage and head_usage.directories is not None and
+              not head_usage.stale):
+            accounting = usage.Delta(head.tree, head_usage,
+                                     usage.entries(head), changes,
+                                     store=store)
+          else:
+            changes = None
+            accounting = usage.Accounting(
+                usage.entries(head) if head else None, store=store)
+          hit_counter = linkdest.HitCounter(link_dest_names, sink.path)
+          manifest_start = time.time()
+          status.update(phase="manifest")
+          try:
+            summary = manifest.Manifest(sink.manifests_dir, name).write(
+                tree, parent=head_id or None, changes=changes,
+                observers=[accounting, hit_counter, status])
+          except (OSError, ValueError) as e:
+            io.warning("{}: failed to write manifest: {}"
+                       .format(sink.name, e))
+            summary = None
+          timings["manifest"] = time.time() - manifest_start
+
+          if summary:
+            for dest, hits, size in hit_counter.items():
+              io.verbose("{}: linked {} files ({}) from {}"
+                         .format(sink.name, hits, humanize.naturalsize(size),
+                                 dest))
+
           # Create node:
+          node_start = time.time()
+          status.update(phase="node")
           node_path = "{0}/.emu/nodes/{1}".format(sink.path, id.snapshot_name)
-          node = _ConfigParser()
+          node = Node.new(node_path)
           node.add_section("Snapshot")
           node.set("Snapshot", "snapshot", id.snapshot_name)
           node.set("Snapshot", "parent", str(head_id))
           node.set("Snapshot", "name", str(name))
           node.set("Snapshot", "date", str(date))
           node.add_section("Tree")
+          if summary:
+            for option, value in summary.items():
+              node.set("Tree", option, str(value))
           node.add_section("Sink")
           node.set("Sink", "source", str(sink.source.path))
           node.set("Sink", "sink", str(id.sink_name))
           node.set("Sink", "path", str(sink.path))
-          node.set("Sink", "snapshot-no", str(len(list(sink.snapshots())) + 1))
+          snapshot_no = len(index) + 1
+          node.set("Sink", "snapshot-no", str(snapshot_no))
           node.add_section("Emu")
           node.set("Emu", "emu-version", str(Meta.version))
           node.set("Emu", "user", str(getpass.getuser()))
           node.set("Emu", "uid", str(os.getuid()))
-          with open(node_path, "w") as node_file:
-            node.write(node_file)
+          if dedup_stats:
+            node.add_section("Dedup")
+            node.set("Dedup", "files", str(dedup_stats.files))
+            node.set("Dedup", "linked", str(dedup_stats.linked))
+            node.set("Dedup", "bytes-saved", str(dedup_stats.bytes_saved))
+          if summary:
+            usage.write(node, accounting.usage())
+          if summary and link_dest_names:
+            node.add_section("LinkDest")
+            node.set("LinkDest", "dests", " ".join(hit_counter.names))
+            node.set("LinkDest", "hits",
+                     " ".join(str(h) for h in hit_counter.hits))
+            node.set("LinkDest", "bytes",
+                     " ".join(str(b) for b in hit_counter.bytes))
+          if journal_position:
+            # Record the changes included in the snapshot:
+            node.add_section("Journal")
+            node.set("Journal", "generation", journal_position[0])
+            node.set("Journal", "offset", str(journal_position[1]))
+            node.set("Journal", "excludes", str(excludes_mtime))
+          if transfer_stats:
+            node.add_section("Stats")
+            for option, value in transfer_stats.items():
+              node.set("Stats", option, str(value))
+
+          # Files shared with the new snapshot are no longer exclusive
+          # to its parent:
+          if summary and head_usage:
+            usage.write(head.node, head_usage._replace(
+                exclusive=max(0, head_usage.exclusive -
+                              accounting.parent_exclusive),
+                shared_child=accounting.shared_parent))
+            head.node.flush()
+
+          index.add(IndexEntry(name=id.snapshot_name, parent=head_id,
+                               date=int(time.mktime(date.date)),
+                               snapshot_no=snapshot_no, status="clean"))
+          timings["node"] = time.time() - node_start
+
+          # Record the phase timings, now that they are all known, and
+          # write the node once. Flushing it shares the parser with
+          # readers of the node. The index must be written after the
+          # node file:
+          node.add_section("Timings")
+          for phase, elapsed in timings.items():
+            node.set("Timings", phase, "{:.3f}".format(elapsed))
+          node.flush()
+          index.flush()
 
     io.printf("{}: new snapshot {}".format(
         colourise(sink.name, Colours.OK),
@@ -1339,52 +2269,57 @@ class Snapshot:
 # Unique global snapshot identifier #
 #####################################
 class SnapshotID:
+  """
+  An immutable (sink, snapshot) name pair.
+
+  Sink names are interned, so that the many IDs created when
+  iterating over a sink share a single string.
+  """
+
+  __slots__ = ("sink_name", "snapshot_name", "_key")
+
   def __init__(self, sink_name: str, snapshot_name: str):
-    self.sink_name = str(sink_name)
-    self.snapshot_name = str(snapshot_name)
+    sink_name = sys.intern(str(sink_name))
+    snapshot_name = str(snapshot_name)
+    object.__setattr__(self, "sink_name", sink_name)
+    object.__setattr__(self, "snapshot_name", snapshot_name)
+    object.__setattr__(self, "_key", (sink_name, snapshot_name))
+
+  def __setattr__(self, name, value):
+    raise AttributeError("SnapshotID is immutable")
 
   def __repr__(self):
     return self.sink_name + ":" + self.snapshot_name
 
   def __key__(self):
-    return (self.sink_name, self.snapshot_name)
+    return self._key
 
   def __hash__(self):
-    return hash(self.__key__())
+    return hash(self._key)
 
   # Snapshot IDs can be compared using the standard operators. Snapshots
   # are first sorted alphabetically by sink, then chronologically by timestamp.
 
   def __eq__(self, other):
-    if other.snapshot_name:
-      return self.snapshot_name == other.snapshot_name and self.sink_name == other.sink_name
-    else:
+    try:
+      return self._key == other._key
+    except AttributeError:
       return False
 
   def __ne__(self, other):
     return not self.__eq__(other)
 
   def __gt__(self, other):
-    # If snapshots have same sink, sort chronologically:
-    if self.sink_name == other.sink_name:
-      return self.snapshot_name > other.snapshot_name
-    # Else sort alphabetically:
-    else:
-      sinks = [self.sink_name, other.sink_name]
-      sinks.sort()
-      if sinks[0] == self.sink_name:
-        return True
-      else:
-        return False
+    return self._key > other._key
 
   def __ge__(self, other):
-    return self.__gt__(other) or self.__eq__(other)
+    return self._key >= other._key
 
   def __lt__(self, other):
-    return not self.__ge__(other)
+    return self._key < other._key
 
   def __le__(self, other):
-    return self.__lt__(other) or self.__eq__(other)
+    return self._key <= other._key
 
 
 #################################
@@ -1447,6 +2382,27 @@ class Version:
     return Version(major, minor, micro)
 
 
+class _Resource:
+  """
+  A class attribute holding the path of a package resource. The path
+  is looked up on first access, and then replaces the attribute.
+  """
+
+  def __init__(self, name):
+    self.name = name
+
+  def __set_name__(self, owner, attr):
+    self.attr = attr
+
+  def __get__(self, instance, owner):
+    import importlib.resources
+
+    path = os.path.abspath(
+        str(importlib.resources.files(__name__).joinpath(self.name)))
+    setattr(owner, self.attr, path)
+    return path
+
+
 ######################
 # Emu metadata class #
 ######################
@@ -1460,9 +2416,9 @@ class Meta:
   #
   # Template paths:
   #
-  templates = resource_filename(__name__, "templates/")
-  source_templates = os.path.abspath(templates + "/source-templates")
-  sink_templates = os.path.abspath(templates + "/sink-templates")
+  templates = _Resource("templates")
+  source_templates = _Resource("templates/source-templates")
+  sink_templates = _Resource("templates/sink-templates")
 
   @staticmethod
   def versionstr():
@@ -1492,6 +2448,12 @@ class Meta:
 # Standardised emu config file parser #
 #######################################
 class ConfigParser(_ConfigParser):
+  # Parsed config files, shared by every reader in the process. Keyed
+  # by class and absolute path, each value is a tuple of the stamp of
+  # the file when it was last read or written, and the parser. The
+  # least recently used parsers are evicted beyond CACHE_SIZE.
+  _cache = OrderedDict()
+  CACHE_SIZE = 1024
 
   def __init__(self, path):
     _ConfigParser.__init__(self)
@@ -1503,12 +2465,75 @@ class ConfigParser(_ConfigParser):
       io.fatal("Config file '{0}' not found".format(self.path))
 
     self.read(self.path)
+    self._remember()
+
+  @staticmethod
+  def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+  def _remember(self):
+    key = (type(self), os.path.abspath(self.path))
+    try:
+      ConfigParser._cache[key] = (ConfigParser._stamp(self.path), self)
+    except OSError:
+      ConfigParser._cache.pop(key, None)
+      return
+    ConfigParser._cache.move_to_end(key)
+    while len(ConfigParser._cache) > ConfigParser.CACHE_SIZE:
+      ConfigParser._cache.popitem(last=False)
+
+  @classmethod
+  def cached(cls, path):
+    """
+    Return the parsed config file at a path.
+
+    The file is only read if it has not been read before, or if its
+    modification time, size, or inode have changed since it was last
+    read or written. Parsers are shared, so changes made through one
+    are seen by every reader once they are flushed.
+
+    Arguments:
+        path (str): Path of the config file.
+
+    Returns:
+        ConfigParser: An instance of the class.
+    """
+    key = (cls, os.path.abspath(path))
+    stamp, config = ConfigParser._cache.get(key, (None, None))
+    try:
+      if config is not None and stamp == ConfigParser._stamp(path):
+        ConfigParser._cache.move_to_end(key)
+        return config
+    except OSError:
+      ConfigParser._cache.pop(key, None)
+    return cls(path)
+
+  @classmethod
+  def new(cls, path):
+    """
+    Create an empty config for a file which does not exist yet.
+
+    Nothing is read. The file is created, and the parser shared with
+    readers of cached(), once the config is flushed.
+
+    Arguments:
+        path (str): Path of the config file.
+
+    Returns:
+        ConfigParser: An instance of the class.
+    """
+    config = cls.__new__(cls)
+    _ConfigParser.__init__(config)
+    config.path = path
+    return config
 
   # flush() - Write config properties to disk
   #
   def flush(self):
     with open(self.path, "w") as config_file:
       self.write(config_file)
+    self._remember()
 
   # section() - Set/get items as dictionary
   #
@@ -1644,11 +2669,11 @@ class UserConfig(ConfigParser):
       self.set_string(s, p, "")
       return None
 
-  # TODO: The Emu config class should use a singleton pattern in
-  # order to require only one disk read per process.
+  # instance() - Return the user's config, re-read only if it changes
+  #
   @staticmethod
   def instance():
-    return UserConfig(os.path.expanduser("~/.emuconfig"))
+    return UserConfig.cached(os.path.expanduser("~/.emuconfig"))
 
 
 #############################
@@ -1686,6 +2711,463 @@ class Node(ConfigParser):
       return self.get_string(s, p)
 
 
+# A single record in a sink's snapshot index. 'date' is a UNIX
+# timestamp and 'snapshot_no' an integer.
+IndexEntry = namedtuple("IndexEntry",
+                        ["name", "parent", "date", "snapshot_no", "status"])
+
+
+###########################
+# Per-sink snapshot index #
+###########################
+class SnapshotIndex:
+  """
+  Compact on-disk index of a sink's snapshot nodes.
+
+  The index is stored at <sink>/.emu/index and records the name,
+  parent, date, snapshot number and status of every node, so that
+  lookups don't require listing and parsing every node file. The node
+  files remain the source of truth. The index records the
+  modification time of the nodes directory it was built against, and
+  is rebuilt from the node files whenever the two disagree. Rebuilt
+  indexes are only written to disk by processes which hold the sink
+  lock, since a reader could otherwise overwrite a newer index written
+  by a push.
+
+  The on-disk format is a header line followed by one tab-separated
+  line per snapshot, in chronological order:
+
+      # emu-index 1 <nodes-mtime-ns>
+      <name>  <parent>  <date>  <snapshot-no>  <status>
+  """
+
+  VERSION = 1
+
+  def __init__(self, sink):
+    """
+    Create an index for a sink. The index is loaded lazily.
+
+    Arguments:
+        sink (Sink): The sink to index.
+    """
+    self.path = os.path.join(sink.path, ".emu", "index")
+    self.nodes_dir = os.path.join(sink.path, ".emu", "nodes")
+    self.lock = sink.lock
+    self._mtime = None
+    self._entries = {}
+    self._names = []
+    self._ancestry = None
+
+  def _nodes_mtime(self):
+    return os.stat(self.nodes_dir).st_mtime_ns
+
+  def load(self):
+    """
+    Ensure that the index is up to date with the nodes directory.
+
+    Reads the on-disk index if it is current, else rebuilds it from
+    the node files.
+
+    Returns:
+        SnapshotIndex: self.
+    """
+    mtime = self._nodes_mtime()
+    if mtime == self._mtime:
+      return self
+
+    try:
+      with open(self.path) as infile:
+        header = infile.readline().split()
+        if (len(header) == 4 and header[:2] == ["#", "emu-index"] and
+            int(header[2]) == self.VERSION and int(header[3]) == mtime):
+          self._set_entries(SnapshotIndex._parse_line(line)
+                            for line in infile if line.strip())
+          self._mtime = mtime
+          return self
+    except (OSError, ValueError, IndexError):
+      pass
+
+    io.debug("Rebuilding snapshot index '{}'".format(self.path))
+    return self.rebuild()
+
+  def rebuild(self):
+    """
+    Rebuild the index by parsing every node file.
+
+    The rebuilt index is written to disk if the sink is locked by the
+    current process. Otherwise it is kept in memory.
+
+    Returns:
+        SnapshotIndex: self.
+    """
+    # Record the mtime before reading the nodes, so that any
+    # concurrent modification leaves the index stale rather than
+    # silently incomplete.
+    mtime = self._nodes_mtime()
+    entries = []
+    for name in Util.ls(self.nodes_dir, must_exist=True):
+      entry = SnapshotIndex.read_node(os.path.join(self.nodes_dir, name))
+      if entry:
+        entries.append(entry)
+    self._set_entries(entries)
+    self._mtime = mtime
+    if self.lock.owned_by_self:
+      self._write(mtime)
+    return self
+
+  def flush(self):
+    """
+    Write the index to disk.
+
+    Must be called after every change to the nodes directory, once
+    the node files have been written.
+    """
+    self._mtime = self._nodes_mtime()
+    self._write(self._mtime)
+
+  def _write(self, mtime):
+    import tempfile
+
+    tmp_path = None
+    try:
+      fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                      prefix="index.")
+      with open(fd, "w") as outfile:
+        # Other users, e.g. the monitor, may read the index:
+        os.fchmod(outfile.fileno(), 0o644)
+        print("# emu-index", self.VERSION, mtime, file=outfile)
+        for name in self._names:
+          print("\t".join(str(x) for x in self._entries[name]),
+                file=outfile)
+      os.replace(tmp_path, self.path)
+    except OSError as e:
+      # A read-only sink can still be indexed in memory.
+      io.debug("Failed to write snapshot index '{}': {}".format(self.path, e))
+      if tmp_path and os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+  def _set_entries(self, entries):
+    # Entries are built before any are replaced. The index is not
+    # thread safe, so concurrent users must serialise their access:
+    entries = {entry.name: entry for entry in entries}
+    names = sorted(entries)
+    self._entries, self._names, self._ancestry = entries, names, None
+
+  def names(self):
+    """
+    Return the names of all snapshots, oldest first.
+    """
+    return list(self._names)
+
+  def entries(self):
+    """
+    Iterate over all index entries, oldest first.
+    """
+    for name in self._names:
+      yield self._entries[name]
+
+  def get(self, name):
+    """
+    Return the index entry for a snapshot name, or None.
+    """
+    return self._entries.get(name)
+
+  def head(self):
+    """
+    Return the name of the most recent snapshot, or None.
+    """
+    return self._names[-1] if self._names else None
+
+  def tail(self):
+    """
+    Return the name of the oldest snapshot, or None.
+    """
+    return self._names[0] if self._names else None
+
+  def add(self, entry):
+    """
+    Add or replace an entry. Does not write to disk, see flush().
+    """
+    if entry.name not in self._entries:
+      bisect.insort(self._names, entry.name)
+    self._entries[entry.name] = entry
+    self._ancestry = None
+
+  def remove(self, name):
+    """
+    Remove an entry. Does not write to disk, see flush().
+    """
+    if self._entries.pop(name, None):
+      self._names.remove(name)
+    self._ancestry = None
+
+  def update(self, name, **fields):
+    """
+    Update fields of an entry. Does not write to disk, see flush().
+    """
+    self._entries[name] = self._entries[name]._replace(**fields)
+    self._ancestry = None
+
+  def ancestry(self):
+    """
+    Return the ancestry of the sink's snapshots.
+
+    The ancestry is computed once per change to the index.
+
+    Returns:
+        Ancestry: Ancestry.
+    """
+    if self._ancestry is None:
+      self._ancestry = Ancestry(
+          {name: entry.parent for name, entry in self._entries.items()},
+          self.head())
+    return self._ancestry
+
+  def children(self, name):
+    """
+    Return the names of all snapshots whose parent is 'name'.
+    """
+    return [n for n in self._names if self._entries[n].parent == name]
+
+  def __len__(self):
+    return len(self._names)
+
+  def __contains__(self, name):
+    return name in self._entries
+
+  def __repr__(self):
+    return self.path
+
+  @staticmethod
+  def _parse_line(line):
+    name, parent, date, snapshot_no, status = line.rstrip("\n").split("\t")
+    return IndexEntry(name, parent, int(date), int(snapshot_no), status)
+
+  @staticmethod
+  def read_node(path):
+    """
+    Create an index entry from a node file. The node is parsed
+    through Node.cached(), so it is shared with readers of the node.
+
+    Arguments:
+        path (str): Path to node file.
+
+    Returns:
+        IndexEntry: The entry, or None if the node is missing or
+          malformed.
+    """
+    if not Util.readable(path):
+      io.warning("Malformed node file '{}'".format(path))
+      return None
+    try:
+      node = Node.cached(path)
+      date = datetime.strptime(node.get("Snapshot", "date"), Date.REPR_FORMAT)
+      return IndexEntry(
+          name=os.path.basename(path),
+          parent=node.get("Snapshot", "parent", fallback=""),
+          date=int(time.mktime(date.timetuple())),
+          snapshot_no=node.getint("Sink", "snapshot-no", fallback=0),
+          status=node.get("Snapshot", "status", fallback="clean"))
+    except Exception:
+      io.warning("Malformed node file '{}'".format(path))
+      return None
+
+
+##########################
+# Sink rotation planning #
+##########################
+class RotationPlan:
+  """
+  A plan of which snapshots to keep and remove when rotating a sink.
+
+  Attributes:
+      items (list of (str, bool, str)): A (name, keep, reason) tuple
+        for every snapshot considered, newest first.
+  """
+
+  def __init__(self, items):
+    self.items = items
+
+  @property
+  def keep(self):
+    return [name for name, keep, _ in self.items if keep]
+
+  @property
+  def remove(self):
+    return [name for name, keep, _ in self.items if not keep]
+
+  def report(self):
+    """
+    Iterate over human readable lines describing the plan.
+    """
+    for name, keep, reason in self.items:
+      action = "skipping" if keep else "removing"
+      yield f"{action} {reason}"
+
+  @staticmethod
+  def create(entries, now):
+    """
+    Plan a rotation in a single pass over snapshot dates.
+
+    Arguments:
+        entries (iterable of IndexEntry): Snapshots in a branch,
+          newest first.
+        now (datetime): The current time.
+
+    Returns:
+        RotationPlan: The plan.
+    """
+    items = []
+    current_day = now.day
+    current_week = now.isocalendar()[1]
+
+    for entry in entries:
+      date = datetime.fromtimestamp(entry.date)
+      diff = now - date
+      name = entry.name
+
+      if diff.days < 1:
+        hours_ago = diff.seconds // 3600
+        items.append((name, True,
+                      f"snapshot {name} from {hours_ago} hours ago"))
+      elif diff.days < 31:
+        days_ago = diff.days
+        if current_day != date.day:
+          items.append((name, True,
+                        f"last snapshot {name} from {days_ago} days ago"))
+          current_day = date.day
+        else:
+          items.append((name, False,
+                        f"snapshot {name} from {days_ago} days ago"))
+      else:
+        weeks_ago = diff.days // 7
+        week = date.isocalendar()[1]
+        if current_week != week:
+          items.append((name, True,
+                        f"last snapshot {name} from {weeks_ago} weeks ago"))
+          current_week = week
+        else:
+          items.append((name, False,
+                        f"snapshot {name} from {weeks_ago} weeks ago"))
+
+    return RotationPlan(items)
+
+
+##########################
+# Snapshot parent lookup #
+##########################
+class Ancestry:
+  """
+  Ancestry of the snapshots in a sink.
+
+  The snapshots in the HEAD's branch are stored as an array in branch
+  order, so that ancestor and descendant queries within the branch
+  are resolved by index arithmetic. Queries on snapshots outside of
+  the HEAD's branch fall back to following parent pointers in memory.
+  """
+
+  def __init__(self, parents, head):
+    """
+    Create an ancestry.
+
+    Arguments:
+        parents (dict): A map from snapshot name to parent name.
+        head (str): The name of the HEAD snapshot, or None.
+    """
+    self.parents = parents
+    self.branch = []
+    self.position = {}
+    name = head
+    # Stop at the root, at dangling parents, or at cycles in malformed
+    # histories:
+    while name in parents and name not in self.position:
+      self.position[name] = len(self.branch)
+      self.branch.append(name)
+      name = parents[name]
+
+  def depth(self, name):
+    """
+    Return the number of generations from HEAD to a snapshot, or None
+    if the snapshot is not in the HEAD's branch.
+    """
+    return self.position.get(name)
+
+  def ancestors(self, name):
+    """
+    Iterate over a snapshot and its ancestors, newest first.
+    """
+    i = self.position.get(name)
+    if i is not None:
+      yield from islice(self.branch, i, None)
+    else:
+      seen = set()
+      while name in self.parents and name not in seen:
+        if name in self.position:
+          yield from self.ancestors(name)
+          return
+        seen.add(name)
+        yield name
+        name = self.parents[name]
+
+  def nth_parent(self, name, n):
+    """
+    Return the name of the nth parent of a snapshot, or None.
+    """
+    i = self.position.get(name)
+    if i is not None:
+      i += n
+      return self.branch[i] if i < len(self.branch) else None
+    else:
+      for ancestor in self.ancestors(name):
+        if n == 0:
+          return ancestor
+        n -= 1
+
+  def nth_child(self, name, n):
+    """
+    Return the name of the nth child of a snapshot in the HEAD's
+    branch, or None.
+    """
+    i = self.position.get(name)
+    if i is not None and i - n >= 0:
+      return self.branch[i - n]
+
+  def root(self, name):
+    """
+    Return the name of the oldest ancestor of a snapshot.
+    """
+    if name in self.position:
+      return self.branch[-1]
+    for ancestor in self.ancestors(name):
+      name = ancestor
+    return name
+
+  def between(self, src, dst):
+    """
+    Return the names of the snapshots between a snapshot and one of
+    its ancestors, newest first, excluding both end points.
+
+    Arguments:
+        src (str): Name of the newest snapshot.
+        dst (str): Name of the ancestor. If None, return all ancestors.
+
+    Returns:
+        list of str: Snapshot names, or None if dst is not an ancestor
+          of src.
+    """
+    i, j = self.position.get(src), self.position.get(dst)
+    if i is not None and dst is None:
+      return self.branch[i + 1:]
+    elif i is not None and j is not None:
+      return self.branch[i + 1:j] if j > i else None
+
+    names = list(self.ancestors(src))[1:]
+    if dst is None:
+      return names
+    elif dst in names:
+      return names[:names.index(dst)]
+
+
 ##############################################
 # Utility static class with helper functions #
 ##############################################
@@ -1739,8 +3221,11 @@ class Util:
   # to exit fatally on error, or a callback function to execute. If
   # 'must_exist' is True, then error if the file doesn't exist. This
   # function returns boolean on whether a file was deleted or not.
+  # Directories are removed using 'jobs' threads, see emu.removal.
   @staticmethod
-  def rm(path, must_exist=False, error=False, dry_run=False):
+  def rm(path, must_exist=False, error=False, dry_run=False, jobs=None):
+    from emu import removal
+
     exists = os.path.exists(path)
 
     if exists:
@@ -1754,7 +3239,8 @@ class Util:
         elif os.path.isdir(path):
           type = "directory"
           if not dry_run:
-            shutil.rmtree(path)
+            stats = removal.rmtree(path, jobs=jobs)
+            io.debug("Removed '{0}': {1}".format(path, stats))
         else:
           type = "file"
           if not dry_run:
@@ -1779,6 +3265,45 @@ class Util:
     else:
       return False
 
+  # du() - Return the disk usage of a path in bytes
+  #
+  # Recursively sums the allocated size of a file or directory
+  # without following symbolic links. If 'exclusive' is True, then
+  # only count files which are not hardlinked from elsewhere, i.e. the
+  # space which would be freed by deleting the path. Links from the
+  # inodes in 'store' (see dedup.Store.inodes()) are not counted.
+  @staticmethod
+  def du(path, exclusive=False, store=()):
+    from emu import usage
+
+    def size(st):
+      if (not exclusive or stat.S_ISDIR(st.st_mode) or
+          usage.links_outside_store(st, store) == 1):
+        return st.st_blocks * 512
+      return 0
+
+    try:
+      st = os.lstat(path)
+    except OSError:
+      return 0
+
+    total = size(st)
+    stack = [path] if stat.S_ISDIR(st.st_mode) else []
+    while stack:
+      try:
+        with os.scandir(stack.pop()) as it:
+          for entry in it:
+            try:
+              st = entry.stat(follow_symlinks=False)
+            except OSError:
+              continue
+            total += size(st)
+            if stat.S_ISDIR(st.st_mode):
+              stack.append(entry.path)
+      except OSError:
+        continue
+    return total
+
   # ls() - List a directory's contents
   #
   # Returns an alphabetically sorted list of a directory's contents.
@@ -1803,6 +3328,8 @@ class Util:
   # True, then error if the file doesn't exist.
   @staticmethod
   def mv(src, dst, must_exist=False, error=False):
+    import shutil
+
     exists = os.path.exists(src)
     readable = Util.readable(src, error=error)
 
@@ -1898,6 +3425,7 @@ class Util:
              wait=True, error=False):
 
     if isinstance(args, str):
+      import shlex
       args = shlex.split(args)
 
     io.verbose("Executing '{0}'.".format(" ".join(args)))
@@ -1907,7 +3435,17 @@ class Util:
 
     if wait:
       process.wait()
+      Util.check_returncode(args, process, error=error)
+
+    return process
 
+  # check_returncode() - Handle the exit status of a finished process
+  #
+  # Argument 'error' can either be a boolean that dictates whether to
+  # exit fatally if the process failed, or a callback function to
+  # execute.
+  @staticmethod
+  def check_returncode(args, process, error=False):
     if error and process.returncode:
       e = ("Process '{0}' exited with return value {1}."
            .format(colourise(" ".join(args), Colours.ERROR),
@@ -1919,14 +3457,39 @@ class Util:
       elif error:
         io.fatal(e)
 
-    return process
+  # transfer() - Copy a directory tree using the native transfer engine
+  #
+  # Accepts the keyword arguments of emu.transfer.sync(). Returns the
+  # statistics of the transfer. Argument 'error' can either be a
+  # boolean that dictates whether to exit fatally on error, or a
+  # callback function to execute.
+  @staticmethod
+  def transfer(src, dst, error=False, **kwargs):
+    from emu import transfer
+
+    try:
+      stats = transfer.sync(src, dst, **kwargs)
+      io.verbose("Transferred '{0}' -> '{1}': {2}".format(src, dst, stats))
+    except transfer.TransferError as e:
+      stats = e.stats
+      if hasattr(error, '__call__'):
+        # Execute error callback if provided
+        error(e)
+      elif error:
+        io.fatal(e)
+      else:
+        io.warning(e)
+
+    return stats
 
   # rsync() - Execute rsync file transfer and return elapsed time
   #
   # The 'archive', 'update', 'dry_run', 'link_dest', 'delete', and
   # 'delete_excluded' arguments correspond to their respective rsync
   # flags. 'exclude' and 'exclude_from' arguments accept either a
-  # list of paths and patterns or a single string.
+  # list of paths and patterns or a single string. If 'output' is a
+  # progress.RsyncOutput, rsync's output is consumed by it rather than
+  # inherited, and the transfer statistics are returned instead.
   @staticmethod
   def rsync(src, dst, archive=True, update=False,
             hard_links=True, keep_dirlinks=True, dry_run=False,
@@ -1934,9 +3497,15 @@ class Util:
             exclude=None, exclude_from=None,
             delete=False, delete_excluded=False, wait=True,
             stdout=None, stderr=None, args=None,
-            error=False, quiet=False):
+            error=False, quiet=False, output=None):
+
+    rsync_flags = ["rsync", "--recursive"]
 
-    rsync_flags = ["rsync", "--human-readable", "--recursive"]
+    # Output is parsed, so numbers must not be abbreviated:
+    if output:
+      rsync_flags += ["--stats", "--itemize-changes", "--info=progress2"]
+    else:
+      rsync_flags.append("--human-readable")
 
     if archive:
       rsync_flags.append("--archive")
@@ -1990,7 +3559,7 @@ class Util:
     if args:
       rsync_flags += args
 
-    if not quiet:
+    if not quiet and not output:
       rsync_flags.append("--verbose")
 
     # Add source and destination operands after flags:
@@ -1999,6 +3568,17 @@ class Util:
     # Record file transfer start time.
     start_time = time.time()
 
+    if output:
+      # Perform rsync, consuming its output asynchronously:
+      process = Util.p_exec(rsync_flags, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, wait=False)
+      rsync_stats = output.run(process)
+      rsync_stats.elapsed = time.time() - start_time
+      io.verbose("Transferred '{0}' -> '{1}': {2}"
+                 .format(src, dst, rsync_stats))
+      Util.check_returncode(rsync_flags, process, error=error)
+      return rsync_stats
+
     # Perform rsync.
     Util.p_exec(rsync_flags, stdout=stdout, stderr=stderr,
                 wait=wait, error=error)
@@ -2122,6 +3702,7 @@ class Date:
   # hex() - Return hex formatted date timestamp
   #
   def hex(self):
+    import calendar
     return "{0:x}".format(calendar.timegm(self.date))
 
   # snapshotfmt() - Return snapshot name formatted date
@@ -2282,9 +3863,7 @@ class VersionError(Error):
 # possible point of interruption in a try-except block, we can
 # register a SIGINT handler. In our case, we don't need it to do
 # anything other than acknowledge the signal, as the err_cb() methods
-# are used for tidying up.
+# are used for tidying up. The handler is installed by Parser, so
+# that importing emu has no side effects.
 def _sigint_handler(signum, frame):
   io.printf("emu: received SIGINT")
-
-
-signal.signal(signal.SIGINT, _sigint_handler)
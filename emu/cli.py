@@ -0,0 +1,110 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Dispatch of emu commands.
+
+Each "emu <command>" is implemented by a program "emu-<command>".
+The programs of emu's own commands are registered in COMMANDS, and
+are loaded and run in the current process, so that a command costs a
+single interpreter start. Other commands are looked up on the $PATH
+and run as child processes. In both cases, arguments are passed
+through unchanged.
+"""
+import importlib.machinery
+import importlib.util
+import os
+import subprocess
+import sys
+
+import emu
+
+
+# Commands which are run in-process:
+COMMANDS = [
+  "clean",
+  "diff",
+  "init",
+  "log",
+  "monitor",
+  "prune",
+  "pull",
+  "push",
+  "sink",
+  "watch",
+]
+
+
+def lookup(command, bin_dir=None):
+  """
+  Return the path to the program which implements an emu command.
+
+  Arguments:
+      command (str): The name of the command.
+      bin_dir (str, optional): Directory to look for the program in
+        before the $PATH, e.g. the directory of the "emu" program.
+
+  Returns:
+      str: Path of the program.
+
+  Raises:
+      InvalidEmuCommand: If the command does not exist.
+  """
+  if bin_dir:
+    script_path = os.path.join(bin_dir, "emu-" + command)
+    if os.path.isfile(script_path):
+      return script_path
+  return emu.lookup_emu_program(command)
+
+
+def load(command, script_path):
+  """
+  Load the program of a command as a module, without running it.
+  """
+  name = "emu_" + command.replace("-", "_")
+  loader = importlib.machinery.SourceFileLoader(name, script_path)
+  spec = importlib.util.spec_from_loader(name, loader)
+  module = importlib.util.module_from_spec(spec)
+  loader.exec_module(module)
+  return module
+
+
+def run(command, argv, bin_dir=None):
+  """
+  Run an emu command.
+
+  Arguments:
+      command (str): The name of the command.
+      argv (list of str): Arguments of the command.
+      bin_dir (str, optional): Directory to look for programs in.
+
+  Returns:
+      int: Exit status of the command.
+
+  Raises:
+      InvalidEmuCommand: If the command does not exist.
+  """
+  script_path = lookup(command, bin_dir)
+  if command not in COMMANDS:
+    return subprocess.call([script_path] + argv)
+
+  # Commands find their man page from sys.argv[0]:
+  saved_argv = sys.argv
+  sys.argv = [script_path] + argv
+  try:
+    return load(command, script_path).main(argv, len(argv)) or 0
+  finally:
+    sys.argv = saved_argv
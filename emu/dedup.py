@@ -0,0 +1,241 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Content-addressed deduplication of snapshot files.
+
+Link destinations only deduplicate files at the same relative path,
+so renamed or moved files are stored again. The store is a directory
+of hardlinks at <sink>/.emu/store/<hh>/<key>, where the key is the
+SHA-256 digest of a file's contents and its metadata. Files written
+by a push are hashed, and replaced by a hardlink to an identical inode
+in the store if there is one, else added to the store.
+
+Since hardlinks share metadata, files are only deduplicated against
+files with the same permissions, ownership, and modification time.
+Store entries which are no longer linked from any snapshot are
+removed by sweep(). A file whose only other link is its store entry is
+exclusive to its snapshot, since deleting the snapshot and sweeping
+the store frees it.
+"""
+import errno
+import os
+import stat
+
+from emu import io
+
+
+DEFAULT_JOBS = 4
+
+# Files smaller than this are not worth an inode lookup:
+MIN_SIZE = 4096
+
+_READ_SIZE = 1 << 20
+
+
+class DedupStats:
+  """
+  Statistics of a deduplication.
+
+  Attributes:
+      files (int): Number of files hashed.
+      linked (int): Number of files replaced by links to the store.
+      bytes_saved (int): Number of bytes freed by linking.
+  """
+
+  def __init__(self):
+    self.files = 0
+    self.linked = 0
+    self.bytes_saved = 0
+
+  def __repr__(self):
+    return "{} files hashed, {} linked, {} bytes saved".format(
+        self.files, self.linked, self.bytes_saved)
+
+
+def _digest(path):
+  import hashlib
+
+  h = hashlib.sha256()
+  with open(path, "rb") as infile:
+    for chunk in iter(lambda: infile.read(_READ_SIZE), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+class Store:
+  """
+  A sink's content-addressed store.
+
+  Attributes:
+      path (str): Path of the store directory.
+  """
+
+  def __init__(self, sink_path):
+    self.path = os.path.join(sink_path, ".emu", "store")
+
+  @staticmethod
+  def key(digest, st):
+    """
+    The store key of a file with the given contents and metadata.
+    """
+    return "{}.{:o}.{}.{}.{}".format(digest, stat.S_IMODE(st.st_mode),
+                                     st.st_uid, st.st_gid, st.st_mtime_ns)
+
+  def entry(self, key):
+    return os.path.join(self.path, key[:2], key)
+
+  def _candidates(self, tree, paths=None):
+    """
+    Yield the path and stat result of every file in a tree which was
+    written by the current push, i.e. which has no other links.
+    """
+    stack = []
+    for path in [""] if paths is None else paths:
+      path = os.path.join(tree, path) if path else tree
+      try:
+        st = os.lstat(path)
+      except FileNotFoundError:
+        continue
+      if stat.S_ISDIR(st.st_mode):
+        stack.append(path)
+      elif (stat.S_ISREG(st.st_mode) and st.st_nlink == 1 and
+            st.st_size >= MIN_SIZE):
+        yield path, st
+
+    while stack:
+      with os.scandir(stack.pop()) as it:
+        for entry in it:
+          if entry.is_dir(follow_symlinks=False):
+            stack.append(entry.path)
+          elif entry.is_file(follow_symlinks=False):
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink == 1 and st.st_size >= MIN_SIZE:
+              yield entry.path, st
+
+  def _link(self, path, st, digest, stats):
+    key = Store.key(digest, st)
+    entry = self.entry(key)
+    tmp_path = path + ".emu-dedup"
+
+    try:
+      os.link(entry, tmp_path)
+    except FileNotFoundError:
+      # New contents, so add the file to the store:
+      os.makedirs(os.path.dirname(entry), exist_ok=True)
+      try:
+        os.link(path, entry)
+      except FileExistsError:
+        pass  # Added concurrently by an identical file.
+      return
+    except OSError as e:
+      if e.errno != errno.EMLINK:
+        raise
+      # The stored inode has reached the maximum link count, so
+      # replace it with this file:
+      os.link(path, tmp_path)
+      os.replace(tmp_path, entry)
+      return
+
+    if os.lstat(tmp_path).st_size != st.st_size:
+      os.unlink(tmp_path)  # Store entry was modified. Don't trust it.
+      return
+    os.replace(tmp_path, path)
+    stats.linked += 1
+    stats.bytes_saved += st.st_blocks * 512
+
+  def dedup(self, tree, jobs=None, paths=None):
+    """
+    Deduplicate the newly written files of a tree against the store.
+
+    Arguments:
+        tree (str): Path of the tree.
+        jobs (int, optional): Number of hashing threads.
+        paths (list of str, optional): If provided, only the files at
+          or beneath these paths of the tree were written.
+
+    Returns:
+        DedupStats: Statistics of the deduplication.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    stats = DedupStats()
+    candidates = list(self._candidates(tree, paths))
+
+    # Hashing is I/O bound, and hashlib releases the GIL:
+    with ThreadPoolExecutor(max_workers=jobs or DEFAULT_JOBS) as executor:
+      digests = executor.map(lambda c: _digest(c[0]), candidates)
+      for (path, st), digest in zip(candidates, digests):
+        stats.files += 1
+        try:
+          self._link(path, st, digest, stats)
+        except OSError as e:
+          io.warning("dedup: {}: {}".format(path, e))
+
+    io.debug("dedup: {}: {}".format(tree, stats))
+    return stats
+
+  def inodes(self):
+    """
+    The inodes of the store entries.
+
+    The inodes are read from the store directories, without a stat()
+    of each entry.
+
+    Returns:
+        set of int: Inode numbers.
+    """
+    inodes = set()
+    try:
+      buckets = os.listdir(self.path)
+    except FileNotFoundError:
+      return inodes
+
+    for bucket in buckets:
+      try:
+        with os.scandir(os.path.join(self.path, bucket)) as it:
+          inodes.update(entry.inode() for entry in it)
+      except OSError:
+        continue
+    return inodes
+
+  def sweep(self):
+    """
+    Remove store entries which are not linked from any snapshot.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    removed = 0
+    try:
+      buckets = os.listdir(self.path)
+    except FileNotFoundError:
+      return 0
+
+    for bucket in buckets:
+      bucket_path = os.path.join(self.path, bucket)
+      with os.scandir(bucket_path) as it:
+        for entry in it:
+          if entry.stat(follow_symlinks=False).st_nlink == 1:
+            os.unlink(entry.path)
+            removed += 1
+      try:
+        os.rmdir(bucket_path)
+      except OSError:
+        pass  # Not empty.
+
+    io.debug("dedup: swept {} store entries".format(removed))
+    return removed
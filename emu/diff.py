@@ -0,0 +1,229 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Differences between snapshots.
+
+Unchanged files are hardlinked between snapshots, so files which share
+an inode are identical and need not be compared. Differences are
+computed from the snapshots' manifests when both exist, else by
+walking both trees in parallel. In both cases changes are streamed in
+sorted path order.
+
+Files with distinct inodes are compared by type, size, modification
+time, and permissions, in the manner of rsync's "quick check".
+"""
+import os
+import stat
+from collections import namedtuple
+
+from emu import manifest
+
+
+DEFAULT_JOBS = 8
+
+ADDED = "A"
+REMOVED = "D"
+MODIFIED = "M"
+
+Change = namedtuple("Change", ["status", "path", "old", "new"])
+Change.__doc__ = """
+A changed path. 'old' and 'new' are the manifest entries of the path
+in each snapshot, or None if it is absent.
+"""
+
+
+class DiffStats:
+  """
+  Totals of a diff.
+
+  Attributes:
+      added (int): Number of added paths.
+      removed (int): Number of removed paths.
+      modified (int): Number of modified paths.
+      bytes_added (int): Size of added files.
+      bytes_removed (int): Size of removed files.
+      bytes_modified (int): Size of modified files, in the new snapshot.
+  """
+
+  def __init__(self):
+    self.added = 0
+    self.removed = 0
+    self.modified = 0
+    self.bytes_added = 0
+    self.bytes_removed = 0
+    self.bytes_modified = 0
+
+  def add(self, change):
+    if change.status == ADDED:
+      self.added += 1
+      self.bytes_added += change.new.size
+    elif change.status == REMOVED:
+      self.removed += 1
+      self.bytes_removed += change.old.size
+    else:
+      self.modified += 1
+      self.bytes_modified += change.new.size
+
+
+def _modified(old, new):
+  return (old.ino != new.ino and
+          (old.size, old.mtime, old.mode) != (new.size, new.mtime, new.mode))
+
+
+def _changes(old, new):
+  """
+  The changes of a path, given its entries in each snapshot.
+  """
+  if old is not None and new is not None and old.type != new.type:
+    return [Change(REMOVED, old.path, old, None),
+            Change(ADDED, new.path, None, new)]
+  elif old is None:
+    return [Change(ADDED, new.path, None, new)]
+  elif new is None:
+    return [Change(REMOVED, old.path, old, None)]
+  elif old.type != "d" and _modified(old, new):
+    return [Change(MODIFIED, new.path, old, new)]
+  return []
+
+
+def diff_manifests(old, new):
+  """
+  Compute the changes between two manifests.
+
+  Arguments:
+      old (iterable of manifest.Entry): Entries of the old snapshot.
+      new (iterable of manifest.Entry): Entries of the new snapshot.
+
+  Yields:
+      Change: Changes, in sorted order.
+  """
+  for a, b in manifest.diff(old, new):
+    yield from _changes(a, b)
+
+
+def _entry(dir_entry, path):
+  st = dir_entry.stat(follow_symlinks=False)
+  type = manifest._type(st.st_mode)
+  return manifest.Entry(path, type, st.st_size if type != "d" else 0,
+                        st.st_mtime_ns, stat.S_IMODE(st.st_mode),
+                        st.st_ino if type != "d" else 0)
+
+
+def _subtree(tree, entry):
+  """
+  Yield an entry and, if it is a directory, everything beneath it.
+  """
+  yield entry
+  if entry.type == "d":
+    for child in manifest.scan(os.path.join(tree, entry.path)):
+      yield child._replace(path=entry.path + "/" + child.path)
+
+
+def _compare_dir(old_tree, new_tree, relpath):
+  """
+  Compare the entries of a directory in two trees.
+
+  Returns:
+      list of Tuple(str, DirEntry, DirEntry): The name and directory
+        entries of each name in either directory, in sorted order.
+        Names whose entries share an inode are omitted.
+  """
+  def _scan(tree):
+    try:
+      with os.scandir(os.path.join(tree, relpath)) as it:
+        return {e.name: e for e in it}
+    except FileNotFoundError:
+      return {}
+
+  old, new = _scan(old_tree), _scan(new_tree)
+  pairs = []
+  for name in sorted(old.keys() | new.keys()):
+    a, b = old.get(name), new.get(name)
+    # The inode is returned by readdir(), so this costs no stat():
+    if a is not None and b is not None and a.inode() == b.inode():
+      continue
+    pairs.append((name, a, b))
+  return pairs
+
+
+def diff_trees(old_tree, new_tree, jobs=None):
+  """
+  Compute the changes between two snapshot trees.
+
+  Directories are compared in parallel threads, ahead of the
+  directory whose changes are being yielded.
+
+  Arguments:
+      old_tree (str): Path of the old snapshot tree.
+      new_tree (str): Path of the new snapshot tree.
+      jobs (int, optional): Number of threads.
+
+  Yields:
+      Change: Changes, in sorted order.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  with ThreadPoolExecutor(max_workers=jobs or DEFAULT_JOBS) as executor:
+
+    def _submit(relpath):
+      return executor.submit(_compare_dir, old_tree, new_tree, relpath)
+
+    def _walk(relpath, future):
+      pairs = future.result()
+      entries = []
+      for name, a, b in pairs:
+        path = os.path.join(relpath, name) if relpath else name
+        old = _entry(a, path) if a is not None else None
+        new = _entry(b, path) if b is not None else None
+        recurse = (old is not None and new is not None and
+                   old.type == new.type == "d")
+        entries.append((old, new, _submit(path) if recurse else None))
+
+      for old, new, subdir in entries:
+        if subdir:
+          yield from _walk(new.path, subdir)
+          continue
+        if old is not None and new is not None and old.type == new.type:
+          yield from _changes(old, new)
+          continue
+        if old is not None:
+          for entry in _subtree(old_tree, old):
+            yield Change(REMOVED, entry.path, entry, None)
+        if new is not None:
+          for entry in _subtree(new_tree, new):
+            yield Change(ADDED, entry.path, None, entry)
+
+    yield from _walk("", _submit(""))
+
+
+def diff_snapshots(old, new, use_manifests=True, jobs=None):
+  """
+  Compute the changes between two snapshots.
+
+  Arguments:
+      old (emu.Snapshot): The old snapshot.
+      new (emu.Snapshot): The new snapshot.
+      use_manifests (bool, optional): If True, use the snapshots'
+        manifests if both exist.
+      jobs (int, optional): Number of threads used to walk trees.
+
+  Yields:
+      Change: Changes, in sorted order.
+  """
+  if use_manifests and old.manifest.exists and new.manifest.exists:
+    return diff_manifests(old.manifest, new.manifest)
+  return diff_trees(old.tree, new.tree, jobs=jobs)
@@ -0,0 +1,465 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Source change journal.
+
+The watcher (emu watch) uses inotify(7) to record the paths of a
+source which change, so that a push can transfer only those paths
+rather than scanning the entire source tree. The journal is an
+append-only file at <source>/.emu/journal:
+
+    # emu-journal 1 <generation>
+    <path>
+    ...
+
+Paths are relative to the source root. A new generation begins each
+time the watcher starts, since changes made while no watcher was
+running are unknown. A line "!overflow" records that changes have
+been lost, for example because the kernel event queue overflowed.
+
+Each snapshot records the generation and byte offset of the journal
+when its transfer began. The changes since a snapshot are the lines
+after its offset, provided that the generation is unchanged and the
+watcher is still alive.
+"""
+import errno
+import fcntl
+import os
+import select
+import signal
+import stat
+import struct
+import time
+
+from emu import io
+from emu import manifest
+from emu import removal
+from emu.lockfile import LockFile
+
+
+VERSION = 1
+OVERFLOW = "!overflow"
+
+# Seconds between watcher heartbeats. A watcher is presumed dead once
+# its heartbeat is more than HEARTBEAT_TOLERANCE intervals old:
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TOLERANCE = 3
+
+# Seconds between writes of pending changes to the journal:
+FLUSH_INTERVAL = 1
+
+# Size at which the watcher starts a new journal generation:
+MAX_JOURNAL_SIZE = 256 << 20
+
+# inotify(7) event masks:
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR |
+              IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+  """
+  A minimal ctypes binding of the Linux inotify API.
+  """
+
+  def __init__(self):
+    import ctypes.util
+
+    self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    self._libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+    self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+    if self.fd < 0:
+      self._raise()
+
+  def _raise(self, path=None):
+    import ctypes
+
+    e = ctypes.get_errno()
+    raise OSError(e, os.strerror(e), path)
+
+  def add_watch(self, path, mask):
+    wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      self._raise(path)
+    return wd
+
+  def rm_watch(self, wd):
+    # The watch may already have been removed by the kernel:
+    self._libc.inotify_rm_watch(self.fd, wd)
+
+  def read(self, timeout=None):
+    """
+    Read pending events, waiting up to 'timeout' seconds for one.
+
+    Returns:
+        list of Tuple(int, int, str): The watch descriptor, mask, and
+          name of each event.
+    """
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+
+    data = os.read(self.fd, 1 << 16)
+    events, i = [], 0
+    while i < len(data):
+      wd, mask, _, length = _EVENT.unpack_from(data, i)
+      i += _EVENT.size
+      name = os.fsdecode(data[i:i + length].rstrip(b"\0"))
+      i += length
+      events.append((wd, mask, name))
+    return events
+
+  def close(self):
+    os.close(self.fd)
+
+
+class Journal:
+  """
+  The change journal of a source.
+
+  Attributes:
+      path (str): Path of the journal.
+      heartbeat_path (str): Path of the watcher heartbeat file, which
+        contains the heartbeat interval in seconds.
+  """
+
+  def __init__(self, source_path):
+    self.path = os.path.join(source_path, ".emu", "journal")
+    self.heartbeat_path = self.path + ".heartbeat"
+
+  def start(self):
+    """
+    Begin a new generation of the journal.
+
+    Returns:
+        str: The new generation.
+    """
+    generation = "{}-{}".format(time.time_ns(), os.getpid())
+    tmp_path = "{}.{}".format(self.path, os.getpid())
+    with open(tmp_path, "w") as outfile:
+      print("# emu-journal", VERSION, generation, file=outfile)
+    os.replace(tmp_path, self.path)
+    return generation
+
+  def append(self, paths):
+    """
+    Append changed paths to the journal.
+    """
+    with open(self.path, "a") as outfile:
+      fcntl.flock(outfile, fcntl.LOCK_EX)
+      outfile.write("".join(path + "\n" for path in paths))
+      outfile.flush()
+      fcntl.flock(outfile, fcntl.LOCK_UN)
+
+  @property
+  def size(self):
+    try:
+      return os.path.getsize(self.path)
+    except FileNotFoundError:
+      return 0
+
+  def beat(self, interval):
+    """
+    Record that the watcher is alive.
+    """
+    with open(self.heartbeat_path, "w") as outfile:
+      print(interval, file=outfile)
+
+  def stop(self):
+    """
+    Record that the watcher has stopped.
+    """
+    try:
+      os.remove(self.heartbeat_path)
+    except FileNotFoundError:
+      pass
+
+  @property
+  def is_alive(self):
+    """
+    Whether a watcher is recording changes to the journal.
+    """
+    try:
+      with open(self.heartbeat_path) as infile:
+        interval = float(infile.read())
+        age = time.time() - os.fstat(infile.fileno()).st_mtime
+    except (OSError, ValueError):
+      return False
+    return age < interval * HEARTBEAT_TOLERANCE
+
+  def since(self, generation=None, offset=0):
+    """
+    Read the paths which have changed since a journal position.
+
+    Arguments:
+        generation (str, optional): Generation of the position. If not
+          provided, only the current position is returned.
+        offset (int, optional): Offset of the position.
+
+    Returns:
+        Tuple(list of str, Tuple(str, int)): The changed paths, or None
+          if they are unknown, and the current position of the
+          journal, or None if no watcher is running.
+    """
+    if not self.is_alive:
+      io.verbose("journal: no watcher running")
+      return None, None
+
+    try:
+      infile = open(self.path, "rb")
+    except FileNotFoundError:
+      return None, None
+
+    with infile:
+      fcntl.flock(infile, fcntl.LOCK_SH)
+      header = infile.readline().split()
+      end = os.fstat(infile.fileno()).st_size
+      if (len(header) != 4 or header[:2] != [b"#", b"emu-journal"] or
+          int(header[2]) != VERSION):
+        io.verbose("journal: unrecognised format")
+        return None, None
+      position = (header[3].decode(), end)
+
+      if generation is None:
+        return None, position
+      elif generation != position[0]:
+        io.verbose("journal: changes since generation {} are unknown"
+                   .format(generation))
+        return None, position
+      elif offset > end:
+        io.verbose("journal: truncated")
+        return None, position
+
+      infile.seek(offset)
+      lines = infile.read(end - offset).decode(errors="surrogateescape")
+
+    paths = set(lines.splitlines())
+    if OVERFLOW in paths:
+      io.verbose("journal: changes were lost")
+      return None, position
+
+    return compact(paths), position
+
+
+def compact(paths):
+  """
+  Sort a collection of paths, removing any whose ancestor is included.
+
+  >>> compact(["a/b", "c", "a", "a/b/c", "ab"])
+  ['a', 'ab', 'c']
+  """
+  compacted = []
+  for path in sorted(set(paths), key=lambda p: p.split("/")):
+    if not path:
+      continue
+    if compacted and path.startswith(compacted[-1] + "/"):
+      continue
+    compacted.append(path)
+  return sorted(compacted)
+
+
+def stage(head, staging_area, paths, entries=None):
+  """
+  Prepare a staging area for an incremental transfer.
+
+  The staging area is populated with a hardlinked clone of the
+  unchanged entries of HEAD. The changed paths are left out, so that
+  the transfer creates new inodes for changed files rather than
+  modifying the files of HEAD in place. The clone is made from HEAD's
+  manifest, so HEAD is not walked.
+
+  Arguments:
+      head (str): Path of HEAD tree.
+      staging_area (str): Path of staging area.
+      paths (list of str): Changed paths, relative to the tree root.
+      entries (iterable of manifest.Entry, optional): Sorted entries of
+        HEAD. If not provided, HEAD is walked.
+  """
+  if os.path.lexists(staging_area):
+    removal.rmtree(staging_area)
+  os.mkdir(staging_area)
+
+  if entries is None:
+    entries = manifest.scan(head)
+  changed = set(paths)
+
+  directories = []
+  for entry in entries:
+    if manifest.covered(entry.path, changed):
+      continue
+    staged = os.path.join(staging_area, entry.path)
+    if entry.type == "d":
+      os.mkdir(staged)
+      directories.append((staged, entry))
+    else:
+      os.link(os.path.join(head, entry.path), staged, follow_symlinks=False)
+
+  # Set the metadata of directories once their contents are complete,
+  # deepest first:
+  for staged, entry in reversed(directories):
+    os.chmod(staged, entry.mode)
+    os.utime(staged, ns=(entry.mtime, entry.mtime))
+  st = os.stat(head)
+  os.chmod(staging_area, stat.S_IMODE(st.st_mode))
+  os.utime(staging_area, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+class Watcher:
+  """
+  Record the changes to a source in its journal.
+
+  Attributes:
+      source_path (str): Path of the source.
+      journal (Journal): The source's journal.
+      lock (LockFile): Lock held while the watcher is running.
+  """
+
+  def __init__(self, source_path, interval=HEARTBEAT_INTERVAL):
+    self.source_path = source_path
+    self.interval = interval
+    self.journal = Journal(source_path)
+    self.lock = LockFile(os.path.join(source_path, ".emu", "WATCH"))
+    self._inotify = None
+    self._watches = {}  # Maps watch descriptors to directory paths.
+    self._pending = set()
+    self._running = False
+
+  def _watch_tree(self, relpath):
+    """
+    Watch a directory and all of its subdirectories.
+    """
+    for dirpath, dirnames, _ in os.walk(os.path.join(self.source_path,
+                                                     relpath)):
+      rel = os.path.relpath(dirpath, self.source_path)
+      if rel == ".":
+        rel = ""
+        dirnames[:] = [d for d in dirnames if d != ".emu"]
+
+      try:
+        wd = self._inotify.add_watch(dirpath, WATCH_MASK)
+      except OSError as e:
+        if e.errno == errno.ENOSPC:
+          io.error("watch: inotify watch limit reached, see "
+                   "/proc/sys/fs/inotify/max_user_watches")
+          self._pending.add(OVERFLOW)
+          return
+        elif e.errno in (errno.ENOENT, errno.ENOTDIR):
+          continue  # Removed since the directory was listed.
+        raise
+      self._watches[wd] = rel
+
+  def _unwatch_tree(self, relpath):
+    """
+    Stop watching a directory and all of its subdirectories.
+    """
+    prefix = relpath + "/"
+    for wd, path in list(self._watches.items()):
+      if path == relpath or path.startswith(prefix):
+        self._inotify.rm_watch(wd)
+        del self._watches[wd]
+
+  def _handle(self, wd, mask, name):
+    if mask & IN_Q_OVERFLOW:
+      io.error("watch: inotify event queue overflowed")
+      self._pending.add(OVERFLOW)
+      return
+    elif mask & IN_IGNORED:
+      self._watches.pop(wd, None)
+      return
+    elif wd not in self._watches or not name:
+      # Events on a watched directory itself are also reported to the
+      # watch of its parent, so are recorded there.
+      return
+
+    path = os.path.join(self._watches[wd], name)
+    if "\n" in path:
+      # Unrepresentable in the journal:
+      self._pending.add(OVERFLOW)
+      return
+
+    if mask & IN_ISDIR:
+      if mask & (IN_MOVED_FROM | IN_DELETE):
+        self._unwatch_tree(path)
+      if mask & (IN_MOVED_TO | IN_CREATE):
+        # The contents of a new directory are included by recording
+        # the directory itself:
+        self._watch_tree(path)
+
+    self._pending.add(path)
+
+  def _flush(self):
+    if self._pending:
+      self.journal.append(sorted(self._pending))
+      self._pending.clear()
+
+  def _stop(self, *_):
+    self._running = False
+
+  def run(self):
+    """
+    Watch the source until interrupted or terminated.
+    """
+    with self.lock.acquire(replace_stale=True):
+      self._inotify = Inotify()
+      self._running = True
+      signal.signal(signal.SIGTERM, self._stop)
+      try:
+        # Begin the new generation once all of the watches are in
+        # place, so that no changes in the generation are missed:
+        self._watch_tree("")
+        generation = self.journal.start()
+        io.printf("Watching {} directories of '{}' (generation {})"
+                  .format(len(self._watches), self.source_path, generation))
+
+        next_beat = 0
+        while self._running:
+          now = time.time()
+          if now >= next_beat:
+            self.journal.beat(self.interval)
+            next_beat = now + self.interval
+
+          for event in self._inotify.read(timeout=FLUSH_INTERVAL):
+            self._handle(*event)
+          self._flush()
+
+          if self.journal.size > MAX_JOURNAL_SIZE:
+            self.journal.start()
+      except KeyboardInterrupt:
+        pass
+      finally:
+        self.journal.stop()
+        self._inotify.close()
+        self._inotify = None
+        self._watches = {}
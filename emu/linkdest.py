@@ -0,0 +1,174 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Selection of link destinations.
+
+Unchanged files are hardlinked to an identical file at the same path
+in a previous snapshot, the "link destination", rather than copied.
+Every link destination is probed for every file transferred, so each
+one multiplies the metadata I/O of a push. Link destinations are
+probed in order, and the first match is used.
+
+The selection is made according to a policy:
+
+    auto    HEAD, followed by the ancestors which hold the most files
+            that HEAD does not, i.e. files which have since been
+            changed or deleted and may be restored. Candidates are
+            sampled at exponentially increasing distances from HEAD,
+            along with the oldest ancestor, so that they are diverse.
+            They are ranked by the overlap of their manifests with
+            HEAD's. Candidates without manifests are skipped, and
+            if HEAD has no manifest then only HEAD is used, so that
+            no trees are walked.
+    head    HEAD only.
+    recent  The most recent snapshots, newest first.
+"""
+import os
+
+from emu import io
+from emu import manifest
+
+
+POLICIES = ["auto", "head", "recent"]
+DEFAULT_POLICY = "auto"
+DEFAULT_MAX = 4
+
+
+def sample(branch, count):
+  """
+  Sample ancestors at exponentially increasing distances, and the
+  oldest ancestor.
+
+  >>> sample(list("abcdefghijk"), 3)
+  ['b', 'c', 'e']
+  >>> sample(list("abcdef"), 4)
+  ['b', 'c', 'e', 'f']
+  >>> sample(list("ab"), 3)
+  ['b']
+  """
+  samples = []
+  distance = 1
+  while distance < len(branch) and len(samples) < count:
+    samples.append(branch[distance])
+    distance *= 2
+  if len(branch) > 1 and len(samples) < count and branch[-1] not in samples:
+    samples.append(branch[-1])
+  return samples
+
+
+def unique_files(head, entries):
+  """
+  Count the files of a snapshot which are not in HEAD.
+
+  Arguments:
+      head (iterable of manifest.Entry): Sorted entries of HEAD.
+      entries (iterable of manifest.Entry): Sorted entries of the
+        snapshot.
+
+  Returns:
+      int: Number of files whose path is not in HEAD, or whose inode
+        differs from HEAD's.
+  """
+  count = 0
+  for a, b in manifest.diff(head, entries):
+    if b is not None and b.type == "f" and (a is None or a.ino != b.ino):
+      count += 1
+  return count
+
+
+def select(branch, sink_path, policy=DEFAULT_POLICY, max=DEFAULT_MAX):
+  """
+  Select the link destinations of a push.
+
+  Arguments:
+      branch (list of str): Names of HEAD and its ancestors, newest
+        first.
+      sink_path (str): Path of the sink.
+      policy (str, optional): Selection policy.
+      max (int, optional): Maximum number of link destinations.
+
+  Returns:
+      list of str: Names of link destinations, in the order that they
+        should be probed.
+  """
+  if not branch or max < 1:
+    return []
+  elif policy == "head":
+    return branch[:1]
+  elif policy == "recent":
+    return branch[:max]
+
+  manifests_dir = os.path.join(sink_path, ".emu", "manifests")
+  head = manifest.Manifest(manifests_dir, branch[0])
+  if not head.exists:
+    return branch[:1]
+
+  scores = {}
+  for name in sample(branch, 2 * (max - 1)):
+    m = manifest.Manifest(manifests_dir, name)
+    if not m.exists:
+      continue
+    try:
+      scores[name] = unique_files(head, m)
+    except (OSError, ValueError) as e:
+      io.debug("link-dest: {}: {}".format(name, e))
+
+  # Ancestors whose files are all in HEAD are of no use. Candidates
+  # are sorted by distance, so ties are broken by recency:
+  ranked = sorted((name for name in scores if scores[name]),
+                  key=lambda name: -scores[name])
+  for name in ranked:
+    io.debug("link-dest: {} has {} files not in HEAD"
+             .format(name, scores[name]))
+  return branch[:1] + ranked[:max - 1]
+
+
+class HitCounter:
+  """
+  Counts the files of a new snapshot which were linked from each of
+  its link destinations.
+
+  Attributes:
+      names (list of str): Names of link destinations.
+      hits (list of int): Number of files linked from each.
+      bytes (list of int): Size of files linked from each.
+  """
+
+  def __init__(self, names, sink_path):
+    self.names = names
+    self.hits = [0] * len(names)
+    self.bytes = [0] * len(names)
+    manifests_dir = os.path.join(sink_path, ".emu", "manifests")
+    # Link destinations without manifests are not walked:
+    self._cursors = [manifest.Cursor(manifest.entries(manifests_dir, name))
+                     for name in names]
+
+  def add(self, entry, st):
+    # Entries carried over from the parent are passed without a stat,
+    # see manifest.Manifest.write():
+    if entry.type != "f" or (st is not None and st.st_nlink == 1):
+      return
+    for i, cursor in enumerate(self._cursors):
+      dest = cursor.get(entry.path)
+      if dest is not None and dest.ino == entry.ino:
+        self.hits[i] += 1
+        self.bytes[i] += entry.size
+        break
+
+  def items(self):
+    return list(zip(self.names, self.hits, self.bytes))
+
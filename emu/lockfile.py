@@ -21,8 +21,10 @@ Adapted from labm8, see: https://github.com/ChrisCummins/labm8
 from __future__ import print_function
 
 import datetime
+import fcntl
 import os
 import time
+from contextlib import contextmanager
 
 
 class Error(Exception):
@@ -83,6 +85,11 @@ class LockFile:
   """
   A lock file.
 
+  A lock is either held exclusively by a single process, or shared by
+  any number of processes. The lock file contains one line per
+  holder. Changes to the lock file are serialised using an advisory
+  lock on a sidecar "guard" file.
+
   Attributes:
       path (str): Path of lock file.
   """
@@ -118,13 +125,29 @@ class LockFile:
     """
     return os.path.exists(self.path)
 
+  @property
+  def holders(self):
+    """
+    The (pid, date, shared) tuples of every holder of the lock.
+    """
+    return LockFile.read_holders(self.path)
+
+  @property
+  def isshared(self):
+    """
+    Whether the lock is held in shared mode.
+    """
+    holders = self.holders
+    return bool(holders) and all(shared for _, _, shared in holders)
+
   @property
   def isstale(self):
     """
-    A lock is stale if it is claimed by a process which is not running.
+    A lock is stale if it is claimed only by processes which are not
+    running.
     """
     if self.islocked:
-      return not isprocess(self.pid)
+      return not any(isprocess(pid) for pid, _, _ in self.holders)
     else:
       return False
 
@@ -133,9 +156,35 @@ class LockFile:
     """
     Whether the directory is locked by the current process.
     """
-    return self.pid == os.getpid()
+    return any(pid == os.getpid() for pid, _, _ in self.holders)
 
-  def acquire(self, replace_stale=False, force=False):
+  @contextmanager
+  def _guard(self):
+    """
+    Serialise modifications of the lock file between processes.
+
+    The guard file is removed when the lock is released by its last
+    holder, so a guard which was unlinked while we waited for it is
+    re-opened.
+    """
+    guard_path = self.path + ".guard"
+    while True:
+      guard = open(guard_path, "a")
+      fcntl.flock(guard, fcntl.LOCK_EX)
+      try:
+        if os.stat(guard_path).st_ino == os.fstat(guard.fileno()).st_ino:
+          break
+      except FileNotFoundError:
+        pass
+      guard.close()
+
+    try:
+      yield
+    finally:
+      fcntl.flock(guard, fcntl.LOCK_UN)
+      guard.close()
+
+  def acquire(self, replace_stale=False, force=False, shared=False):
     """
     Acquire the lock.
 
@@ -143,6 +192,7 @@ class LockFile:
         1. The lock is unheld by anyone.
         2. The lock is held but the 'force' argument is set.
         3. The lock is held by the current process.
+        4. The lock is shared, and the 'shared' argument is set.
 
     Arguments:
         replace_stale (bool, optional) If true, lock can be aquired from
@@ -150,6 +200,9 @@ class LockFile:
             the parent lock, but no process with that PID is alive.
         force (bool, optional): If true, ignore any existing
           lock. If false, fail if lock already claimed.
+        shared (bool, optional): If true, acquire the lock in shared
+          mode, allowing other processes to also acquire it in shared
+          mode.
 
     Returns:
         LockFile: self.
@@ -158,23 +211,22 @@ class LockFile:
         UnableToAcquireLockError: If the lock is already claimed
           (not raised if force option is used).
     """
+    with self._guard():
+      holders = self.holders
+      me = (os.getpid(), time.time(), shared)
 
-    def _create_lock():
-      LockFile.write(self.path, os.getpid(), time.time())
-
-    if self.islocked:
-      lock_owner_pid = self.pid
-
-      if self.owned_by_self:
+      if any(pid == os.getpid() for pid, _, _ in holders):
         pass  # don't replace existing lock
-      elif force:
-        _create_lock()
+      elif not holders or force:
+        LockFile.write_holders(self.path, [me])
       elif replace_stale and self.isstale:
-        _create_lock()
+        LockFile.write_holders(self.path, [me])
+      elif shared and self.isshared:
+        # Join the existing shared holders, discarding stale ones:
+        live = [h for h in holders if isprocess(h[0])]
+        LockFile.write_holders(self.path, live + [me])
       else:
         raise UnableToAcquireLockError(self)
-    else:  # new lock
-      _create_lock()
 
     return self
 
@@ -182,7 +234,8 @@ class LockFile:
     """
     Release lock.
 
-    To release a lock, we must already own the lock.
+    To release a lock, we must already own the lock. Releasing a
+    shared lock only removes the current process from its holders.
 
     Arguments:
         force (bool, optional): If true, ignore any existing lock owner.
@@ -195,10 +248,19 @@ class LockFile:
     if not self.islocked:
       return
 
-    if self.owned_by_self or force:
-      os.remove(self.path)
-    else:
-      raise UnableToReleaseLockError(self)
+    with self._guard():
+      holders = self.holders
+      others = [h for h in holders if h[0] != os.getpid()]
+
+      if force or not others and len(others) < len(holders):
+        os.remove(self.path)
+        # Remove the guard while it is still held, so that waiting
+        # processes re-open a new one:
+        os.remove(self.path + ".guard")
+      elif len(others) < len(holders):
+        LockFile.write_holders(self.path, others)
+      else:
+        raise UnableToReleaseLockError(self)
 
   def __repr__(self):
     return self.path
@@ -222,15 +284,40 @@ class LockFile:
             date the lock was required. If the lock is not claimed, both
             values are None.
     """
-    if os.path.exists(path):
-      with open(path) as infile:
-        components = infile.read().split()
-        pid = int(components[0])
-        date = datetime.datetime.fromtimestamp(float(components[1]))
+    holders = LockFile.read_holders(path)
+    if holders:
+      pid, date, _ = holders[0]
       return pid, date
     else:
       return None, None
 
+  @staticmethod
+  def read_holders(path):
+    """
+    Read the holders of a LockFile.
+
+    Arguments:
+        path (str): Path to lockfile.
+
+    Returns:
+        list of Tuple(int, datetime, bool): The integer PID of each lock
+          holder, the date the lock was acquired, and whether it is
+          held in shared mode.
+    """
+    holders = []
+    try:
+      with open(path) as infile:
+        for line in infile:
+          components = line.split()
+          if len(components) >= 2:
+            pid = int(components[0])
+            date = datetime.datetime.fromtimestamp(float(components[1]))
+            shared = len(components) > 2 and components[2] == "shared"
+            holders.append((pid, date, shared))
+    except FileNotFoundError:
+      pass
+    return holders
+
   @staticmethod
   def write(path, pid, timestamp):
     """
@@ -241,5 +328,27 @@ class LockFile:
         pid (int): The integer process ID.
         timestamp (datetime): The time the lock was aquired.
     """
-    with open(path, "w") as lockfile:
-      print(pid, timestamp, file=lockfile)
+    LockFile.write_holders(path, [(pid, timestamp, False)])
+
+  @staticmethod
+  def write_holders(path, holders):
+    """
+    Write the holders of a LockFile.
+
+    Arguments:
+        path (str): Path to lockfile.
+        holders (list of Tuple(int, float or datetime, bool)): The
+          PID, time of acquisition, and shared mode of each holder.
+    """
+    # Write to a temporary file and rename it into place, so that
+    # readers never see a partially written lock file:
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as lockfile:
+      for pid, date, shared in holders:
+        if isinstance(date, datetime.datetime):
+          date = date.timestamp()
+        if shared:
+          print(pid, date, "shared", file=lockfile)
+        else:
+          print(pid, date, file=lockfile)
+    os.replace(tmp_path, path)
@@ -0,0 +1,515 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Snapshot file manifests.
+
+A manifest lists every entry of a snapshot tree, so that the contents
+of a snapshot can be queried without walking the tree. Manifests are
+gzipped text files at <sink>/.emu/manifests/<snapshot>, with one
+entry per line:
+
+    <type> <size> <mtime_ns> <mode> <inode> <path>
+
+Fields are tab separated. The type is one of "d" (directory), "f"
+(regular file), "l" (symbolic link), or "o" (other). Entries are
+sorted by path components, which is the order of a depth-first walk
+visiting names in sorted order. Directories cannot be hardlinked
+between snapshots, so their inode is recorded as 0.
+
+Most manifests are encoded as a delta against the manifest of the
+parent snapshot, listing only added or changed entries ("+" lines)
+and removed paths ("-" lines). To bound the cost of reading, every
+KEYFRAME_INTERVAL-th manifest in a chain of deltas is written in
+full.
+"""
+import gzip
+import os
+import re
+import stat
+from collections import namedtuple
+
+from emu import io
+
+
+VERSION = 1
+KEYFRAME_INTERVAL = 32
+
+Entry = namedtuple("Entry", ["path", "type", "size", "mtime", "mode", "ino"])
+
+
+class TreeSummary:
+  """
+  Counts of the entries of a tree.
+  """
+
+  def __init__(self):
+    self.files = 0
+    self.directories = 0
+    self.symlinks = 0
+    self.other = 0
+    self.size = 0
+
+  def add(self, entry):
+    if entry.type == "f":
+      self.files += 1
+      self.size += entry.size
+    elif entry.type == "d":
+      self.directories += 1
+    elif entry.type == "l":
+      self.symlinks += 1
+    else:
+      self.other += 1
+
+  def items(self):
+    return [("files", self.files), ("directories", self.directories),
+            ("symlinks", self.symlinks), ("other", self.other),
+            ("size", self.size)]
+
+
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n"}
+_UNESCAPES = {v: k for k, v in _ESCAPES.items()}
+
+
+def _escape(path):
+  return re.sub(r"[\\\t\n]", lambda m: _ESCAPES[m.group()], path)
+
+
+def _unescape(path):
+  if "\\" not in path:
+    return path
+  return re.sub(r"\\[\\tn]", lambda m: _UNESCAPES[m.group()], path)
+
+
+def key(path):
+  """
+  The sort key of a path.
+
+  >>> sorted(["a.b", "a/b", "a"], key=key)
+  ['a', 'a/b', 'a.b']
+  """
+  return path.split("/")
+
+
+def _format(entry):
+  return "{}\t{}\t{}\t{:o}\t{}\t{}\n".format(
+      entry.type, entry.size, entry.mtime, entry.mode, entry.ino,
+      _escape(entry.path))
+
+
+def _parse(fields):
+  type, size, mtime, mode, ino, path = fields
+  return Entry(_unescape(path), type, int(size), int(mtime), int(mode, 8),
+               int(ino))
+
+
+def _type(mode):
+  if stat.S_ISDIR(mode):
+    return "d"
+  elif stat.S_ISREG(mode):
+    return "f"
+  elif stat.S_ISLNK(mode):
+    return "l"
+  else:
+    return "o"
+
+
+def _entry(path, st):
+  type = _type(st.st_mode)
+  return Entry(path, type, st.st_size if type != "d" else 0,
+               st.st_mtime_ns, stat.S_IMODE(st.st_mode),
+               st.st_ino if type != "d" else 0)
+
+
+def _walk(dirpath, prefix):
+  with os.scandir(dirpath) as it:
+    entries = sorted(it, key=lambda e: e.name)
+  for e in entries:
+    st = e.stat(follow_symlinks=False)
+    entry = _entry(prefix + e.name, st)
+    yield entry, st
+    if entry.type == "d":
+      yield from _walk(e.path, entry.path + "/")
+
+
+def walk(tree):
+  """
+  Walk a tree, yielding an Entry and the stat result of everything
+  beneath it in sorted order.
+  """
+  yield from _walk(tree, "")
+
+
+def ancestors(paths):
+  """
+  The ancestor directories of a collection of paths.
+
+  >>> sorted(ancestors(["a/b/c", "a/d", "e"]))
+  ['a', 'a/b']
+  """
+  dirs = set()
+  for path in paths:
+    components = path.split("/")
+    dirs.update("/".join(components[:i]) for i in range(1, len(components)))
+  return dirs
+
+
+def covered(path, paths):
+  """
+  Whether a path or any of its ancestors is in a set of paths.
+
+  >>> covered("a/b/c", {"a/b"}), covered("a", {"a/b"})
+  (True, False)
+  """
+  components = path.split("/")
+  return any("/".join(components[:i]) in paths
+             for i in range(1, len(components) + 1))
+
+
+def walk_paths(tree, paths):
+  """
+  Walk only the given paths of a tree, yielding an Entry and the stat
+  result of each path, everything beneath it, and its ancestors, in
+  sorted order. Paths which do not exist are skipped.
+
+  Arguments:
+      tree (str): Path of the tree.
+      paths (list of str): Paths relative to the tree root, none of
+        which is beneath another, see journal.compact().
+  """
+  visited = set()
+  for path in sorted(paths, key=key):
+    components = path.split("/")
+    for i in range(1, len(components) + 1):
+      relpath = "/".join(components[:i])
+      if relpath in visited:
+        continue
+      visited.add(relpath)
+      try:
+        st = os.lstat(os.path.join(tree, relpath))
+      except FileNotFoundError:
+        break
+      entry = _entry(relpath, st)
+      yield entry, st
+      if entry.type != "d":
+        break
+      elif relpath == path:
+        yield from _walk(os.path.join(tree, path), path + "/")
+
+
+def patch(entries, paths, changed):
+  """
+  Merge the entries of changed paths with the entries of the parent
+  snapshot which they were staged from, see journal.stage().
+
+  Arguments:
+      entries (iterable of Entry): Sorted entries of the parent.
+      paths (list of str): Changed paths.
+      changed (iterable of Tuple(Entry, os.stat_result)): Entries and
+        stat results of the changed paths and their ancestors, see
+        walk_paths().
+
+  Yields:
+      Tuple(Entry, os.stat_result): Sorted entries of the new snapshot.
+        The stat result of entries which are carried over from the
+        parent is None.
+  """
+  paths = set(paths)
+  # Ancestors of changed paths are replaced by their new entries:
+  replaced = ancestors(paths)
+
+  unchanged = (e for e in entries
+               if e.path not in replaced and not covered(e.path, paths))
+  changed = iter(changed)
+  a, b = next(unchanged, None), next(changed, None)
+  while a is not None or b is not None:
+    if b is None or (a is not None and key(a.path) < key(b[0].path)):
+      yield a, None
+      a = next(unchanged, None)
+    else:
+      yield b
+      b = next(changed, None)
+
+
+def scan(tree):
+  """
+  Walk a tree, yielding an Entry for everything beneath it in sorted
+  order.
+  """
+  for entry, _ in walk(tree):
+    yield entry
+
+
+def diff(old, new):
+  """
+  Merge two sorted entry streams.
+
+  Yields:
+      Tuple(Entry, Entry): Pairs of old and new entries which differ.
+        The old entry is None for added paths, and the new entry is
+        None for removed paths.
+  """
+  old, new = iter(old), iter(new)
+  a, b = next(old, None), next(new, None)
+  while a is not None or b is not None:
+    if b is None or (a is not None and key(a.path) < key(b.path)):
+      yield a, None
+      a = next(old, None)
+    elif a is None or key(b.path) < key(a.path):
+      yield None, b
+      b = next(new, None)
+    else:
+      if a != b:
+        yield a, b
+      a, b = next(old, None), next(new, None)
+
+
+class Cursor:
+  """
+  Looks up the entries of a sorted entry stream, for paths which are
+  visited in sorted order.
+  """
+
+  def __init__(self, entries):
+    self._entries = iter(entries)
+    self._entry = next(self._entries, None)
+
+  def get(self, path):
+    """
+    Return the entry of a path, or None. Paths must be passed in
+    sorted order.
+    """
+    k = key(path)
+    while self._entry is not None and key(self._entry.path) < k:
+      self._entry = next(self._entries, None)
+    if self._entry is not None and self._entry.path == path:
+      return self._entry
+
+
+def entries(manifests_dir, name, tree=None):
+  """
+  The sorted entries of a snapshot, read from its manifest if it has
+  one.
+
+  Arguments:
+      manifests_dir (str): Path of the sink's manifests directory.
+      name (str): Snapshot name.
+      tree (str, optional): Path of the snapshot tree, which is walked
+        if the snapshot has no manifest.
+
+  Returns:
+      iterable of Entry: Entries, or no entries if the snapshot has no
+        manifest and no tree is provided.
+  """
+  m = Manifest(manifests_dir, name)
+  if m.exists:
+    return iter(m)
+  elif tree is not None and os.path.isdir(tree):
+    return scan(tree)
+  return iter([])
+
+
+class Manifest:
+  """
+  The manifest of a snapshot.
+
+  Attributes:
+      name (str): Snapshot name.
+      path (str): Path of manifest file.
+  """
+
+  def __init__(self, manifests_dir, name):
+    self.name = name
+    self.dir = manifests_dir
+    self.path = os.path.join(manifests_dir, name)
+
+  @property
+  def exists(self):
+    return os.path.exists(self.path)
+
+  def header(self):
+    """
+    Read the manifest header.
+
+    Returns:
+        Tuple(str, int): The name of the snapshot which this manifest
+          is a delta against, or None if it is a full manifest, and the
+          number of deltas in the chain.
+    """
+    with gzip.open(self.path, "rt", encoding="utf-8",
+                   errors="surrogateescape") as infile:
+      return Manifest._parse_header(infile.readline())
+
+  @staticmethod
+  def _parse_header(line):
+    fields = line.split()
+    if fields[:3] != ["#", "emu-manifest", str(VERSION)]:
+      raise ValueError("unrecognised manifest format")
+    if fields[3] == "delta":
+      return fields[4], int(fields[5])
+    return None, 0
+
+  def __iter__(self):
+    """
+    Stream the entries of the manifest, in sorted order.
+    """
+    with gzip.open(self.path, "rt", encoding="utf-8",
+                   errors="surrogateescape") as infile:
+      base, _ = Manifest._parse_header(infile.readline())
+
+      if base is None:
+        for line in infile:
+          yield _parse(line.rstrip("\n").split("\t"))
+        return
+
+      # Merge the delta with the base manifest:
+      parent = iter(Manifest(self.dir, base))
+
+      def _delta():
+        for line in infile:
+          fields = line.rstrip("\n").split("\t")
+          if fields[0] == "-":
+            yield _unescape(fields[1]), None
+          else:
+            entry = _parse(fields[1:])
+            yield entry.path, entry
+
+      a = next(parent, None)
+      for path, entry in _delta():
+        k = key(path)
+        while a is not None and key(a.path) < k:
+          yield a
+          a = next(parent, None)
+        if a is not None and a.path == path:
+          a = next(parent, None)
+        if entry is not None:
+          yield entry
+      while a is not None:
+        yield a
+        a = next(parent, None)
+
+  def lookup(self, path):
+    """
+    Find the entry of a path, or None if it is not in the snapshot.
+    """
+    k = key(path)
+    for entry in self:
+      if entry.path == path:
+        return entry
+      elif key(entry.path) > k:
+        return None
+    return None
+
+  def _write(self, entries, base=None):
+    """
+    Write the manifest from a stream of entries, atomically.
+
+    Arguments:
+        entries (iterable of Entry): Sorted entries.
+        base (Manifest, optional): Manifest to encode a delta against.
+
+    Returns:
+        TreeSummary: Summary of the entries.
+    """
+    summary = TreeSummary()
+
+    def _summarise(entries):
+      for entry in entries:
+        summary.add(entry)
+        yield entry
+
+    entries = _summarise(entries)
+
+    depth = 0
+    if base is not None:
+      if base.exists:
+        depth = base.header()[1] + 1
+      if depth >= KEYFRAME_INTERVAL or not base.exists:
+        base = None
+
+    os.makedirs(self.dir, exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+    with gzip.open(tmp_path, "wt", encoding="utf-8",
+                   errors="surrogateescape") as outfile:
+      if base is None:
+        outfile.write("# emu-manifest {} full\n".format(VERSION))
+        for entry in entries:
+          outfile.write(_format(entry))
+      else:
+        outfile.write("# emu-manifest {} delta {} {}\n"
+                      .format(VERSION, base.name, depth))
+        for old, new in diff(base, entries):
+          if new is None:
+            outfile.write("-\t{}\n".format(_escape(old.path)))
+          else:
+            outfile.write("+\t" + _format(new))
+    os.replace(tmp_path, self.path)
+
+    io.debug("Wrote manifest '{}'".format(self.path))
+    return summary
+
+  def write(self, tree, parent=None, observers=(), changes=None):
+    """
+    Write the manifest of a snapshot tree.
+
+    Arguments:
+        tree (str): Path of the snapshot tree.
+        parent (str, optional): Name of the parent snapshot.
+        observers (list, optional): Objects whose add() method is
+          called with every entry and its stat result, so that they
+          share the walk of the tree.
+        changes (list of str, optional): If provided, the tree was
+          staged from the parent with only these paths changed, see
+          journal.stage(). Only the changed paths are walked, and the
+          other entries are read from the parent's manifest. Observers
+          are passed a stat result of None for those entries.
+
+    Returns:
+        TreeSummary: Summary of the tree.
+    """
+    base = Manifest(self.dir, parent) if parent else None
+    if changes is None:
+      stream = walk(tree)
+    else:
+      stream = patch(iter(base), changes, walk_paths(tree, changes))
+
+    def _observe():
+      for entry, st in stream:
+        for observer in observers:
+          observer.add(entry, st)
+        yield entry
+
+    return self._write(_observe(), base=base)
+
+  def rebase(self, parent=None):
+    """
+    Re-encode the manifest against a different parent snapshot.
+
+    This must be performed before the manifest's current base is
+    removed.
+
+    Arguments:
+        parent (str, optional): Name of the new parent snapshot.
+    """
+    base = Manifest(self.dir, parent) if parent else None
+    # The manifest is only replaced once it has been read in full:
+    self._write(iter(self), base=base)
+
+  def remove(self):
+    try:
+      os.remove(self.path)
+    except FileNotFoundError:
+      pass
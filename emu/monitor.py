@@ -1,9 +1,14 @@
+import bisect
 import datetime
+import json
+import math
 import os
-from itertools import chain
-from typing import Dict, List
+import threading
+import time
+from typing import Dict, List, Tuple
 
 import emu
+import emu.usage
 import flask
 import humanize
 from flask import Flask
@@ -16,94 +21,692 @@ def unexpand_user(path: str) -> str:
   return path.replace(os.path.expanduser("~"), "~", 1)
 
 
-def get_sink_data(sink: emu.Sink) -> Dict[str, str]:
-  d = {
+# Seconds between checks for changes to the cached data:
+REFRESH_INTERVAL = 5
+
+# Number of snapshots per page of the timeline, by default and at most:
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Seconds between checks for changes to the status of pushes, and
+# between keep-alive comments on idle event streams:
+EVENTS_INTERVAL = 1
+KEEPALIVE_INTERVAL = 15
+
+# Seconds after which an event stream is closed if no push is running,
+# and after which clients reconnect:
+EVENTS_IDLE_TIMEOUT = 300
+EVENTS_RETRY = 30
+
+
+def get_space(sink: emu.Sink) -> Dict[str, int]:
+  """
+  Read the space on a sink's device, using a single statvfs().
+  """
+  statvfs = os.statvfs(sink.path)
+  pending = sink.pending_trash_space
+  capacity = statvfs.f_blocks * statvfs.f_frsize
+  free = statvfs.f_bavail * statvfs.f_frsize + pending
+  return {
+    "used": (statvfs.f_blocks - statvfs.f_bavail) * statvfs.f_frsize - pending,
+    "free": free,
+    "total": capacity,
+    "free_ratio": free / capacity if capacity else 0,
+    "pending": pending,
+    "inodes": statvfs.f_files,
+    "inodes_free": statvfs.f_favail,
+  }
+
+
+def get_head_metrics(snapshot: emu.Snapshot) -> Dict[str, float]:
+  """
+  Read the metrics of a snapshot's push from its node.
+  """
+  node = snapshot.node
+  metrics = {}
+  if node.has_section("Timings"):
+    metrics["emu_last_push_duration_seconds"] = sum(
+        float(elapsed) for _, elapsed in node.items("Timings"))
+  if node.has_section("Stats"):
+    stats = dict(node.items("Stats"))
+    written = stats.get("literal-data", stats.get("bytes-copied"))
+    if written is not None:
+      metrics["emu_last_push_bytes"] = int(written)
+  return metrics
+
+
+def get_sink_state(sink: emu.Sink) -> Dict[str, object]:
+  """
+  Read the state of a sink which is cached by the monitor.
+  """
+  in_progress = sink.is_inprogress
+  index = sink.index
+  head = sink.head()
+  return {
     "name": sink.name,
     "path": unexpand_user(sink.path),
+    "space": get_space(sink),
+    "in_progress": in_progress,
+    "lock_date": sink.lock.date if in_progress else None,
+    "snapshots": len(index),
+    "head_date": index.get(head.name).date if head else None,
+    "head_metrics": get_head_metrics(head) if head else {},
+  }
+
+
+def get_sink_data(state: Dict[str, object],
+                  now: datetime.datetime) -> Dict[str, str]:
+  space = state["space"]
+  d = {
+    "name": state["name"],
+    "path": state["path"],
     "space": {
-      "used": humanize.naturalsize(sink.used_space_on_device),
-      "free": humanize.naturalsize(sink.free_space_on_device),
-      "total": humanize.naturalsize(sink.device_capacity),
-      "ratio_used": int((1 - sink.free_space_ratio) * 100),
-      "ratio_free": int(sink.free_space_ratio * 100),
-    }
+      "used": humanize.naturalsize(space["used"]),
+      "free": humanize.naturalsize(space["free"]),
+      "total": humanize.naturalsize(space["total"]),
+      "ratio_used": int((1 - space["free_ratio"]) * 100),
+      "ratio_free": int(space["free_ratio"] * 100),
+    },
+    "in_progress": state["in_progress"],
+    "in_progress_since": None,
   }
 
-  if sink.is_inprogress:
-    d["in_progress"] = True
-    d["in_progress_since"] = (
-        datetime.datetime.now() - sink.lock.date).total_seconds()
-  else:
-    d["in_progress"] = False
-    d["in_progress_since"] = None
+  if state["in_progress"] and state["lock_date"]:
+    d["in_progress_since"] = (now - state["lock_date"]).total_seconds()
 
   return d
 
 
-def get_snapshot_data(snapshot: emu.Snapshot) -> Dict[str, str]:
+def get_usage_data(usage: emu.usage.Usage) -> Dict[str, str]:
+  return {
+    "total": humanize.naturalsize(usage.total),
+    "exclusive": humanize.naturalsize(usage.exclusive),
+    "shared": humanize.naturalsize(usage.total - usage.exclusive),
+    "shared_parent": humanize.naturalsize(usage.shared_parent),
+    "shared_child": humanize.naturalsize(usage.shared_child),
+    "stale": usage.stale,
+  }
+
+
+def get_snapshot_record(snapshot: emu.Snapshot,
+                        parent: str) -> Dict[str, object]:
+  """
+  Read the data of a snapshot which is cached by the monitor.
+
+  Arguments:
+      snapshot: The snapshot.
+      parent: The name of the snapshot's parent, from the sink index.
+  """
+  usage = snapshot.usage
   return {
     "sink": snapshot.sink.name,
     "name": snapshot.name,
-    "how_long_ago": humanize.naturaltime(
-        datetime.datetime.now() - snapshot.date),
-    "seconds_ago": (datetime.datetime.now() - snapshot.date).total_seconds(),
+    "parent": parent,
+    "date": snapshot.date,
+    "usage": get_usage_data(usage) if usage else None,
   }
 
 
-def get_snapshots_data(source: emu.Source) -> List[Dict[str, str]]:
-  snapshots = sum(chain(list(sink.snapshots()) for sink in source.sinks()), [])
-  snapshots = list(
-      reversed(sorted(snapshots, key=lambda x: x.id.snapshot_name)))
-  data = list(get_snapshot_data(snapshot) for snapshot in snapshots)
+def timeline_spacing(gap: float) -> int:
+  """
+  The vertical spacing of a snapshot in the timeline, in pixels, given
+  the number of seconds between it and the next newest snapshot.
+  Spacing grows logarithmically, so that long gaps don't dominate.
+  """
+  return int(min(200, 40 * math.log10(1 + max(gap, 0) / 60)))
+
+
+def get_snapshot_data(record: Dict[str, object], now: datetime.datetime,
+                      newer: Dict[str, object] = None) -> Dict[str, str]:
+  """
+  Present a cached snapshot record.
+
+  Arguments:
+      record: The snapshot's cached record.
+      now: The current time.
+      newer: The record of the next newest snapshot, if any.
+  """
+  gap = ((newer["date"] if newer else now) - record["date"]).total_seconds()
+  return {
+    "sink": record["sink"],
+    "name": record["name"],
+    "timestamp": record["date"].timestamp(),
+    "how_long_ago": humanize.naturaltime(now - record["date"]),
+    "seconds_ago": (now - record["date"]).total_seconds(),
+    "spacing": timeline_spacing(gap),
+    "usage": record["usage"],
+  }
+
+
+def _cursor_key(cursor: str) -> Tuple[str, str]:
+  name, _, sink = cursor.partition("/")
+  return name, sink
+
+
+def _time_key(timestamp: float) -> str:
+  return datetime.datetime.fromtimestamp(timestamp).strftime(
+      "%Y-%m-%d-%H%M%S")
+
+
+def get_snapshots_page(data: Dict[str, object], now: datetime.datetime,
+                       cursor: str = None, limit: int = PAGE_SIZE,
+                       since: float = None, until: float = None,
+                       sink: str = None) -> Tuple[List[Dict[str, str]], str]:
+  """
+  Return a page of snapshots from the cached data, newest first.
+
+  The cached snapshots are sorted, so a page is found by bisection,
+  and the cost of a request is proportional to the size of the page
+  rather than to the number of snapshots.
+
+  Arguments:
+      data: Cached data.
+      now: The current time.
+      cursor: Return snapshots older than this cursor, as returned by
+        a previous call.
+      limit: Maximum number of snapshots to return.
+      since: Return only snapshots created at or after this UNIX time.
+      until: Return only snapshots created at or before this UNIX time.
+      sink: Return only snapshots in the sink with this name.
+
+  Returns:
+      The snapshots, and the cursor of the next page, or None if there
+      are no more snapshots.
+  """
+  records, keys = data["snapshots"], data["keys"]
+
+  end = len(keys)
+  if cursor:
+    end = bisect.bisect_left(keys, _cursor_key(cursor))
+  if until is not None:
+    end = min(end, bisect.bisect_right(keys, (_time_key(until), "\uffff")))
+  start = 0
+  if since is not None:
+    start = bisect.bisect_left(keys, (_time_key(since), ""))
+
+  page = []
+  i = end
+  while i > start and len(page) < limit:
+    i -= 1
+    if sink is None or keys[i][1] == sink:
+      newer = records[i + 1] if i + 1 < len(records) else None
+      page.append(get_snapshot_data(records[i], now, newer))
+
+  next_cursor = None
+  if len(page) == limit and i > start:
+    next_cursor = "{}/{}".format(*keys[i])
+  return page, next_cursor
+
+
+class Cache:
+  """
+  An in-memory copy of the data shown by the monitor.
+
+  A background thread checks the source's sinks for changes every
+  'interval' seconds. Requests are served from the cache, which is
+  refreshed synchronously if the background thread has fallen more
+  than two intervals behind. The thread also checks the status of
+  pushes every 'events_interval' seconds, and wakes the event streams
+  which are waiting for them to change, see statuses().
+
+  The cache owns its source, and only uses it while holding the
+  refresh lock, since sinks and their indexes are not thread safe.
+  Snapshot records are kept between refreshes, and a sink's nodes are
+  only read when its nodes directory or lock state changes. Even then,
+  only the nodes whose records may have changed are read: those which
+  were added or re-parented, and the neighbours of added and removed
+  snapshots. The records of snapshots whose disk usage is stale are
+  re-read on every refresh, until it is recomputed.
+  """
+
+  def __init__(self, source_dir: str, interval: float = REFRESH_INTERVAL,
+               events_interval: float = EVENTS_INTERVAL):
+    self.source_dir = source_dir
+    self.interval = interval
+    self.events_interval = events_interval
+    self._lock = threading.Lock()
+    self._refresh_lock = threading.Lock()
+    self._source = None
+    self._source_mtime = None
+    self._sinks = {}  # Maps sink paths to their key and records.
+    self._data = None
+    self._updated = 0
+    self._thread = None
+    # The status of each sink's push, and the number of times that
+    # they have changed:
+    self._statuses = {}
+    self._status_version = 0
+    self._status_changed = threading.Condition()
+
+  @staticmethod
+  def _key(sink: emu.Sink):
+    nodes_dir = os.path.join(sink.path, ".emu", "nodes")
+    return os.stat(nodes_dir).st_mtime_ns, sink.lock.islocked
+
+  def _get_source(self) -> emu.Source:
+    """
+    Return the cached source, reloading it if its sinks have changed.
+    """
+    sinks_dir = os.path.join(self.source_dir, ".emu", "sinks")
+    mtime = os.stat(sinks_dir).st_mtime_ns
+    if mtime != self._source_mtime:
+      self._source = emu.Source(self.source_dir)
+      self._source_mtime = mtime
+    return self._source
+
+  @staticmethod
+  def _update_records(sink: emu.Sink,
+                      records: Dict[str, Dict[str, object]]):
+    """
+    Update the records of a sink's snapshots from its index, reading
+    only the nodes whose records may have changed.
 
-  # determine timeline positions
-  gaps = [data[0]["seconds_ago"]]
-  for i in range(1, len(data)):
-    gaps.append(data[i]["seconds_ago"] - data[i - 1]["seconds_ago"])
-  mingap = min(gaps)
-  gaps = [g / mingap for g in gaps]  # normalize
-  acc = 0
-  for d, gap in zip(data, gaps):
-    acc += gap
-    d["position"] = acc
-    d["padding_top"] = gap
+    Returns:
+        The new records, keyed by snapshot name.
+    """
+    index = sink.index
+    parents = {entry.name: entry.parent for entry in index.entries()}
 
-  return data
+    reread = set()
+    for name, parent in parents.items():
+      record = records.get(name)
+      if record is None:
+        # The parent of a new snapshot shares files with it:
+        reread.update((name, parent))
+      elif record["parent"] != parent:
+        reread.add(name)
+    for name, record in records.items():
+      if name not in parents:
+        # The surviving ancestor of a removed snapshot is marked stale:
+        ancestor = record["parent"]
+        while ancestor in records and ancestor not in parents:
+          ancestor = records[ancestor]["parent"]
+        reread.add(ancestor)
+
+    updated = {}
+    for name, parent in parents.items():
+      record = records.get(name)
+      if (name in reread or
+          record["usage"] is not None and record["usage"]["stale"]):
+        fresh = get_snapshot_record(
+            emu.Snapshot(emu.SnapshotID(sink.name, name), sink), parent)
+        # Unchanged records are kept, so that they are not re-sorted:
+        if fresh != record:
+          record = fresh
+      updated[name] = record
+    return updated
+
+  def refresh(self):
+    """
+    Update the cached data from disk.
+    """
+    with self._refresh_lock:
+      source = self._get_source()
+      sinks, changed = [], False
+      sink_records = {}
+      for sink in source.sinks():
+        key = Cache._key(sink)
+        cached_key, records = self._sinks.get(sink.path, (None, {}))
+        stale = any(r["usage"] is not None and r["usage"]["stale"]
+                    for r in records.values())
+        if key != cached_key or stale:
+          updated = Cache._update_records(sink, records)
+          changed |= (updated.keys() != records.keys() or
+                      any(updated[name] is not records[name]
+                          for name in updated))
+          records = updated
+          self._sinks[sink.path] = (key, records)
+        sinks.append(get_sink_state(sink))
+        sink_records[sink.path] = records
+
+      # Forget removed sinks:
+      if set(self._sinks) != set(sink_records):
+        self._sinks = {path: self._sinks[path] for path in sink_records}
+        changed = True
+
+      with self._lock:
+        data = self._data
+      if changed or data is None:
+        # Snapshots are sorted oldest first, for pagination:
+        snapshots = sorted(
+            (r for records in sink_records.values()
+             for r in records.values()),
+            key=lambda x: (x["name"], x["sink"]))
+        keys = [(x["name"], x["sink"]) for x in snapshots]
+      else:
+        snapshots, keys = data["snapshots"], data["keys"]
+
+      with self._lock:
+        self._data = {
+          "source": {"path": unexpand_user(source.path)},
+          "sinks": sinks,
+          "snapshots": snapshots,
+          "keys": keys,
+        }
+        self._updated = time.time()
+
+  def poll_status(self):
+    """
+    Check the status files of the sinks for changes.
+
+    Status files left by pushes which are no longer running are
+    ignored. Event streams are woken if any status has changed.
+    """
+    with self._refresh_lock:
+      statuses = {}
+      for sink in self._get_source().sinks():
+        try:
+          mtime = os.stat(sink.status_path).st_mtime_ns
+        except FileNotFoundError:
+          mtime = None
+        # Status files are only re-read once they change, but a push
+        # may have died since:
+        previous = self._statuses.get(sink.name)
+        if previous and previous[0] == mtime:
+          status = previous[1]
+        else:
+          status = sink.status if mtime else None
+        if status and not (sink.lock.islocked and not sink.lock.isstale):
+          status = None
+        statuses[sink.name] = (mtime, status)
+
+    with self._status_changed:
+      if statuses != self._statuses:
+        self._statuses = statuses
+        self._status_version += 1
+        self._status_changed.notify_all()
+
+  def statuses(self, version: int = None,
+               timeout: float = None) -> Tuple[int, Dict[str, object]]:
+    """
+    Return the status of each sink's push, waiting for it to change.
+
+    Arguments:
+        version: The version of the statuses last returned. If they
+          are unchanged, wait up to 'timeout' seconds for a change.
+        timeout: Seconds to wait.
+
+    Returns:
+        The version of the statuses, and the status of each sink's
+        push, or None if no push is running.
+    """
+    self._start()
+    with self._status_changed:
+      self._status_changed.wait_for(
+          lambda: self._status_version != version, timeout)
+      return self._status_version, {
+        name: status for name, (_, status) in self._statuses.items()}
+
+  def _run(self):
+    next_refresh = 0
+    while True:
+      try:
+        if time.time() >= next_refresh:
+          self.refresh()
+          next_refresh = time.time() + self.interval
+        self.poll_status()
+      except Exception as e:
+        app.logger.warning("Failed to refresh monitor data: %s", e)
+        next_refresh = time.time() + self.interval
+      time.sleep(self.events_interval)
+
+  def _start(self):
+    """
+    Start the background thread, once.
+    """
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+  def get(self) -> Dict[str, object]:
+    """
+    Return the cached data, starting the background thread on first
+    use.
+    """
+    self._start()
+    with self._lock:
+      data, updated = self._data, self._updated
+
+    if data is None or time.time() - updated > 2 * self.interval:
+      self.refresh()
+      with self._lock:
+        data = self._data
+    return data
+
+
+_caches = {}
+
+
+def get_cache(source_dir: str) -> Cache:
+  # Atomic, so concurrent requests share a single cache:
+  return _caches.setdefault(source_dir, Cache(source_dir))
+
+
+def get_source_dir() -> str:
+  """
+  Return the monitored source directory, found once per process.
+  """
+  if "EMU_SOURCE_DIR" not in app.config:
+    app.config["EMU_SOURCE_DIR"] = emu.find_source_dir(".")
+  return app.config["EMU_SOURCE_DIR"]
+
+
+METRICS = [
+  ("emu_snapshots", "gauge", "Number of snapshots in the sink."),
+  ("emu_head_timestamp_seconds", "gauge",
+   "Creation time of the most recent snapshot."),
+  ("emu_head_age_seconds", "gauge", "Age of the most recent snapshot."),
+  ("emu_last_push_duration_seconds", "gauge",
+   "Duration of the push which created the most recent snapshot."),
+  ("emu_last_push_bytes", "gauge",
+   "Bytes written by the push which created the most recent snapshot."),
+  ("emu_push_in_progress", "gauge", "Whether a push is in progress."),
+  ("emu_free_bytes", "gauge", "Free space on the sink's device."),
+  ("emu_capacity_bytes", "gauge", "Capacity of the sink's device."),
+  ("emu_free_inodes", "gauge", "Free inodes on the sink's device."),
+  ("emu_inodes", "gauge", "Number of inodes on the sink's device."),
+]
+
+
+def get_sink_metrics(state: Dict[str, object],
+                     now: float) -> Dict[str, float]:
+  """
+  Collect the metrics of a sink from its cached state.
+
+  Arguments:
+      state: The sink's cached state.
+      now: The current UNIX time.
+  """
+  metrics = {"emu_snapshots": state["snapshots"]}
+
+  if state["head_date"] is not None:
+    metrics["emu_head_timestamp_seconds"] = state["head_date"]
+    metrics["emu_head_age_seconds"] = max(0, now - state["head_date"])
+    metrics.update(state["head_metrics"])
+
+  metrics["emu_push_in_progress"] = 1 if state["in_progress"] else 0
+
+  space = state["space"]
+  metrics["emu_free_bytes"] = space["free"] - space["pending"]
+  metrics["emu_capacity_bytes"] = space["total"]
+  metrics["emu_free_inodes"] = space["inodes_free"]
+  metrics["emu_inodes"] = space["inodes"]
+  return metrics
+
+
+def _escape_label(value: str) -> str:
+  return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+          .replace("\n", "\\n"))
+
+
+def format_metrics(data: Dict[str, object]) -> str:
+  """
+  Format the metrics of a source's sinks in the Prometheus text
+  exposition format.
+
+  Arguments:
+      data: Cached data, see Cache.get().
+  """
+  now = time.time()
+  sink_metrics = [(state["name"], get_sink_metrics(state, now))
+                  for state in data["sinks"]]
+
+  lines = []
+  for name, type, help in METRICS:
+    lines.append("# HELP {} {}".format(name, help))
+    lines.append("# TYPE {} {}".format(name, type))
+    for sink, metrics in sink_metrics:
+      if name in metrics:
+        lines.append('{}{{sink="{}"}} {}'.format(
+            name, _escape_label(sink), metrics[name]))
+  return "\n".join(lines) + "\n"
+
+
+@app.route('/metrics')
+def metrics():
+  cached = get_cache(get_source_dir()).get()
+  return flask.Response(format_metrics(cached),
+                        mimetype="text/plain; version=0.0.4")
+
+
+def _float_arg(name: str) -> float:
+  value = flask.request.args.get(name)
+  try:
+    return float(value) if value is not None else None
+  except ValueError:
+    flask.abort(400, "'{}' must be a UNIX timestamp".format(name))
+
+
+@app.route('/api/sinks')
+def api_sinks():
+  cached = get_cache(get_source_dir()).get()
+  now = datetime.datetime.now()
+  return flask.jsonify(
+      sinks=[get_sink_data(state, now) for state in cached["sinks"]])
+
+
+@app.route('/api/snapshots')
+def api_snapshots():
+  cached = get_cache(get_source_dir()).get()
+  try:
+    limit = int(flask.request.args.get("limit", PAGE_SIZE))
+  except ValueError:
+    flask.abort(400, "'limit' must be an integer")
+  if not 0 < limit <= MAX_PAGE_SIZE:
+    flask.abort(400, "'limit' must be between 1 and {}".format(MAX_PAGE_SIZE))
+
+  snapshots, next_cursor = get_snapshots_page(
+      cached, datetime.datetime.now(),
+      cursor=flask.request.args.get("cursor"), limit=limit,
+      since=_float_arg("since"), until=_float_arg("until"),
+      sink=flask.request.args.get("sink"))
+  return flask.jsonify(snapshots=snapshots, next=next_cursor,
+                       total=len(cached["snapshots"]))
+
+
+def _event(event: str, data: Dict[str, object]) -> str:
+  return "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+
+
+def progress_events(cache: Cache, keepalive: float = KEEPALIVE_INTERVAL,
+                    idle_timeout: float = EVENTS_IDLE_TIMEOUT,
+                    retry: float = EVENTS_RETRY):
+  """
+  Generate Server-Sent Events of the progress of pushes.
+
+  The status of pushes is read from the cache, which wakes the stream
+  when it changes. A "progress" event is sent with the status of a
+  push whenever it changes, and a "done" event once the push
+  completes. The stream ends once no push has been running for
+  'idle_timeout' seconds, and the client reconnects after 'retry'
+  seconds.
+
+  Arguments:
+      cache: The monitor's cache.
+      keepalive: Seconds between keep-alive comments, which stop idle
+        streams from being closed by proxies.
+      idle_timeout: Seconds without a running push after which the
+        stream ends.
+      retry: Seconds after which the client should reconnect.
+
+  Yields:
+      Events, in the text/event-stream format.
+  """
+  yield "retry: {}\n\n".format(int(retry * 1000))
+
+  version, statuses = None, {}
+  idle_since = time.time()
+  while True:
+    new_version, current = cache.statuses(version, timeout=keepalive)
+    if new_version == version:
+      yield ": keep-alive\n\n"
+    else:
+      for sink, status in current.items():
+        previous = statuses.get(sink)
+        if status and status != previous:
+          yield _event("progress", status)
+        elif previous and not status:
+          yield _event("done", {"sink": sink})
+      version, statuses = new_version, current
+
+    if any(statuses.values()):
+      idle_since = time.time()
+    elif time.time() - idle_since >= idle_timeout:
+      return
+
+
+@app.route('/events')
+def events():
+  return flask.Response(progress_events(get_cache(get_source_dir())),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
 
 
 @app.route('/')
 def index():
-  source_dir = emu.find_source_dir('.')
-  source = emu.Source(source_dir)
+  cache = get_cache(get_source_dir())
+  cached = cache.get()
+  now = datetime.datetime.now()
+
+  # Only the first page of snapshots is rendered. The rest are loaded
+  # from the API as the timeline is scrolled:
+  snapshots, next_cursor = get_snapshots_page(cached, now)
 
   data = {
     "refresh_every": 60,  # seconds
     "assets": {
-      "cache_tag": 1,
+      "cache_tag": 2,
       "styles_css": flask.url_for('static', filename='styles.css'),
       "site_js": flask.url_for('static', filename='site.js'),
     },
-    "source": {
-      "path": unexpand_user(source.path),
+    "api": {
+      "snapshots": flask.url_for('api_snapshots'),
+      "events": flask.url_for('events'),
     },
-    "sinks": [get_sink_data(sink) for sink in source.sinks()],
-    "snapshots": get_snapshots_data(source),
+    "source": cached["source"],
+    "sinks": [get_sink_data(state, now) for state in cached["sinks"]],
+    "snapshots": snapshots,
+    "next_cursor": next_cursor,
     "emu": {
       "version": emu.Meta.version,
     },
   }
 
-  data["num_snapshots"] = len(data["snapshots"])
+  data["num_snapshots"] = len(cached["snapshots"])
   data["num_sinks"] = len(data["sinks"])
+  if cached["snapshots"]:
+    data["newest"] = humanize.naturaltime(now - cached["snapshots"][-1]["date"])
+    data["oldest"] = humanize.naturaltime(now - cached["snapshots"][0]["date"])
 
   data["in_progress"] = sum(
       1 if sink["in_progress"] else 0 for sink in data["sinks"])
   data["in_progress_since"] = max(
-      sink["in_progress_since"] for sink in data["sinks"])
+      (sink["in_progress_since"] for sink in data["sinks"]
+       if sink["in_progress_since"] is not None), default=None)
   if data["in_progress_since"]:
     data["in_progress_since_hr"] = humanize.naturaltime(
-        datetime.datetime.now() - datetime.timedelta(
-            seconds=data["in_progress_since"]))
+        now - datetime.timedelta(seconds=data["in_progress_since"]))
 
   return flask.render_template("timeline.html", **data)
 
@@ -116,6 +719,7 @@ def main(source_dir="/", **flask_opts):
       **flask_opts:
   """
   os.chdir(source_dir)
+  app.config["EMU_SOURCE_DIR"] = emu.find_source_dir(".")
   app.run(**flask_opts)
 
 
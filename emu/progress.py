@@ -0,0 +1,432 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Progress of rsync transfers.
+
+rsync itemizes every file that it changes. Printed to a terminal or a
+cron mail, this output throttles large transfers and produces huge
+mails. Instead, rsync's output is consumed by reader threads, which
+count the itemized changes and rsync's progress reports. The full
+output is written to a rotating log at <source>/.emu/logs/<sink>.log,
+and a one line summary is printed periodically.
+
+Output handling never blocks the transfer. Readers only parse lines
+and pass them to the log writer through a bounded queue; lines which
+do not fit in the queue are dropped from the log, and counted.
+Printing is done by a separate thread.
+
+While a push is running, its phase and counters are published to a
+status file at <sink>/.emu/progress, which is read by the monitor.
+The file is replaced atomically at most once every STATUS_INTERVAL
+seconds, and removed once the push completes.
+"""
+import collections
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+from emu import io
+from emu import transfer
+
+
+SUMMARY_INTERVAL = 10
+MAX_LOG_SIZE = 64 << 20
+LOG_BACKUPS = 3
+STATUS_INTERVAL = 1
+
+_QUEUE_SIZE = 1 << 16
+_MAX_ERRORS = 20
+
+# An itemized change, as printed by rsync --itemize-changes:
+_ITEMIZED = re.compile(r"^([<>ch.*])([fdLDS])\S{9} ")
+
+# An overall progress report, as printed by rsync --info=progress2:
+_PROGRESS = re.compile(r"^\s*([\d,]+)\s+(\d+)%\s+(\S+/s)"
+                       r"(?:\s+(\d+:\d\d:\d\d))?")
+
+
+class Progress:
+  """
+  Counters of an rsync transfer.
+
+  Attributes:
+      items (int): Number of itemized changes.
+      transferred (int): Number of files transferred.
+      created (int): Number of entries created.
+      linked (int): Number of hardlinks created.
+      deleted (int): Number of entries deleted.
+      errors (int): Number of lines of error output.
+      bytes (int): Number of bytes transferred.
+      percent (int): Percentage of the transfer complete.
+      rate (str): Transfer rate, as reported by rsync.
+      eta (str): Estimated time remaining, as reported by rsync.
+      dropped (int): Number of lines dropped from the log.
+  """
+
+  def __init__(self):
+    self.items = 0
+    self.transferred = 0
+    self.created = 0
+    self.linked = 0
+    self.deleted = 0
+    self.errors = 0
+    self.bytes = 0
+    self.percent = 0
+    self.rate = None
+    self.eta = None
+    self.dropped = 0
+
+  def update(self, line):
+    """
+    Update the counters from a line of rsync output.
+    """
+    if line.startswith("*deleting"):
+      self.items += 1
+      self.deleted += 1
+      return
+
+    match = _ITEMIZED.match(line)
+    if match:
+      self.items += 1
+      update, type = match.groups()
+      if update in "<>" and type == "f":
+        self.transferred += 1
+      elif update == "c":
+        self.created += 1
+      elif update == "h":
+        self.linked += 1
+      return
+
+    match = _PROGRESS.match(line)
+    if match:
+      self.bytes = int(match.group(1).replace(",", ""))
+      self.percent = int(match.group(2))
+      self.rate = match.group(3)
+      self.eta = match.group(4)
+
+  def counters(self):
+    """
+    Return the counters which are published in a push's status.
+    """
+    return {
+      "items": self.items,
+      "transferred": self.transferred,
+      "deleted": self.deleted,
+      "errors": self.errors,
+      "bytes": self.bytes,
+      "percent": self.percent,
+      "rate": self.rate,
+      "eta": self.eta,
+    }
+
+  def summary(self):
+    s = ("{} changes ({} transferred, {} created, {} linked, {} deleted), "
+         "{} bytes, {}%".format(self.items, self.transferred, self.created,
+                                self.linked, self.deleted, self.bytes,
+                                self.percent))
+    if self.rate:
+      s += " at {}".format(self.rate)
+    if self.errors:
+      s += ", {} errors".format(self.errors)
+    return s
+
+
+class Status:
+  """
+  The status of a push, published to a file.
+
+  The file holds a JSON object of the push's sink, process ID, start
+  time, phase, and the counters of the current phase.
+
+  Attributes:
+      path (str): Path of the status file, or None to publish nothing.
+      sink (str): Name of the sink.
+  """
+
+  def __init__(self, path, sink, interval=STATUS_INTERVAL):
+    self.path = path
+    self.sink = sink
+    self.interval = interval
+    self.started = time.time()
+    self.phase = None
+    self.scanned = 0
+    self._counters = {}
+    self._written = 0
+    self._lock = threading.Lock()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.remove()
+
+  def update(self, phase=None, **counters):
+    """
+    Update the status, and write it if the phase has changed or
+    'interval' seconds have passed since it was last written.
+
+    Arguments:
+        phase (str, optional): The new phase. The counters of the
+          previous phase are discarded.
+        counters: Counters of the current phase.
+    """
+    with self._lock:
+      force = phase is not None and phase != self.phase
+      if force:
+        self.phase = phase
+        self.scanned = 0
+        self._counters = {}
+      self._counters.update(counters)
+      if force or time.time() - self._written >= self.interval:
+        self._write()
+
+  def flush(self):
+    """
+    Write the status now.
+    """
+    with self._lock:
+      self._write()
+
+  def add(self, entry, st):
+    """
+    Count an entry scanned by manifest.Manifest.write().
+    """
+    self.scanned += 1
+    if time.time() - self._written >= self.interval:
+      self.update(scanned=self.scanned)
+
+  def _write(self):
+    if not self.path:
+      return
+    self._written = time.time()
+    status = {
+      "sink": self.sink,
+      "pid": os.getpid(),
+      "started": self.started,
+      "updated": self._written,
+      "phase": self.phase,
+    }
+    status.update(self._counters)
+    tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+    try:
+      with open(tmp_path, "w") as outfile:
+        json.dump(status, outfile)
+      os.replace(tmp_path, self.path)
+    except OSError as e:
+      io.debug("{}: failed to write status '{}': {}"
+               .format(self.sink, self.path, e))
+
+  def remove(self):
+    if self.path:
+      try:
+        os.remove(self.path)
+      except FileNotFoundError:
+        pass
+
+  @staticmethod
+  def read(path):
+    """
+    Read a status file.
+
+    Returns:
+        dict: The status, or None if there is no valid status file.
+    """
+    try:
+      with open(path) as infile:
+        return json.load(infile)
+    except (OSError, ValueError):
+      return None
+
+
+class RotatingLog:
+  """
+  A log file which is rotated once it exceeds a maximum size, keeping
+  a number of backups named <path>.1, <path>.2, etc.
+  """
+
+  def __init__(self, path, max_size=MAX_LOG_SIZE, backups=LOG_BACKUPS):
+    self.path = path
+    self.max_size = max_size
+    self.backups = backups
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    self._file = open(path, "a", encoding="utf-8", errors="replace")
+
+  def rotate(self):
+    self._file.close()
+    for i in range(self.backups - 1, 0, -1):
+      if os.path.exists("{}.{}".format(self.path, i)):
+        os.replace("{}.{}".format(self.path, i),
+                   "{}.{}".format(self.path, i + 1))
+    if self.backups:
+      os.replace(self.path, self.path + ".1")
+    else:
+      os.remove(self.path)
+    self._file = open(self.path, "a", encoding="utf-8", errors="replace")
+
+  def write(self, line):
+    self._file.write(line)
+    if self._file.tell() > self.max_size:
+      self.rotate()
+
+  def close(self):
+    self._file.close()
+
+
+class RsyncOutput:
+  """
+  Consumes the output of an rsync process.
+
+  Attributes:
+      name (str): Name printed in summary lines.
+      log_path (str): Path of the log.
+      progress (Progress): Counters of the transfer.
+      stats (transfer.RsyncStats): Statistics reported by rsync.
+      status (Status): Status to publish the counters of the transfer
+        to, if any.
+  """
+
+  def __init__(self, name, log_path, interval=SUMMARY_INTERVAL, status=None):
+    self.name = name
+    self.log_path = log_path
+    self.interval = interval
+    self.status = status
+    self.progress = Progress()
+    self.stats = transfer.RsyncStats()
+    self._queue = queue.Queue(maxsize=_QUEUE_SIZE)
+    self._errors = collections.deque(maxlen=_MAX_ERRORS)
+    self._lock = threading.Lock()
+    self._done = threading.Event()
+
+  def _log(self, line):
+    try:
+      self._queue.put_nowait(line)
+    except queue.Full:
+      self.progress.dropped += 1
+
+  def _read_stdout(self, pipe):
+    buf = b""
+    for chunk in iter(lambda: pipe.read1(1 << 16), b""):
+      buf += chunk
+      # Progress reports are terminated by carriage returns:
+      lines = re.split(rb"[\r\n]", buf)
+      buf = lines.pop()
+      for line in lines:
+        line = line.decode("utf-8", errors="replace")
+        if not line:
+          continue
+        with self._lock:
+          if not self.stats.parse(line):
+            self.progress.update(line)
+        if not _PROGRESS.match(line):
+          self._log(line + "\n")
+    if buf:
+      self._log(buf.decode("utf-8", errors="replace") + "\n")
+
+  def _read_stderr(self, pipe):
+    for line in pipe:
+      line = line.decode("utf-8", errors="replace")
+      with self._lock:
+        self.progress.errors += 1
+        self._errors.append(line.rstrip("\n"))
+      self._log(line)
+
+  def _write_log(self):
+    log = None
+    try:
+      log = RotatingLog(self.log_path)
+      for line in iter(self._queue.get, None):
+        log.write(line)
+    except OSError as e:
+      io.warning("{}: failed to write log '{}': {}"
+                 .format(self.name, self.log_path, e))
+      # Keep draining the queue, so that readers are never blocked:
+      for line in iter(self._queue.get, None):
+        pass
+    finally:
+      if log:
+        log.close()
+
+  def _print_errors(self):
+    with self._lock:
+      errors = list(self._errors)
+      self._errors.clear()
+    for line in errors:
+      io.error("{}: {}".format(self.name, line))
+
+  def _publish_status(self):
+    with self._lock:
+      counters = self.progress.counters()
+    self.status.update(**counters)
+
+  def _print_summaries(self):
+    next_summary = time.time() + self.interval
+    wait = min(self.interval, self.status.interval if self.status else
+               self.interval)
+    while not self._done.wait(wait):
+      if self.status:
+        self._publish_status()
+      if time.time() >= next_summary:
+        next_summary += self.interval
+        self._print_errors()
+        with self._lock:
+          summary = self.progress.summary()
+        io.printf("{}: {}".format(self.name, summary))
+    self._print_errors()
+    if self.status:
+      self._publish_status()
+      self.status.flush()
+
+  def run(self, process):
+    """
+    Consume the output of a process until it exits.
+
+    Arguments:
+        process (subprocess.Popen): An rsync process whose stdout and
+          stderr are pipes.
+
+    Returns:
+        transfer.RsyncStats: Statistics reported by rsync.
+    """
+    self._log("# {} {}\n".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                  " ".join(process.args)))
+    readers = [
+        threading.Thread(target=self._read_stdout, args=(process.stdout,)),
+        threading.Thread(target=self._read_stderr, args=(process.stderr,)),
+    ]
+    writer = threading.Thread(target=self._write_log)
+    printer = threading.Thread(target=self._print_summaries)
+    for thread in readers + [writer, printer]:
+      thread.daemon = True
+      thread.start()
+
+    process.wait()
+    for thread in readers:
+      thread.join()
+    self._queue.put(None)
+    writer.join()
+    self._done.set()
+    printer.join()
+
+    io.verbose("{}: {}".format(self.name, self.progress.summary()))
+    if self.progress.dropped:
+      io.warning("{}: {} lines of output were dropped from '{}'"
+                 .format(self.name, self.progress.dropped, self.log_path))
+    return self.stats
@@ -0,0 +1,192 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Machine-readable records of snapshots and sinks.
+
+Records are printed in JSON Lines format, one JSON object per line,
+so that they can be consumed as a stream. A snapshot record holds
+every section of the snapshot's node, with integer and decimal values
+converted to numbers. A sink record holds the sink's snapshot count,
+HEAD, and the mount and space of the device which holds it.
+
+Device information is read from /proc/self/mountinfo and statvfs(),
+so that no subprocess is spawned. Where mountinfo is not available,
+only the space of the device is reported.
+"""
+import json
+import os
+import re
+import sys
+
+FORMATS = ["text", "jsonl"]
+
+_MOUNTINFO = "/proc/self/mountinfo"
+
+_INT = re.compile(r"^-?\d+$")
+_FLOAT = re.compile(r"^-?\d+\.\d+$")
+
+# An octal escape of a mountinfo field, e.g. "\040" for a space:
+_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field):
+  return _ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+def value(string):
+  """
+  Convert a node property to a JSON value.
+
+  >>> value("10"), value("0.25"), value("2020-01-01")
+  (10, 0.25, '2020-01-01')
+  """
+  if _INT.match(string):
+    return int(string)
+  elif _FLOAT.match(string):
+    return float(string)
+  return string
+
+
+def mount(path, mountinfo=_MOUNTINFO):
+  """
+  Find the mount which holds a path.
+
+  Arguments:
+      path (str): Path.
+      mountinfo (str, optional): Path of the mount table.
+
+  Returns:
+      dict: The source device, mount point, and filesystem type of
+        the mount, or None if the mount table cannot be read.
+  """
+  path = os.path.realpath(path)
+  st_dev = os.stat(path).st_dev
+  dev = "{}:{}".format(os.major(st_dev), os.minor(st_dev))
+
+  best, best_key = None, None
+  try:
+    with open(mountinfo) as infile:
+      for line in infile:
+        fields = line.split()
+        # Optional fields are terminated by a single hyphen:
+        try:
+          sep = fields.index("-", 6)
+        except ValueError:
+          continue
+        if len(fields) < sep + 3:
+          continue
+        mount_point = _unescape(fields[4])
+        if os.path.commonpath([path, mount_point]) != mount_point:
+          continue
+        # Mounts of the path's device are preferred, then the deepest
+        # mount point. Later mounts shadow earlier ones:
+        key = (fields[2] == dev, len(mount_point))
+        if best_key is None or key >= best_key:
+          best_key = key
+          best = {
+            "source": _unescape(fields[sep + 2]),
+            "mount_point": mount_point,
+            "fstype": fields[sep + 1],
+          }
+  except OSError:
+    return None
+  return best
+
+
+def space(path):
+  """
+  Read the space of the device which holds a path, using a single
+  statvfs().
+
+  Returns:
+      dict: Sizes in bytes and inode counts.
+  """
+  statvfs = os.statvfs(path)
+  return {
+    "total": statvfs.f_blocks * statvfs.f_frsize,
+    "used": (statvfs.f_blocks - statvfs.f_bfree) * statvfs.f_frsize,
+    "free": statvfs.f_bavail * statvfs.f_frsize,
+    "inodes": statvfs.f_files,
+    "inodes_free": statvfs.f_favail,
+  }
+
+
+def device(path):
+  """
+  Describe the device which holds a path.
+
+  Returns:
+      dict: The device's mount, if known, and space.
+  """
+  record = {"source": None, "mount_point": None, "fstype": None}
+  record.update(mount(path) or {})
+  record.update(space(path))
+  return record
+
+
+def snapshot(snapshot):
+  """
+  Create the record of a snapshot.
+
+  Arguments:
+      snapshot (emu.Snapshot): Snapshot.
+
+  Returns:
+      dict: Record.
+  """
+  node = snapshot.node
+  return {
+    "sink": snapshot.sink.name,
+    "name": snapshot.name,
+    "id": str(snapshot.id),
+    "date": node.date.timestamp(),
+    "node": {
+      section: {prop: value(v) for prop, v in node.items(section)}
+      for section in node.sections()
+    },
+  }
+
+
+def sink(sink):
+  """
+  Create the record of a sink.
+
+  Arguments:
+      sink (emu.Sink): Sink.
+
+  Returns:
+      dict: Record.
+  """
+  head = sink.head()
+  return {
+    "name": sink.name,
+    "path": sink.path,
+    "snapshots": len(sink.index),
+    "head": head.name if head else None,
+    "in_progress": sink.is_inprogress,
+    "status": sink.status,
+    "device": device(sink.path),
+  }
+
+
+def write(record, file=None):
+  """
+  Print a record as a single line of JSON, and flush it.
+  """
+  file = file or sys.stdout
+  file.write(json.dumps(record, sort_keys=True) + "\n")
+  file.flush()
@@ -0,0 +1,121 @@
+/*
+ * Load-on-scroll for the snapshots timeline.
+ *
+ * Only the first page of snapshots is rendered by the server. When the
+ * end of the timeline is scrolled into view, the next page is fetched
+ * from the snapshots API and appended.
+ */
+$(function() {
+  var timeline = $("ul.timeline");
+  if (!timeline.length) {
+    return;
+  }
+
+  var api = timeline.data("api");
+  var next = timeline.data("next");
+  var numSinks = parseInt(timeline.data("num-sinks"), 10);
+  // Number of snapshots shown, used to alternate their sides:
+  var count = timeline.children("li").not(".now, .clearfix").length;
+  var loading = false;
+
+  function snapshotItem(snapshot) {
+    var heading = $("<h4>");
+    heading.text((numSinks > 1 ? snapshot.sink + ":" : "") + snapshot.name +
+                 " from " + snapshot.how_long_ago +
+                 (numSinks > 1 ? " on " + snapshot.sink : ""));
+    var panelHeading = $('<div class="timeline-heading">').append(heading);
+    if (snapshot.usage) {
+      panelHeading.append($("<p>").append($("<small>").text(
+          snapshot.usage.exclusive + " exclusive, " + snapshot.usage.shared +
+          " shared" + (snapshot.usage.stale ? " (stale)" : ""))));
+    }
+
+    var item = $("<li>").css("margin-top", snapshot.spacing + "px");
+    if (count++ % 2 === 0) {
+      item.addClass("timeline-inverted");
+    }
+    return item.append(
+        '<div class="timeline-badge"><a><i class="fa fa-circle"></i></a></div>',
+        $('<div class="timeline-panel">').append(panelHeading));
+  }
+
+  function loadMore() {
+    if (loading || !next) {
+      return;
+    }
+    var end = timeline.children(".clearfix");
+    if (end.offset().top > $(window).scrollTop() + 2 * $(window).height()) {
+      return;
+    }
+
+    loading = true;
+    $.getJSON(api, {cursor: next}).done(function(data) {
+      var items = $.map(data.snapshots, snapshotItem);
+      end.before(items);
+      next = data.next;
+    }).always(function() {
+      loading = false;
+      // Keep loading until the viewport is filled:
+      loadMore();
+    });
+  }
+
+  $(window).on("scroll resize", loadMore);
+  loadMore();
+});
+
+/*
+ * Live progress of pushes.
+ *
+ * The progress of each push is streamed from the monitor as
+ * Server-Sent Events, and shown at the top of the timeline. The page
+ * is reloaded once a push completes, to show the new snapshot.
+ */
+$(function() {
+  var now = $("ul.timeline > li.now");
+  if (!now.length || !window.EventSource) {
+    return;
+  }
+
+  var panel = now.children(".timeline-panel");
+  var lines = {};
+
+  function describe(status) {
+    var parts = [status.phase];
+    if (status.phase === "transfer" && status.items !== undefined) {
+      parts.push(status.items + " changes", status.bytes + " bytes",
+                 status.percent + "%");
+      if (status.rate) {
+        parts.push(status.rate);
+      }
+      if (status.eta) {
+        parts.push(status.eta + " remaining");
+      }
+      if (status.errors) {
+        parts.push(status.errors + " errors");
+      }
+    } else if (status.scanned) {
+      parts.push(status.scanned + " files scanned");
+    }
+    return status.sink + ": " + parts.join(", ");
+  }
+
+  function render() {
+    var text = $.map(lines, function(line) { return line; }).join("; ");
+    panel.find(".push-progress").text(text);
+    if (text) {
+      panel.show();
+    }
+  }
+
+  var events = new EventSource(now.data("events"));
+  events.addEventListener("progress", function(e) {
+    var status = JSON.parse(e.data);
+    lines[status.sink] = describe(status);
+    render();
+  });
+  events.addEventListener("done", function() {
+    events.close();
+    window.location.reload();
+  });
+});
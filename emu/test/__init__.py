@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with emu.  If not, see <http://www.gnu.org/licenses/>.
 #
+import datetime
 import os
 import sys
 from contextlib import contextmanager
@@ -93,6 +94,70 @@ def archive(*components):
   return path
 
 
+def make_source(dirpath, sinks=("origin",), num_snapshots=0,
+                start=datetime.datetime(2020, 1, 1),
+                interval=datetime.timedelta(hours=1)) -> emu.Source:
+  """
+  Create an emu source with populated sinks in a directory.
+
+  Node files are written in the same format as Snapshot.create(), so
+  that tests can operate on sinks with arbitrary histories without
+  performing any file transfers.
+
+  Arguments:
+      dirpath (str): Directory to create the source and sinks in.
+      sinks (sequence of str, optional): Names of sinks to create.
+      num_snapshots (int, optional): Number of snapshots to create in
+        each sink.
+      start (datetime, optional): Date of the oldest snapshot.
+      interval (timedelta, optional): Time between snapshots.
+
+  Returns:
+      emu.Source: The new source.
+  """
+  source_path = os.path.join(str(dirpath), "source")
+  for d in ["hooks", "sinks"]:
+    os.makedirs(os.path.join(source_path, ".emu", d))
+  for f in ["config", "excludes"]:
+    Path(source_path, ".emu", f).touch()
+
+  for sink_name in sinks:
+    sink_path = os.path.join(str(dirpath), sink_name)
+    os.makedirs(os.path.join(sink_path, ".emu", "nodes"))
+    Path(sink_path, ".emu", "config").write_text("[Snapshots]\n")
+    Path(source_path, ".emu", "sinks", sink_name).write_text(sink_path + "\n")
+
+    parent = ""
+    for i in range(num_snapshots):
+      date = start + i * interval
+      name = date.strftime("%Y-%m-%d-%H%M%S")
+      os.makedirs(os.path.join(sink_path, name))
+      Path(sink_path, ".emu", "nodes", name).write_text(f"""\
+[Snapshot]
+snapshot = {name}
+parent = {parent}
+name = {name}
+date = {date.strftime(emu.Date.REPR_FORMAT)}
+
+[Tree]
+
+[Sink]
+source = {source_path}
+sink = {sink_name}
+path = {sink_path}
+snapshot-no = {i + 1}
+
+[Emu]
+emu-version = {emu.Meta.version}
+user = test
+uid = 0
+
+""")
+      parent = name
+
+  return emu.Source(source_path)
+
+
 class DevNullRedirect(object):
   """
   Context manager to redirect stdout and stderr to devnull.
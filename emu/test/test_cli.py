@@ -0,0 +1,84 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+
+import emu
+import pytest
+from emu import cli
+from emu import test
+
+
+_PROGRAM = """
+import sys
+
+def main(argv, argc):
+  with open(argv[0], "w") as outfile:
+    outfile.write(repr([sys.argv[0]] + argv[1:]))
+  return 3
+"""
+
+
+def _write(path, contents, mode=0o644):
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+  os.chmod(path, mode)
+
+
+def test_run_in_process(tmpdir):
+  bin_dir = str(tmpdir.mkdir("bin"))
+  _write(os.path.join(bin_dir, "emu-log"), _PROGRAM)
+  output = str(tmpdir.join("output"))
+  argv = sys.argv
+
+  assert 3 == cli.run("log", [output, "a b", "--c"], bin_dir)
+  with open(output) as infile:
+    assert (repr([os.path.join(bin_dir, "emu-log"), "a b", "--c"]) ==
+            infile.read())
+  assert argv is sys.argv
+
+
+def test_run_external(tmpdir):
+  bin_dir = str(tmpdir.mkdir("bin"))
+  output = str(tmpdir.join("output"))
+  _write(os.path.join(bin_dir, "emu-hello"),
+         "#!/bin/sh\nprintf '%s\\n' \"$@\" > {}\nexit 4\n".format(output),
+         mode=0o755)
+
+  assert 4 == cli.run("hello", ["a b", "c"], bin_dir)
+  with open(output) as infile:
+    assert ["a b\n", "c\n"] == infile.readlines()
+
+
+def test_run_invalid_command(tmpdir):
+  with pytest.raises(emu.InvalidEmuCommand):
+    cli.run("not-a-command", [], str(tmpdir))
+
+
+def test_parser_source_dir(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir)
+  monkeypatch.chdir(str(tmpdir))
+  # The source is only looked up if it is not given:
+  options, _ = emu.Parser().parse_args(["-S", source.path])
+  assert source.path == options.source_dir
+  with pytest.raises(emu.SourceNotFoundError):
+    emu.Parser().parse_args([])
+
+  monkeypatch.chdir(source.path)
+  options, args = emu.Parser().parse_args(["a"])
+  assert source.path == options.source_dir
+  assert ["a"] == args
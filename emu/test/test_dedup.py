@@ -0,0 +1,111 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+
+import emu
+from emu import dedup
+from emu import test
+
+
+def _write(path, contents, mtime=1500000000):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+  os.utime(path, (mtime, mtime))
+
+
+def test_store_dedup(tmpdir):
+  store = dedup.Store(str(tmpdir))
+  old, new = str(tmpdir.join("old")), str(tmpdir.join("new"))
+  data = "x" * 10000
+  _write(os.path.join(old, "media", "a"), data)
+  stats = store.dedup(old)
+  assert 1 == stats.files
+  assert 0 == stats.linked
+
+  # A moved file is linked to the stored inode:
+  _write(os.path.join(new, "renamed", "a"), data)
+  # Files with different metadata are not:
+  _write(os.path.join(new, "b"), data, mtime=1600000000)
+  # Nor are small files:
+  _write(os.path.join(new, "c"), "x")
+  stats = store.dedup(new)
+  assert 2 == stats.files
+  assert 1 == stats.linked
+  assert stats.bytes_saved >= 10000
+  assert os.path.samefile(os.path.join(old, "media", "a"),
+                          os.path.join(new, "renamed", "a"))
+  assert 1600000000 == os.stat(os.path.join(new, "b")).st_mtime
+
+
+def test_store_sweep(tmpdir):
+  store = dedup.Store(str(tmpdir))
+  tree = str(tmpdir.join("tree"))
+  _write(os.path.join(tree, "a"), "a" * 10000)
+  _write(os.path.join(tree, "b"), "b" * 10000)
+  store.dedup(tree)
+  os.remove(os.path.join(tree, "a"))
+  assert 1 == store.sweep()
+  assert 1 == sum(len(files) for _, _, files in os.walk(store.path))
+
+
+def test_push_dedup(tmpdir):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n[Dedup]\nenabled = true\n")
+  sink = emu.Sink("origin", source)
+  _write(os.path.join(source.path, "media", "video"), "x" * 100000)
+  sink.push()
+  head = sink.head()
+
+  os.rename(os.path.join(source.path, "media"),
+            os.path.join(source.path, "videos"))
+  time.sleep(1)
+  sink.push()
+  assert os.path.samefile(os.path.join(head.tree, "media", "video"),
+                          os.path.join(sink.head().tree, "videos", "video"))
+  node = sink.head().node
+  assert 1 == node.getint("Dedup", "linked")
+  assert node.getint("Dedup", "bytes-saved") >= 100000
+
+
+def test_rotate_dedup_nearly_full(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n[Dedup]\nenabled = true\n")
+  sink = emu.Sink("origin", source)
+  for i in range(3):
+    _write(os.path.join(source.path, "data"), str(i) * 65536,
+           mtime=1500000000 + i)
+    sink.push()
+    time.sleep(1)
+  sink.empty_trash()
+  names = sink.snapshot_names()
+
+  # Files linked only from the store are exclusive to their snapshot:
+  oldest = sink.tail()
+  assert oldest.usage.exclusive >= 65536
+  assert oldest.usage.exclusive == sink.freed_space([oldest])[oldest.name]
+
+  # Freeing the oldest snapshot brings the sink back above 5% free:
+  statvfs = os.statvfs_result((4096, 4096, 1000, 40, 40, 0, 0, 0, 0, 255))
+  monkeypatch.setattr(os, "statvfs", lambda path: statvfs)
+  sink.rotate()
+  assert names[1:] == sink.snapshot_names()
@@ -0,0 +1,83 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+
+from emu import diff
+from emu import manifest
+
+
+def _write(path, contents):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+
+
+def _snapshots(tmpdir):
+  """
+  Create two snapshot trees, the second hardlinked from the first.
+  """
+  old, new = str(tmpdir.join("old")), str(tmpdir.join("new"))
+  _write(os.path.join(old, "same"), "same")
+  _write(os.path.join(old, "modified"), "old")
+  _write(os.path.join(old, "removed", "file"), "removed")
+  _write(os.path.join(old, "type"), "file")
+  shutil.copytree(old, new, copy_function=os.link)
+
+  os.remove(os.path.join(new, "modified"))
+  _write(os.path.join(new, "modified"), "modified")
+  shutil.rmtree(os.path.join(new, "removed"))
+  os.remove(os.path.join(new, "type"))
+  _write(os.path.join(new, "type", "file"), "")
+  _write(os.path.join(new, "added", "a"), "added")
+  return old, new
+
+
+EXPECTED = [
+  ("A", "added"),
+  ("A", "added/a"),
+  ("M", "modified"),
+  ("D", "removed"),
+  ("D", "removed/file"),
+  ("D", "type"),
+  ("A", "type"),
+  ("A", "type/file"),
+]
+
+
+def test_diff_trees(tmpdir):
+  old, new = _snapshots(tmpdir)
+  changes = list(diff.diff_trees(old, new, jobs=2))
+  assert EXPECTED == [(c.status, c.path) for c in changes]
+
+  stats = diff.DiffStats()
+  for change in changes:
+    stats.add(change)
+  assert (4, 3, 1) == (stats.added, stats.removed, stats.modified)
+  assert 5 == stats.bytes_added
+  assert 11 == stats.bytes_removed
+  assert 8 == stats.bytes_modified
+
+
+def test_diff_manifests(tmpdir):
+  old, new = _snapshots(tmpdir)
+  manifests = str(tmpdir.join("manifests"))
+  manifest.Manifest(manifests, "old").write(old)
+  manifest.Manifest(manifests, "new").write(new, parent="old")
+  changes = diff.diff_manifests(manifest.Manifest(manifests, "old"),
+                                manifest.Manifest(manifests, "new"))
+  assert EXPECTED == [(c.status, c.path) for c in changes]
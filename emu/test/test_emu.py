@@ -14,11 +14,16 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
 import os
+import subprocess
+import sys
 
 import emu
 import pytest
+from emu import journal
 from emu import test
+from emu import usage
 
 
 def test_which():
@@ -73,3 +78,356 @@ def test_isprocess():
   # We hope there aren't this many processes running!
   assert False == emu.isprocess(10000000)
   assert False == emu.isprocess(10000001)
+
+
+# SnapshotIndex
+def test_index_rebuild(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  assert not os.path.exists(os.path.join(sink.path, ".emu", "index"))
+  assert ["2020-01-01-000000", "2020-01-01-010000", "2020-01-01-020000"] == \
+         sink.snapshot_names()
+  entry = sink.index.get("2020-01-01-020000")
+  assert "2020-01-01-010000" == entry.parent
+  assert 3 == entry.snapshot_no
+  assert "clean" == entry.status
+  # Indexes rebuilt without holding the sink lock are kept in memory:
+  assert not os.path.exists(sink.index.path)
+  with sink.lock.acquire():
+    emu.SnapshotIndex(sink).load()
+  assert os.path.exists(sink.index.path)
+  assert ["index"] == [name for name in
+                       os.listdir(os.path.join(sink.path, ".emu"))
+                       if name.startswith("index")]
+
+
+def test_index_head_tail(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  assert "2020-01-01-020000" == sink.head().name
+  assert "2020-01-01-000000" == sink.tail().name
+
+
+def test_index_empty(tmpdir):
+  source = test.make_source(tmpdir)
+  sink = source.sinks()[0]
+  assert sink.head() is None
+  assert sink.tail() is None
+  assert [] == list(sink.snapshots())
+
+
+def test_index_stale(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  assert 3 == len(sink.index)
+  # Removing a node file behind the index's back invalidates it:
+  os.remove(os.path.join(sink.path, ".emu", "nodes", "2020-01-01-020000"))
+  assert "2020-01-01-010000" == sink.head().name
+  assert 2 == len(emu.SnapshotIndex(sink).load())
+
+
+def test_index_destroy(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  emu.Snapshot(emu.SnapshotID("origin", "2020-01-01-010000"), sink).destroy()
+  assert ["2020-01-01-000000", "2020-01-01-020000"] == sink.snapshot_names()
+  assert "2020-01-01-000000" == sink.index.get("2020-01-01-020000").parent
+  assert "2020-01-01-000000" == sink.head().node.parent()
+  # The on-disk index is current:
+  index = emu.SnapshotIndex(sink)
+  mtime = index._nodes_mtime()
+  with open(index.path) as infile:
+    assert str(mtime) == infile.readline().split()[-1]
+
+
+# SnapshotID
+def test_snapshot_id_ordering():
+  a = emu.SnapshotID("a", "2020-01-01-000000")
+  b = emu.SnapshotID("a", "2020-01-02-000000")
+  c = emu.SnapshotID("b", "2020-01-01-000000")
+  assert a < b < c
+  assert c > b > a
+  assert a == emu.SnapshotID("a", "2020-01-01-000000")
+  assert a != b
+  assert [a, b, c] == sorted([c, a, b])
+
+
+def test_snapshot_id_immutable():
+  id = emu.SnapshotID("a", "2020-01-01-000000")
+  with pytest.raises(AttributeError):
+    id.sink_name = "b"
+
+
+# Snapshot
+def test_snapshot_lazy_node(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=2)
+  sink = source.sinks()[0]
+  # Handles for non-existent snapshots can be created without I/O:
+  emu.Snapshot(emu.SnapshotID("origin", "2000-01-01-000000"), sink)
+  head = sink.head()
+  assert "2020-01-01-000000" == head.parent().name
+  assert not hasattr(head, "_node")
+  assert "2020-01-01-000000" == head.node.parent()
+  assert hasattr(head, "_node")
+
+
+# Ancestry
+def test_ancestry_branch():
+  ancestry = emu.Ancestry({"c": "b", "b": "a", "a": "", "x": "a"}, "c")
+  assert ["c", "b", "a"] == ancestry.branch
+  assert 1 == ancestry.depth("b")
+  assert ancestry.depth("x") is None
+  assert "a" == ancestry.nth_parent("c", 2)
+  assert ancestry.nth_parent("c", 3) is None
+  assert "a" == ancestry.nth_parent("x", 1)
+  assert "c" == ancestry.nth_child("a", 2)
+  assert ancestry.nth_child("b", 2) is None
+  assert "a" == ancestry.root("x")
+  assert ["x", "a"] == list(ancestry.ancestors("x"))
+
+
+def test_ancestry_between():
+  ancestry = emu.Ancestry({"d": "c", "c": "b", "b": "a", "a": ""}, "d")
+  assert ["c", "b"] == ancestry.between("d", "a")
+  assert [] == ancestry.between("d", "c")
+  assert ["b", "a"] == ancestry.between("c", None)
+  assert ancestry.between("b", "d") is None
+
+
+def test_snapshot_nth_parent_child(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=5)
+  sink = source.sinks()[0]
+  head = sink.head()
+  assert "2020-01-01-010000" == head.nth_parent(3).name
+  assert "2020-01-01-000000" == head.nth_parent(10, truncate=True).name
+  with pytest.raises(emu.SnapshotNotFoundError):
+    head.nth_parent(5)
+  assert "2020-01-01-030000" == sink.tail().nth_child(3).name
+  with pytest.raises(emu.SnapshotNotFoundError):
+    sink.tail().nth_child(5)
+  assert 5 == len(list(head.branch()))
+
+
+# RotationPlan
+def test_rotation_plan():
+  now = datetime.datetime(2020, 6, 30, 12)
+  dates = [
+    datetime.datetime(2020, 6, 30, 11),  # hours ago, keep
+    datetime.datetime(2020, 6, 30, 1),  # hours ago, keep
+    datetime.datetime(2020, 6, 28, 10),  # first of day, keep
+    datetime.datetime(2020, 6, 28, 9),  # same day, remove
+    datetime.datetime(2020, 6, 27, 9),  # first of day, keep
+    datetime.datetime(2020, 4, 1, 9),  # first of week, keep
+    datetime.datetime(2020, 3, 31, 9),  # same week, remove
+  ]
+  entries = [emu.IndexEntry(str(i), "", int(d.timestamp()), 0, "clean")
+             for i, d in enumerate(dates)]
+  plan = emu.RotationPlan.create(entries, now)
+  assert ["0", "1", "2", "4", "5"] == plan.keep
+  assert ["3", "6"] == plan.remove
+  assert 7 == len(list(plan.report()))
+
+
+def test_remove_snapshots(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=5)
+  sink = source.sinks()[0]
+  sink.remove_snapshots(["2020-01-01-010000", "2020-01-01-020000",
+                         "2020-01-01-040000"])
+  assert ["2020-01-01-000000", "2020-01-01-030000"] == sink.snapshot_names()
+  assert "2020-01-01-000000" == sink.head().node.parent()
+  assert "2020-01-01-030000" == os.readlink(os.path.join(sink.path, "Latest"))
+  assert not os.path.exists(os.path.join(sink.path, "2020-01-01-020000"))
+
+
+def test_rotate_free_space(tmpdir, monkeypatch):
+  source = test.make_source(
+      tmpdir, num_snapshots=4,
+      start=datetime.datetime.now() - datetime.timedelta(hours=4))
+  sink = source.sinks()[0]
+  names = sink.snapshot_names()
+  for snapshot in sink.snapshots():
+    usage.write(snapshot.node, usage.Usage(
+        50000, 50000, 0, 0, False))
+    snapshot.node.flush()
+
+  # 120 KB of 4 MB is free, so 80 KB must be freed to reach 5%:
+  statvfs = os.statvfs_result((4096, 4096, 1000, 30, 30, 0, 0, 0, 0, 255))
+  monkeypatch.setattr(os, "statvfs", lambda path: statvfs)
+  assert {names[0]: 50000} == sink.freed_space(names[:1])
+  sink.rotate()
+  assert names[2:] == sink.snapshot_names()
+  assert 100000 == sink.pending_trash_space
+
+
+def test_freed_space_shared(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  names = sink.snapshot_names()
+  figures = [(100, 10, 0, 60), (100, 10, 60, 20), (100, 10, 20, 0)]
+  for snapshot, figure in zip(sink.snapshots(), figures):
+    usage.write(snapshot.node, usage.Usage(*figure, False))
+    snapshot.node.flush()
+
+  # Files shared by only the two removed snapshots are freed:
+  assert {names[0]: 50, names[1]: 10} == sink.freed_space(names[:2])
+  assert {names[1]: 10} == sink.freed_space(names[1:2])
+  # Snapshots can be added to an estimate one at a time:
+  freed = sink.freed_space(names[1:2])
+  assert {names[0]: 50, names[1]: 10} == sink.freed_space(names[:1], freed)
+
+
+def test_rotate_free_space_unknown_usage(tmpdir, monkeypatch):
+  source = test.make_source(
+      tmpdir, num_snapshots=4,
+      start=datetime.datetime.now() - datetime.timedelta(hours=4))
+  sink = source.sinks()[0]
+  names = sink.snapshot_names()
+  walks = []
+  monkeypatch.setattr(emu.Util, "du",
+                      lambda path, **kwargs: walks.append(path) or 50000)
+
+  # No trees are walked if there is enough free space:
+  sink.rotate(dry_run=True)
+  assert [] == walks
+
+  # Otherwise each snapshot without recorded usage is measured once:
+  statvfs = os.statvfs_result((4096, 4096, 1000, 30, 30, 0, 0, 0, 0, 255))
+  monkeypatch.setattr(os, "statvfs", lambda path: statvfs)
+  sink.rotate()
+  assert names[2:] == sink.snapshot_names()
+  assert [os.path.join(sink.path, name) for name in names[:2]] == walks
+
+
+# Sink trash
+def test_sink_trash(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  tree = os.path.join(sink.path, "2020-01-01-000000")
+  with open(os.path.join(tree, "file"), "w") as outfile:
+    outfile.write("x" * 10000)
+  sink.remove_snapshots(["2020-01-01-000000"])
+  assert not os.path.exists(tree)
+  # The snapshot has no recorded usage, so its size is measured later:
+  assert ["2020-01-01-000000"] == os.listdir(sink.trash_dir)
+  assert sink.pending_trash_space >= 10000
+  assert 1 == sink.empty_trash()
+  assert [] == os.listdir(sink.trash_dir)
+  assert 0 == sink.pending_trash_space
+
+
+def test_sink_pending_trash_space_reaping(tmpdir):
+  source = test.make_source(tmpdir)
+  sink = source.sinks()[0]
+  # An entry without a recorded size is measured, even while claimed:
+  tree = os.path.join(sink.trash_dir, ".reaping-10000000-foo")
+  os.makedirs(tree)
+  with open(os.path.join(tree, "file"), "w") as outfile:
+    outfile.write("x" * 10000)
+  assert sink.pending_trash_space >= 10000
+
+
+def test_sink_empty_trash_resume(tmpdir):
+  source = test.make_source(tmpdir)
+  sink = source.sinks()[0]
+  # A trash entry claimed by a dead reaper is resumed:
+  os.makedirs(os.path.join(sink.trash_dir, ".reaping-10000000-foo", "bar"))
+  assert 1 == sink.empty_trash()
+  assert [] == os.listdir(sink.trash_dir)
+
+
+# Change journal
+def test_snapshot_journal_changes(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=2)
+  sink = source.sinks()[0]
+  j = journal.Journal(source.path)
+  j.beat(10)
+  j.start()
+  # HEAD was not created from a journal position:
+  changes, (generation, offset) = emu.Snapshot.journal_changes(sink)
+  assert changes is None
+
+  node = sink.head().node
+  node.add_section("Journal")
+  node.set("Journal", "generation", generation)
+  node.set("Journal", "offset", str(offset))
+  excludes = os.path.join(source.path, ".emu", "excludes")
+  node.set("Journal", "excludes", str(os.stat(excludes).st_mtime_ns))
+  node.flush()
+
+  j.append(["foo"])
+  assert ["foo"] == emu.Snapshot.journal_changes(sink)[0]
+  assert emu.Snapshot.journal_changes(sink, full=True)[0] is None
+
+  os.utime(excludes, ns=(0, 0))
+  assert emu.Snapshot.journal_changes(sink)[0] is None
+
+
+def test_import_is_lazy():
+  # Importing emu must not install signal handlers, or import modules
+  # which are only needed by some commands:
+  script = ("import signal, sys; import emu; "
+            "print(signal.getsignal(signal.SIGINT) is signal.default_int_handler); "
+            "print(sorted({'humanize', 'pkg_resources', 'tempfile', "
+            "'concurrent.futures', 'shutil', 'gzip', 'emu.manifest', "
+            "'emu.transfer', 'emu.journal'} & set(sys.modules)))")
+  output = subprocess.check_output(
+      [sys.executable, "-c", script], universal_newlines=True,
+      cwd=os.path.dirname(os.path.dirname(emu.__file__)))
+  assert "True\n[]\n" == output
+
+
+def test_meta_templates():
+  assert os.path.isfile(os.path.join(emu.Meta.sink_templates, "config"))
+  assert os.path.isdir(emu.Meta.source_templates)
+  assert emu.Meta.templates == os.path.dirname(emu.Meta.sink_templates)
+
+
+def test_config_cache(tmpdir):
+  path = str(tmpdir.join("config"))
+  with open(path, "w") as outfile:
+    outfile.write("[general]\ncolour = true\n")
+
+  config = emu.SinkConfig.cached(path)
+  assert config is emu.SinkConfig.cached(path)
+  assert isinstance(emu.Node.cached(path), emu.Node)
+
+  # Writes through the cache keep it coherent:
+  config.set("general", "colour", "false")
+  config.flush()
+  assert config is emu.SinkConfig.cached(path)
+
+  # Changes by other writers are seen:
+  with open(path, "w") as outfile:
+    outfile.write("[general]\ncolour = true\nfoo = bar\n")
+  config = emu.SinkConfig.cached(path)
+  assert "bar" == config.get("general", "foo")
+  assert config.getboolean("general", "colour")
+
+  # New configs are only cached once they are written:
+  path = str(tmpdir.join("node"))
+  node = emu.Node.new(path)
+  assert not os.path.exists(path)
+  node.add_section("Snapshot")
+  node.flush()
+  assert node is emu.Node.cached(path)
+
+
+def test_parser_iter_snapshots(tmpdir):
+  source = test.make_source(tmpdir, sinks=("origin", "mirror"),
+                            num_snapshots=3)
+  heads = [sink.index.head() for sink in source.sinks()]
+
+  def _iter(args, limit=0):
+    parser = emu.Parser()
+    parser.parse_args(["-S", source.path] + args)
+    return [str(s.id) for s in parser.iter_snapshots(source, limit=limit)]
+
+  # Sinks alphabetically, newest first:
+  ids = _iter([])
+  assert 6 == len(ids)
+  assert "mirror:" + heads[0] == ids[0]
+  assert ids[:3] == sorted(ids[:3], reverse=True)
+  assert ids[:2] == _iter([], limit=2)
+  assert ["origin:" + heads[0]] == _iter(["origin"], limit=1)
+  assert ids == _iter(["origin", "mirror", "origin"])
+  assert ["origin:" + heads[0]] == _iter(["origin:HEAD"])
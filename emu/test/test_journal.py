@@ -0,0 +1,189 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+
+import emu
+from emu import journal
+from emu import manifest
+from emu import test
+from emu import usage
+
+
+def test_journal_since(tmpdir):
+  source = test.make_source(tmpdir)
+  j = journal.Journal(source.path)
+  assert (None, None) == j.since()
+
+  j.beat(10)
+  generation = j.start()
+  changes, (gen, offset) = j.since()
+  assert changes is None
+  assert generation == gen
+
+  j.append(["b", "a/c", "a"])
+  changes, position = j.since(gen, offset)
+  assert ["a", "b"] == changes
+  assert position[1] > offset
+
+  # A different generation's changes are unknown:
+  assert j.since("0-0", offset)[0] is None
+
+  j.append([journal.OVERFLOW])
+  assert j.since(gen, offset)[0] is None
+  assert [] == j.since(*j.since()[1])[0]
+
+  j.stop()
+  assert not j.is_alive
+  assert (None, None) == j.since(gen, offset)
+
+
+def test_journal_stage(tmpdir):
+  head = str(tmpdir.join("head"))
+  os.makedirs(os.path.join(head, "dir"))
+  for name in ["a", "b", "dir/c"]:
+    with open(os.path.join(head, name), "w") as outfile:
+      outfile.write(name)
+
+  staging = str(tmpdir.join("new"))
+  journal.stage(head, staging, ["a", "dir"])
+  assert ["b"] == os.listdir(staging)
+  assert os.path.samefile(os.path.join(head, "b"), os.path.join(staging, "b"))
+
+
+def test_journal_stage_entries(tmpdir):
+  head = str(tmpdir.join("head"))
+  os.makedirs(os.path.join(head, "dir", "sub"))
+  for name in ["a", "dir/b", "dir/sub/c"]:
+    with open(os.path.join(head, name), "w") as outfile:
+      outfile.write(name)
+  os.utime(os.path.join(head, "dir"), ns=(0, 1000000000))
+
+  # The staging area is cloned from the entries, not by walking HEAD:
+  entries = [e for e in manifest.scan(head) if e.path != "dir/b"]
+  staging = str(tmpdir.join("new"))
+  journal.stage(head, staging, ["dir/sub"], entries=entries)
+  assert ["a", "dir"] == sorted(os.listdir(staging))
+  assert [] == os.listdir(os.path.join(staging, "dir"))
+  assert 1000000000 == os.stat(os.path.join(staging, "dir")).st_mtime_ns
+
+
+def test_watcher_events(tmpdir):
+  source = test.make_source(tmpdir)
+  os.makedirs(os.path.join(source.path, "dir"))
+  watcher = journal.Watcher(source.path)
+  watcher._inotify = journal.Inotify()
+  try:
+    watcher._watch_tree("")
+    # The .emu directory is not watched:
+    assert ["", "dir"] == sorted(watcher._watches.values())
+
+    with open(os.path.join(source.path, "dir", "file"), "w") as outfile:
+      outfile.write("hello")
+    os.makedirs(os.path.join(source.path, "new", "sub"))
+    os.rename(os.path.join(source.path, "dir"),
+              os.path.join(source.path, "moved"))
+    with open(os.path.join(source.path, ".emu", "excludes"), "w"):
+      pass
+
+    for event in watcher._inotify.read(timeout=1):
+      watcher._handle(*event)
+
+    assert {"dir", "dir/file", "moved", "new"} == watcher._pending
+    assert ["", "moved", "new", "new/sub"] == sorted(watcher._watches.values())
+  finally:
+    watcher._inotify.close()
+
+
+def test_incremental_push(tmpdir):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n")
+  sink = emu.Sink("origin", source)
+  for name in ["a", "b", "c"]:
+    with open(os.path.join(source.path, name), "w") as outfile:
+      outfile.write(name)
+
+  j = journal.Journal(source.path)
+  j.beat(10)
+  j.start()
+  sink.push()
+  head = sink.head()
+  assert head.node.has_section("Journal")
+
+  with open(os.path.join(source.path, "b"), "w") as outfile:
+    outfile.write("changed")
+  os.remove(os.path.join(source.path, "c"))
+  with open(os.path.join(source.path, "d"), "w") as outfile:
+    outfile.write("d")
+  j.append(["b", "c", "d"])
+  # Changes missing from the journal are not transferred:
+  with open(os.path.join(source.path, "e"), "w") as outfile:
+    outfile.write("e")
+
+  time.sleep(1)
+  sink.push()
+  tree = sink.head().tree
+  assert ["a", "b", "d"] == sorted(os.listdir(tree))
+  assert "changed" == open(os.path.join(tree, "b")).read()
+  assert os.path.samefile(os.path.join(head.tree, "a"),
+                          os.path.join(tree, "a"))
+  assert "b" == open(os.path.join(head.tree, "b")).read()
+
+
+def test_incremental_push_manifest(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n")
+  sink = emu.Sink("origin", source)
+  os.makedirs(os.path.join(source.path, "dir", "sub"))
+  for name in ["a", "dir/b", "dir/sub/c"]:
+    with open(os.path.join(source.path, name), "w") as outfile:
+      outfile.write(name * 5000)
+
+  j = journal.Journal(source.path)
+  j.beat(10)
+  j.start()
+  sink.push()
+  head = sink.head()
+
+  with open(os.path.join(source.path, "dir", "b"), "w") as outfile:
+    outfile.write("changed" * 5000)
+  os.makedirs(os.path.join(source.path, "dir", "new"))
+  with open(os.path.join(source.path, "dir", "new", "d"), "w") as outfile:
+    outfile.write("d")
+  j.append(["dir/b", "dir/new"])
+  time.sleep(1)
+
+  def walk(tree):
+    raise AssertionError("walked " + tree)
+
+  # Only the changed paths are walked:
+  monkeypatch.setattr(manifest, "walk", walk)
+  sink.push()
+  monkeypatch.undo()
+
+  # The manifest and usage match those of a walk of the whole tree:
+  new = sink.head()
+  assert list(manifest.scan(new.tree)) == list(new.manifest)
+  assert (usage.account(new.tree, manifest.scan(head.tree)).usage() ==
+          new.usage)
+  head = emu.Snapshot(head.id, sink)
+  assert usage.account(head.tree).exclusive == head.usage.exclusive
+  assert new.usage.shared_parent == head.usage.shared_child
@@ -0,0 +1,108 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+
+import emu
+from emu import linkdest
+from emu import manifest
+from emu import test
+
+
+def _write(path, contents):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+
+
+def _snapshot(sink_path, name, files, parent=None):
+  tree = os.path.join(sink_path, name)
+  os.makedirs(tree)
+  for path in files:
+    if parent and os.path.exists(os.path.join(sink_path, parent, path)):
+      os.link(os.path.join(sink_path, parent, path), os.path.join(tree, path))
+    else:
+      _write(os.path.join(tree, path), path)
+  manifest.Manifest(os.path.join(sink_path, ".emu", "manifests"),
+                    name).write(tree, parent=parent)
+
+
+def test_select_policies():
+  branch = ["5", "4", "3", "2", "1"]
+  assert ["5"] == linkdest.select(branch, "/nonexistent", policy="head")
+  assert ["5", "4"] == linkdest.select(branch, "/nonexistent",
+                                       policy="recent", max=2)
+  # Without manifests, only HEAD is used:
+  assert ["5"] == linkdest.select(branch, "/nonexistent", max=3)
+  assert [] == linkdest.select([], "/nonexistent")
+
+
+def test_select_auto(tmpdir):
+  sink_path = str(tmpdir)
+  _snapshot(sink_path, "1", ["a", "b", "c"])
+  _snapshot(sink_path, "2", ["a"], parent="1")
+  _snapshot(sink_path, "3", ["a"], parent="2")
+  _snapshot(sink_path, "4", ["a", "d"], parent="3")
+
+  # Snapshot 1 holds two files which HEAD does not, and snapshots 2
+  # and 3 hold none:
+  assert ["4", "1"] == linkdest.select(["4", "3", "2", "1"], sink_path)
+
+  # Candidates without manifests are skipped:
+  manifest.Manifest(os.path.join(sink_path, ".emu", "manifests"),
+                    "1").remove()
+  assert ["4"] == linkdest.select(["4", "3", "2", "1"], sink_path)
+
+
+def test_hit_counter(tmpdir):
+  sink_path = str(tmpdir)
+  _snapshot(sink_path, "1", ["a", "b"])
+  _snapshot(sink_path, "2", ["a"], parent="1")
+  _snapshot(sink_path, "3", ["a", "b", "c"], parent="2")
+  os.link(os.path.join(sink_path, "1", "b"),
+          os.path.join(sink_path, "3", "b.1"))
+  os.replace(os.path.join(sink_path, "3", "b.1"),
+             os.path.join(sink_path, "3", "b"))
+
+  counter = linkdest.HitCounter(["2", "1"], sink_path)
+  for entry, st in manifest.walk(os.path.join(sink_path, "3")):
+    counter.add(entry, st)
+  assert [("2", 1, 1), ("1", 1, 1)] == counter.items()
+
+
+def test_push_link_dest_hits(tmpdir):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n")
+  sink = emu.Sink("origin", source)
+  _write(os.path.join(source.path, "a"), "a")
+  _write(os.path.join(source.path, "b"), "b")
+  sink.push()
+  first = sink.head()
+
+  time.sleep(1)
+  os.remove(os.path.join(source.path, "b"))
+  sink.push()
+
+  # Restore a file which HEAD does not hold:
+  time.sleep(1)
+  os.link(os.path.join(first.tree, "b"), os.path.join(source.path, "b"))
+  sink.push()
+  node = sink.head().node
+  assert [first.name] == node.get("LinkDest", "dests").split()[1:]
+  assert ["1", "1"] == node.get("LinkDest", "hits").split()
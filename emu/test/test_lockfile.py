@@ -0,0 +1,72 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import pytest
+from emu import lockfile
+
+
+def test_lock_exclusive(tmpdir):
+  lock = lockfile.LockFile(str(tmpdir.join("LOCK")))
+  assert not lock.islocked
+  with lock.acquire():
+    assert lock.islocked
+    assert lock.owned_by_self
+    assert os.getpid() == lock.pid
+    assert not lock.isshared
+  assert not lock.islocked
+  # The guard file is removed with the lock:
+  assert [] == os.listdir(str(tmpdir))
+
+
+def test_lock_shared(tmpdir):
+  path = str(tmpdir.join("LOCK"))
+  lock = lockfile.LockFile(path)
+  # Another live process holds the lock in shared mode:
+  lockfile.LockFile.write_holders(path, [(os.getppid(), 0, True)])
+
+  with lock.acquire(shared=True):
+    assert lock.isshared
+    assert [os.getppid(), os.getpid()] == [h[0] for h in lock.holders]
+    assert os.getppid() == lock.pid
+  # Releasing only removes the current process:
+  assert [os.getppid()] == [h[0] for h in lock.holders]
+
+  with pytest.raises(lockfile.UnableToAcquireLockError):
+    lock.acquire()
+
+
+def test_lock_shared_excluded(tmpdir):
+  path = str(tmpdir.join("LOCK"))
+  lock = lockfile.LockFile(path)
+  # Another live process holds the lock exclusively:
+  lockfile.LockFile.write(path, os.getppid(), 0)
+  with pytest.raises(lockfile.UnableToAcquireLockError):
+    lock.acquire(shared=True)
+  with pytest.raises(lockfile.UnableToReleaseLockError):
+    lock.release()
+
+
+def test_lock_shared_stale(tmpdir):
+  path = str(tmpdir.join("LOCK"))
+  lock = lockfile.LockFile(path)
+  lockfile.LockFile.write_holders(path, [(10000000, 0, True)])
+  assert lock.isstale
+  with lock.acquire(replace_stale=True):
+    assert not lock.isshared
+    assert [os.getpid()] == [h[0] for h in lock.holders]
+  assert not lock.islocked
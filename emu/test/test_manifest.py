@@ -0,0 +1,103 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import gzip
+import os
+
+from emu import manifest
+from emu import test
+
+
+def _write(path, contents):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+
+
+def test_manifest_full(tmpdir):
+  tree = str(tmpdir.join("tree"))
+  _write(os.path.join(tree, "a.b"), "x")
+  _write(os.path.join(tree, "a", "b"), "yy")
+  _write(os.path.join(tree, "tab\tand\nnewline\\"), "")
+  os.symlink("a", os.path.join(tree, "link"))
+
+  m = manifest.Manifest(str(tmpdir.join("manifests")), "one")
+  summary = m.write(tree)
+  assert 3 == summary.files
+  assert 1 == summary.directories
+  assert 1 == summary.symlinks
+  assert 3 == summary.size
+
+  entries = list(m)
+  assert ["a", "a/b", "a.b", "link", "tab\tand\nnewline\\"] == [
+      e.path for e in entries]
+  assert entries == list(manifest.scan(tree))
+  assert 0 == entries[0].ino
+  assert os.stat(os.path.join(tree, "a", "b")).st_ino == entries[1].ino
+  assert "l" == m.lookup("link").type
+  assert m.lookup("a/c") is None
+
+
+def test_manifest_delta(tmpdir):
+  manifests = str(tmpdir.join("manifests"))
+  tree = str(tmpdir.join("tree"))
+  _write(os.path.join(tree, "a"), "a")
+  _write(os.path.join(tree, "b"), "b")
+  manifest.Manifest(manifests, "1").write(tree)
+
+  os.remove(os.path.join(tree, "a"))
+  _write(os.path.join(tree, "b"), "changed")
+  _write(os.path.join(tree, "c", "d"), "d")
+  m = manifest.Manifest(manifests, "2")
+  m.write(tree, parent="1")
+  assert ("1", 1) == m.header()
+  assert list(manifest.scan(tree)) == list(m)
+
+  with gzip.open(m.path, "rt") as infile:
+    lines = infile.read().splitlines()
+  assert 5 == len(lines)  # Header, -a, +b, +c, +c/d.
+
+
+def test_manifest_keyframe(tmpdir, monkeypatch):
+  monkeypatch.setattr(manifest, "KEYFRAME_INTERVAL", 2)
+  manifests = str(tmpdir.join("manifests"))
+  tree = str(tmpdir.join("tree"))
+  _write(os.path.join(tree, "a"), "a")
+  manifest.Manifest(manifests, "1").write(tree)
+  manifest.Manifest(manifests, "2").write(tree, parent="1")
+  manifest.Manifest(manifests, "3").write(tree, parent="2")
+  manifest.Manifest(manifests, "4").write(tree, parent="3")
+  assert ("1", 1) == manifest.Manifest(manifests, "2").header()
+  assert (None, 0) == manifest.Manifest(manifests, "3").header()
+  assert ("3", 1) == manifest.Manifest(manifests, "4").header()
+
+
+def test_remove_snapshots_rebases_manifests(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  names = sink.snapshot_names()
+  parent = None
+  for i, name in enumerate(names):
+    _write(os.path.join(sink.path, name, "file{}".format(i)), "x")
+    manifest.Manifest(sink.manifests_dir, name).write(
+        os.path.join(sink.path, name), parent=parent)
+    parent = name
+
+  sink.remove_snapshots([names[1]])
+  m = manifest.Manifest(sink.manifests_dir, names[2])
+  assert (names[0], 1) == m.header()
+  assert ["file2"] == [e.path for e in m]
+  assert not os.path.exists(os.path.join(sink.manifests_dir, names[1]))
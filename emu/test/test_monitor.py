@@ -0,0 +1,196 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+import json
+import os
+import re
+
+import emu
+from emu import monitor
+from emu import progress
+from emu import test
+from emu import usage
+
+
+def _metrics(text):
+  return {m.group(1): float(m.group(2)) for m in re.finditer(
+      r'^(\w+)\{sink="origin"\} (\S+)$', text, re.MULTILINE)}
+
+
+def test_metrics(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  node = emu.Node(os.path.join(sink.path, ".emu", "nodes", sink.index.head()))
+  node.add_section("Timings")
+  node.set("Timings", "transfer", "1.500")
+  node.set("Timings", "move", "0.500")
+  node.add_section("Stats")
+  node.set("Stats", "literal-data", "1024")
+  node.flush()
+
+  monkeypatch.setitem(monitor.app.config, "EMU_SOURCE_DIR", source.path)
+  response = monitor.app.test_client().get("/metrics")
+  assert 200 == response.status_code
+  text = response.get_data(as_text=True)
+  assert "# TYPE emu_snapshots gauge" in text
+
+  metrics = _metrics(text)
+  assert 3 == metrics["emu_snapshots"]
+  assert 2 == metrics["emu_last_push_duration_seconds"]
+  assert 1024 == metrics["emu_last_push_bytes"]
+  assert 0 == metrics["emu_push_in_progress"]
+  assert metrics["emu_head_age_seconds"] > 0
+  assert metrics["emu_free_bytes"] <= metrics["emu_capacity_bytes"]
+  assert metrics["emu_free_inodes"] <= metrics["emu_inodes"]
+
+
+def test_index(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  monkeypatch.setitem(monitor.app.config, "EMU_SOURCE_DIR", source.path)
+  response = monitor.app.test_client().get("/")
+  assert 200 == response.status_code
+  assert source.sinks()[0].index.head() in response.get_data(as_text=True)
+
+
+def test_cache(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  cache = monitor.Cache(source.path, interval=60)
+  cache.refresh()
+  data = cache.get()
+  assert 3 == len(data["snapshots"])
+  assert 1 == len(data["sinks"])
+  assert not data["sinks"][0]["in_progress"]
+
+  # Snapshot records are reused until the sink's nodes change:
+  records = data["snapshots"]
+  cache.refresh()
+  assert records[0] is cache.get()["snapshots"][0]
+
+  sink = emu.Sink("origin", source)
+  sink.remove_snapshots([sink.index.head()])
+  cache.refresh()
+  assert 2 == len(cache.get()["snapshots"])
+
+
+def test_cache_usage(tmpdir):
+  source = test.make_source(tmpdir, num_snapshots=3)
+  sink = source.sinks()[0]
+  for snapshot in sink.snapshots():
+    usage.write(snapshot.node, usage.Usage(100, 10, 0, 0, False))
+    snapshot.node.flush()
+  cache = monitor.Cache(source.path, interval=60)
+  cache.refresh()
+  first, second, third = cache.get()["snapshots"]
+
+  # The neighbours of a removed snapshot are re-read:
+  sink.remove_snapshots([second["name"]])
+  cache.refresh()
+  first, third = cache.get()["snapshots"]
+  assert first["usage"]["stale"]
+  assert third["usage"]["stale"]
+  assert first["name"] == third["parent"]
+
+  # Stale usage is re-read until it is recomputed:
+  snapshot = sink.tail()
+  usage.write(snapshot.node, usage.Usage(100, 50, 0, 0, False))
+  snapshot.node.flush()
+  cache.refresh()
+  assert not cache.get()["snapshots"][0]["usage"]["stale"]
+  assert third is cache.get()["snapshots"][1]
+
+
+def test_api_snapshots(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir, sinks=("origin", "mirror"),
+                            num_snapshots=5)
+  monkeypatch.setitem(monitor.app.config, "EMU_SOURCE_DIR", source.path)
+  client = monitor.app.test_client()
+
+  # Pages are newest first, and follow on from their cursors:
+  response = client.get("/api/snapshots?limit=4")
+  assert 200 == response.status_code
+  data = response.get_json()
+  assert 10 == data["total"]
+  names = [(x["name"], x["sink"]) for x in data["snapshots"]]
+  assert names == sorted(names, reverse=True)
+  pages = [names]
+  while data["next"]:
+    data = client.get("/api/snapshots", query_string={
+      "limit": 4, "cursor": data["next"]}).get_json()
+    pages.append([(x["name"], x["sink"]) for x in data["snapshots"]])
+  assert [4, 4, 2] == [len(page) for page in pages]
+  names = sum(pages, [])
+  assert names == sorted(set(names), reverse=True)
+
+  data = client.get("/api/snapshots?sink=mirror").get_json()
+  assert 5 == len(data["snapshots"])
+  assert {"mirror"} == {x["sink"] for x in data["snapshots"]}
+  assert data["next"] is None
+
+  # Snapshots are taken hourly from 2020-01-01 00:00:
+  since = datetime.datetime(2020, 1, 1, 1).timestamp()
+  until = datetime.datetime(2020, 1, 1, 3).timestamp()
+  data = client.get("/api/snapshots", query_string={
+    "since": since, "until": until, "sink": "origin"}).get_json()
+  assert (["2020-01-01-030000", "2020-01-01-020000", "2020-01-01-010000"] ==
+          [x["name"] for x in data["snapshots"]])
+
+  assert 400 == client.get("/api/snapshots?limit=0").status_code
+  assert 400 == client.get("/api/snapshots?since=yesterday").status_code
+
+
+def test_api_sinks(tmpdir, monkeypatch):
+  source = test.make_source(tmpdir, sinks=("origin", "mirror"))
+  monkeypatch.setitem(monitor.app.config, "EMU_SOURCE_DIR", source.path)
+  data = monitor.app.test_client().get("/api/sinks").get_json()
+  assert {"origin", "mirror"} == {x["name"] for x in data["sinks"]}
+
+
+def test_progress_events(tmpdir):
+  source = test.make_source(tmpdir)
+  sink = source.sinks()[0]
+  cache = monitor.Cache(source.path, interval=60, events_interval=0.01)
+  events = monitor.progress_events(cache)
+  assert "retry: 30000\n\n" == next(events)
+  with sink.lock.acquire():
+    with progress.Status(sink.status_path, sink.name) as status:
+      status.update(phase="transfer", bytes=1024)
+      event = next(events)
+      assert event.startswith("event: progress\n")
+      data = json.loads(event.split("data: ", 1)[1])
+      assert "origin" == data["sink"]
+      assert 1024 == data["bytes"]
+  assert "event: done\ndata: {\"sink\": \"origin\"}\n\n" == next(events)
+
+
+def test_progress_events_stale(tmpdir):
+  source = test.make_source(tmpdir)
+  sink = source.sinks()[0]
+  # A status file left by a push which is no longer running:
+  progress.Status(sink.status_path, sink.name).update(phase="transfer")
+  cache = monitor.Cache(source.path, interval=60, events_interval=0.01)
+  events = monitor.progress_events(cache, keepalive=0)
+  assert "retry: 30000\n\n" == next(events)
+  assert ": keep-alive\n\n" == next(events)
+
+
+def test_progress_events_idle_timeout(tmpdir):
+  source = test.make_source(tmpdir)
+  cache = monitor.Cache(source.path, interval=60, events_interval=0.01)
+  events = list(monitor.progress_events(cache, keepalive=0.01,
+                                        idle_timeout=0.05, retry=1))
+  assert "retry: 1000\n\n" == events[0]
+  assert set(events[1:]) <= {": keep-alive\n\n"}
@@ -0,0 +1,121 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import subprocess
+import sys
+
+from emu import progress
+
+
+_OUTPUT = r"""
+import sys
+sys.stdout.write("cd+++++++++ dir/\n")
+sys.stdout.write(">f+++++++++ dir/a\n")
+sys.stdout.write("hf+++++++++ dir/b => dir/a\n")
+sys.stdout.write("*deleting   old\n")
+sys.stdout.write("      1,024  50%    1.00MB/s    0:00:01 (xfr#1)\r")
+sys.stdout.write("      2,048 100%    1.00MB/s    0:00:02 (xfr#1)\n")
+sys.stdout.write("Number of files: 3 (reg: 2, dir: 1)\n")
+sys.stdout.write("Literal data: 2,048 bytes\n")
+sys.stderr.write("rsync: failed to open 'x': Permission denied\n")
+"""
+
+
+def test_progress_update():
+  p = progress.Progress()
+  for line in [">f+++++++++ a", "<f.st...... b", "cL+++++++++ c -> a",
+               "hf+++++++++ d => a", ".d..t...... e/", "*deleting   f",
+               "  12,345,678  42%   10.00MB/s    0:01:00 (xfr#3, to-chk=1/9)"]:
+    p.update(line)
+  assert 6 == p.items
+  assert 2 == p.transferred
+  assert 1 == p.created
+  assert 1 == p.linked
+  assert 1 == p.deleted
+  assert 12345678 == p.bytes
+  assert 42 == p.percent
+  assert "10.00MB/s" == p.rate
+
+
+def test_rotating_log(tmpdir):
+  path = str(tmpdir.join("logs", "origin.log"))
+  log = progress.RotatingLog(path, max_size=10, backups=2)
+  for i in range(5):
+    log.write("line {}\n".format(i))
+  log.close()
+  assert ["origin.log", "origin.log.1", "origin.log.2"] == sorted(
+      os.listdir(str(tmpdir.join("logs"))))
+
+
+def test_rsync_output(tmpdir):
+  log_path = str(tmpdir.join("logs", "origin.log"))
+  output = progress.RsyncOutput("origin", log_path, interval=60)
+  script = str(tmpdir.join("rsync.py"))
+  with open(script, "w") as outfile:
+    outfile.write(_OUTPUT)
+  process = subprocess.Popen([sys.executable, script],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  stats = output.run(process)
+
+  assert 3 == stats.files
+  assert 2048 == stats.literal_data
+  assert 4 == output.progress.items
+  assert 100 == output.progress.percent
+  assert 1 == output.progress.errors
+  with open(log_path) as infile:
+    log = infile.readlines()
+  assert log[0].startswith("# ")
+  assert ">f+++++++++ dir/a\n" in log
+  assert "rsync: failed to open 'x': Permission denied\n" in log
+  # Progress reports are counted, not logged:
+  assert not [line for line in log[1:] if "xfr#" in line]
+
+
+def test_status(tmpdir):
+  path = str(tmpdir.join("progress"))
+  with progress.Status(path, "origin", interval=60) as status:
+    status.update(phase="transfer", bytes=10)
+    assert "transfer" == progress.Status.read(path)["phase"]
+    # Counters are written at most once per interval:
+    status.update(bytes=20)
+    assert 10 == progress.Status.read(path)["bytes"]
+    # ... unless the phase changes, which discards them:
+    status.update(phase="manifest")
+    data = progress.Status.read(path)
+    assert "manifest" == data["phase"]
+    assert "bytes" not in data
+    assert os.getpid() == data["pid"]
+  assert progress.Status.read(path) is None
+
+
+def test_rsync_output_status(tmpdir):
+  path = str(tmpdir.join("progress"))
+  status = progress.Status(path, "origin", interval=60)
+  output = progress.RsyncOutput("origin", str(tmpdir.join("origin.log")),
+                                interval=60, status=status)
+  script = str(tmpdir.join("rsync.py"))
+  with open(script, "w") as outfile:
+    outfile.write(_OUTPUT)
+  process = subprocess.Popen([sys.executable, script],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  status.update(phase="transfer")
+  output.run(process)
+
+  data = progress.Status.read(path)
+  assert 4 == data["items"]
+  assert 100 == data["percent"]
+  assert "0:00:02" == data["eta"]
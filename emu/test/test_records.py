@@ -0,0 +1,115 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+import re
+
+from emu import cli
+from emu import io
+from emu import records
+from emu import test
+
+
+_BIN_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "bin")
+
+
+def _restore_messages(monkeypatch):
+  for flag in ["printf_enabled", "verbose_enabled", "debug_enabled"]:
+    monkeypatch.setattr(io, flag, getattr(io, flag))
+
+
+def test_value():
+  assert 10 == records.value("10")
+  assert -0.5 == records.value("-0.5")
+  assert "2020-01-01-000000" == records.value("2020-01-01-000000")
+  assert "" == records.value("")
+
+
+def test_mount(tmpdir):
+  path = str(tmpdir)
+  mountinfo = str(tmpdir.join("mountinfo"))
+  st_dev = os.stat(path).st_dev
+  dev = "{}:{}".format(os.major(st_dev), os.minor(st_dev))
+  with open(mountinfo, "w") as outfile:
+    outfile.write("1 0 {} / / rw - ext4 /dev/root rw\n".format(dev))
+    outfile.write("2 1 0:1 / /nonexistent rw shared:1 - tmpfs tmpfs rw\n")
+    outfile.write("3 1 {} / {} rw shared:2 master:3 - xfs /dev/my\\040disk rw\n"
+                  .format(dev, path.replace(" ", "\\040")))
+
+  assert ({"source": "/dev/my disk", "mount_point": path, "fstype": "xfs"} ==
+          records.mount(path, mountinfo=mountinfo))
+  assert None is records.mount(path, mountinfo=mountinfo + ".nonexistent")
+
+
+def test_device(tmpdir):
+  device = records.device(str(tmpdir))
+  assert device["total"] >= device["free"]
+  assert device["inodes"] >= device["inodes_free"]
+  assert {"source", "mount_point", "fstype"} < set(device)
+
+
+def test_log_jsonl(tmpdir, capsys, monkeypatch):
+  _restore_messages(monkeypatch)
+  # Diagnostics must not be interleaved with records:
+  io.enable_debug_messages()
+  source = test.make_source(tmpdir, sinks=("a", "b"), num_snapshots=2)
+  emu_log = cli.load("emu-log", os.path.join(_BIN_DIR, "emu-log"))
+  args = ["-S", source.path, "--format", "jsonl", "-n", "3"]
+  assert 0 == emu_log.main(args, len(args))
+
+  lines = capsys.readouterr().out.splitlines()
+  log = [json.loads(line) for line in lines]
+  assert ["a", "a", "b"] == [record["sink"] for record in log]
+  assert log[0]["date"] > log[1]["date"]
+  assert log[1]["name"] == log[0]["node"]["Snapshot"]["parent"]
+  assert 2 == log[0]["node"]["Sink"]["snapshot-no"]
+
+
+def test_sink_jsonl(tmpdir, capsys, monkeypatch):
+  _restore_messages(monkeypatch)
+  source = test.make_source(tmpdir, num_snapshots=1)
+  emu_sink = cli.load("emu-sink", os.path.join(_BIN_DIR, "emu-sink"))
+  args = ["-S", source.path, "--format=jsonl"]
+  assert 0 == emu_sink.main(args, len(args))
+
+  record, = [json.loads(line)
+             for line in capsys.readouterr().out.splitlines()]
+  sink = source.sinks()[0]
+  assert sink.name == record["name"]
+  assert 1 == record["snapshots"]
+  assert sink.head().name == record["head"]
+  assert not record["in_progress"]
+  assert records.space(sink.path)["total"] == record["device"]["total"]
+
+
+def test_log_sink_names(tmpdir, capsys, monkeypatch):
+  _restore_messages(monkeypatch)
+  source = test.make_source(tmpdir, sinks=("a", "b"), num_snapshots=2)
+  emu_log = cli.load("emu-log", os.path.join(_BIN_DIR, "emu-log"))
+
+  def _headers(*args):
+    args = ["-S", source.path] + list(args)
+    assert 0 == emu_log.main(args, len(args))
+    lines = capsys.readouterr().out.splitlines()
+    return [line for line in lines
+            if re.sub(r"\x1b\[[0-9;]*m", "", line) in ("a:", "b:")]
+
+  # Sink names are only printed if the logged snapshots span sinks:
+  assert [] == _headers("-n", "2")
+  assert [] == _headers("b")
+  assert 2 == len(_headers("-n", "3"))
+  assert 2 == len(_headers())
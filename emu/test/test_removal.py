@@ -0,0 +1,75 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import pytest
+from emu import removal
+
+
+def _make_tree(root):
+  os.makedirs(os.path.join(root, "a", "b", "c"))
+  os.makedirs(os.path.join(root, "d"))
+  for dirpath in ["", "a", "a/b", "a/b/c", "d"]:
+    with open(os.path.join(root, dirpath, "file"), "w") as outfile:
+      outfile.write("x" * 8192)
+  os.symlink("file", os.path.join(root, "a", "link"))
+  # Read-only directories can still be removed:
+  os.chmod(os.path.join(root, "d"), 0o500)
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 8])
+def test_rmtree(tmpdir, jobs):
+  root = str(tmpdir.join("tree"))
+  _make_tree(root)
+  stats = removal.rmtree(root, jobs=jobs)
+  assert not os.path.exists(root)
+  # 5 directories, 5 files, and 1 symlink:
+  assert 11 == stats.inodes
+  assert stats.bytes_freed >= 5 * 8192
+
+
+def test_rmtree_hardlinks(tmpdir):
+  root = str(tmpdir.join("tree"))
+  os.makedirs(root)
+  with open(str(tmpdir.join("file")), "w") as outfile:
+    outfile.write("x" * 8192)
+  os.link(str(tmpdir.join("file")), os.path.join(root, "file"))
+  stats = removal.rmtree(root)
+  assert 2 == stats.inodes
+  # The file is still linked from outside of the tree, so only the
+  # directory is freed:
+  assert stats.bytes_freed < 8192
+  assert os.path.exists(str(tmpdir.join("file")))
+
+
+def test_rmtree_not_found(tmpdir):
+  with pytest.raises(OSError):
+    removal.rmtree(str(tmpdir.join("not-a-directory")))
+
+
+@pytest.mark.parametrize("jobs", [1, 8])
+def test_rmtree_deep(tmpdir, jobs):
+  # Trees deeper than the recursion limit can be removed:
+  root = str(tmpdir.join("tree"))
+  dirpath = root
+  os.mkdir(dirpath)
+  for _ in range(1500):
+    dirpath = os.path.join(dirpath, "d")
+    os.mkdir(dirpath)
+  stats = removal.rmtree(root, jobs=jobs)
+  assert not os.path.exists(root)
+  assert 1501 == stats.inodes
@@ -0,0 +1,188 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import errno
+import os
+import time
+
+import emu
+from emu import test
+from emu import transfer
+
+
+def _write(path, contents):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+
+
+def _tree(root):
+  return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                for dirpath, dirnames, filenames in os.walk(root)
+                for name in dirnames + filenames)
+
+
+def test_filter_from_rsync(tmpdir):
+  excludes = str(tmpdir.join("excludes"))
+  _write(excludes, "# comment\n\n+ keep.o\n*.o\n- /build/\n")
+  f = transfer.Filter.from_rsync(exclude="/.emu", exclude_from=excludes)
+  assert f.excluded(".emu", True)
+  assert f.excluded("src/a.o", False)
+  assert not f.excluded("src/keep.o", False)
+  assert f.excluded("build", True)
+  assert not f.excluded("src/build", True)
+  assert not f.excluded("src/a.c", False)
+
+
+def test_sync(tmpdir):
+  src, dst = str(tmpdir.join("src")), str(tmpdir.join("dst"))
+  _write(os.path.join(src, "a"), "a")
+  _write(os.path.join(src, "dir", "b"), "b" * 100000)
+  _write(os.path.join(src, "dir", "c.o"), "c")
+  os.symlink("a", os.path.join(src, "link"))
+  os.link(os.path.join(src, "a"), os.path.join(src, "dir", "a2"))
+  os.chmod(os.path.join(src, "a"), 0o640)
+
+  stats = transfer.sync(src, dst, exclude="*.o")
+  assert ["a", "dir", "dir/a2", "dir/b", "link"] == _tree(dst)
+  assert 4 == stats.files
+  assert 2 == stats.copied
+  assert 100001 == stats.bytes_copied
+  assert "b" * 100000 == open(os.path.join(dst, "dir", "b")).read()
+  assert "a" == os.readlink(os.path.join(dst, "link"))
+  assert os.path.samefile(os.path.join(dst, "a"),
+                          os.path.join(dst, "dir", "a2"))
+  st, dst_st = os.lstat(os.path.join(src, "a")), os.lstat(
+      os.path.join(dst, "a"))
+  assert st.st_mode == dst_st.st_mode
+  assert st.st_mtime_ns == dst_st.st_mtime_ns
+
+
+def test_sync_link_dest(tmpdir):
+  src = str(tmpdir.join("src"))
+  head, new = str(tmpdir.join("head")), str(tmpdir.join("new"))
+  _write(os.path.join(src, "same"), "same")
+  _write(os.path.join(src, "changed"), "old")
+  transfer.sync(src, head)
+
+  _write(os.path.join(src, "changed"), "new!")
+  # Leftovers from an interrupted transfer are deleted:
+  _write(os.path.join(new, "stale"), "stale")
+  stats = transfer.sync(src, new, link_dest=[head])
+  assert ["changed", "same"] == _tree(new)
+  assert 1 == stats.linked
+  assert 1 == stats.copied
+  assert os.path.samefile(os.path.join(head, "same"),
+                          os.path.join(new, "same"))
+  assert "old" == open(os.path.join(head, "changed")).read()
+  assert "new!" == open(os.path.join(new, "changed")).read()
+
+
+def test_sync_link_dest_max_links(tmpdir, monkeypatch):
+  src = str(tmpdir.join("src"))
+  head, new = str(tmpdir.join("head")), str(tmpdir.join("new"))
+  _write(os.path.join(src, "same"), "same")
+  os.link(os.path.join(src, "same"), os.path.join(src, "link"))
+  transfer.sync(src, head)
+
+  def link(*args, **kwargs):
+    raise OSError(errno.EMLINK, os.strerror(errno.EMLINK))
+
+  # Files are copied once their link count is exhausted:
+  monkeypatch.setattr(os, "link", link)
+  stats = transfer.sync(src, new, link_dest=[head])
+  assert 0 == stats.linked
+  assert 1 == stats.copied
+  assert 2 == stats.files
+  assert "same" == open(os.path.join(new, "link")).read()
+
+
+def test_sync_paths(tmpdir):
+  src, dst = str(tmpdir.join("src")), str(tmpdir.join("dst"))
+  _write(os.path.join(src, "a"), "a")
+  _write(os.path.join(src, "dir", "b"), "b")
+  os.makedirs(dst)
+  stats = transfer.sync(src, dst, paths=["dir/b", "missing"])
+  assert ["dir", "dir/b"] == _tree(dst)
+  assert 1 == stats.files
+
+
+def test_push_native(tmpdir):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n")
+  sink = emu.Sink("origin", source)
+  _write(os.path.join(source.path, "file"), "hello")
+
+  sink.push()
+  head = sink.head()
+  assert ["file"] == os.listdir(head.tree)
+
+  # The next snapshot links unchanged files from HEAD:
+  time.sleep(1)
+  sink.push()
+  assert 2 == len(sink.snapshot_names())
+  assert os.path.samefile(os.path.join(head.tree, "file"),
+                          os.path.join(sink.head().tree, "file"))
+  node = sink.head().node
+  # The node written by the push is shared through the cache:
+  assert node is emu.Node.cached(node.path)
+  assert "native" == node.get("Stats", "engine")
+  assert 1 == node.getint("Stats", "linked")
+  for phase in ["rotate", "lock", "transfer", "move", "manifest", "node"]:
+    assert node.getfloat("Timings", phase) >= 0
+  # The status of the push is removed once it completes:
+  assert not os.path.exists(sink.status_path)
+
+
+def test_rsync_stats():
+  output = """\
+sending incremental file list
+./
+file
+
+Number of files: 3 (reg: 2, dir: 1)
+Number of created files: 1 (reg: 1)
+Number of deleted files: 0
+Number of regular files transferred: 1
+Total file size: 1,234,567 bytes
+Total transferred file size: 4,567 bytes
+Literal data: 4,567 bytes
+Matched data: 0 bytes
+File list size: 0
+File list generation time: 0.001 seconds
+File list transfer time: 0.000 seconds
+Total bytes sent: 4,800
+Total bytes received: 38
+
+sent 4,800 bytes  received 38 bytes  9,676.00 bytes/sec
+total size is 1,234,567  speedup is 255.18
+"""
+  stats = transfer.RsyncStats()
+  echoed = [line for line in output.splitlines() if not stats.parse(line)]
+  assert ["sending incremental file list", "./", "file", "", "",
+          "sent 4,800 bytes  received 38 bytes  9,676.00 bytes/sec",
+          "total size is 1,234,567  speedup is 255.18"] == echoed
+  assert 3 == stats.files
+  assert 1 == stats.created
+  assert 0 == stats.deleted
+  assert 1 == stats.transferred
+  assert 1234567 == stats.total_size
+  assert 4567 == stats.literal_data
+  assert 4800 == stats.bytes_sent
+  assert 255.18 == stats.speedup
+  assert ("literal-data", 4567) in stats.items()
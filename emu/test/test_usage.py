@@ -0,0 +1,125 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+
+import emu
+from emu import manifest
+from emu import test
+from emu import usage
+
+
+def _write(path, contents):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w") as outfile:
+    outfile.write(contents)
+
+
+def _blocks(path):
+  return os.lstat(path).st_blocks * 512
+
+
+def test_account(tmpdir):
+  parent = str(tmpdir.join("parent"))
+  tree = str(tmpdir.join("tree"))
+  _write(os.path.join(parent, "a"), "a" * 10000)
+  _write(os.path.join(parent, "b"), "b" * 10000)
+  os.makedirs(tree)
+  os.link(os.path.join(parent, "a"), os.path.join(tree, "a"))
+  _write(os.path.join(tree, "b"), "B" * 20000)
+
+  accounting = usage.account(tree, manifest.scan(parent))
+  a, b = os.path.join(tree, "a"), os.path.join(tree, "b")
+  assert _blocks(a) + _blocks(b) == accounting.total
+  assert _blocks(b) == accounting.exclusive
+  assert _blocks(a) == accounting.shared_parent
+  assert _blocks(a) == accounting.parent_exclusive
+
+
+def test_account_moved_file(tmpdir):
+  parent = str(tmpdir.join("parent"))
+  tree = str(tmpdir.join("tree"))
+  _write(os.path.join(parent, "a"), "a" * 10000)
+  os.makedirs(tree)
+  os.link(os.path.join(parent, "a"), os.path.join(tree, "b"))
+
+  accounting = usage.account(tree, manifest.scan(parent))
+  assert 0 == accounting.exclusive
+  assert 0 == accounting.shared_parent
+
+
+def test_account_store(tmpdir):
+  tree = str(tmpdir.join("tree"))
+  store = str(tmpdir.join("store"))
+  _write(os.path.join(tree, "a"), "a" * 10000)
+  os.makedirs(store)
+  os.link(os.path.join(tree, "a"), os.path.join(store, "a"))
+
+  # A link from the store is not a link outside of the snapshot:
+  inodes = {os.lstat(os.path.join(store, "a")).st_ino}
+  assert 0 == usage.account(tree).exclusive
+  assert _blocks(os.path.join(tree, "a")) <= usage.account(
+      tree, store=inodes).exclusive
+
+
+def test_push_usage(tmpdir):
+  source = test.make_source(tmpdir)
+  sink_path = source.sinks()[0].path
+  with open(os.path.join(sink_path, ".emu", "config"), "a") as outfile:
+    outfile.write("[Transfer]\nengine = native\n")
+  sink = emu.Sink("origin", source)
+  _write(os.path.join(source.path, "a"), "a" * 10000)
+  _write(os.path.join(source.path, "b"), "b" * 10000)
+  sink.push()
+  first = sink.head()
+  a = _blocks(os.path.join(first.tree, "a"))
+  b = _blocks(os.path.join(first.tree, "b"))
+  assert first.usage.exclusive >= a + b
+  assert 0 == first.usage.shared_parent
+
+  time.sleep(1)
+  _write(os.path.join(source.path, "b"), "B" * 20000)
+  sink.push()
+  second = sink.head()
+  time.sleep(1)
+  sink.push()
+  third = sink.head()
+
+  first, second = emu.Snapshot(first.id, sink), emu.Snapshot(second.id, sink)
+  assert a + b == first.usage.total
+  assert b == first.usage.exclusive
+  assert a == first.usage.shared_child
+  assert a == second.usage.shared_parent
+  assert 0 == second.usage.exclusive
+  assert not second.usage.stale
+
+  # Removing the middle snapshot makes its files exclusive to its
+  # neighbours once the trash is emptied:
+  sink.remove_snapshots([second])
+  first, third = emu.Snapshot(first.id, sink), emu.Snapshot(third.id, sink)
+  assert first.usage.stale
+  assert third.usage.stale
+
+  sink.empty_trash()
+  assert 2 == sink.update_usage()
+  first, third = emu.Snapshot(first.id, sink), emu.Snapshot(third.id, sink)
+  assert not first.usage.stale
+  assert not third.usage.stale
+  assert a == first.usage.shared_child
+  assert a == third.usage.shared_parent
+  assert b == first.usage.exclusive
+  assert third.usage.total - a == third.usage.exclusive
@@ -0,0 +1,663 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Native file transfer engine.
+
+An alternative to rsync for sinks on the same host as the source.
+Source entries are compared against the link destinations by size
+and modification time, in the manner of rsync's "quick check".
+Unchanged files are hardlinked, and changed files are copied in
+parallel threads using copy_file_range(2), falling back to
+sendfile(2).
+
+The subset of rsync behaviour used by emu is supported: exclude
+patterns and files, --archive metadata preservation, --hard-links,
+--link-dest, --delete, and --delete-excluded.
+"""
+import errno
+import os
+import re
+import stat
+import time
+
+from emu import io
+from emu import removal
+
+
+DEFAULT_JOBS = 8
+
+_COPY_CHUNK = 1 << 30
+
+
+def _read_umask():
+  """
+  Read the process umask.
+
+  The umask can only be read atomically from /proc. Elsewhere it is
+  read by setting it, which is only safe before any threads start, so
+  this is called once on import.
+  """
+  try:
+    with open("/proc/self/status") as infile:
+      for line in infile:
+        if line.startswith("Umask:"):
+          return int(line.split()[1], 8)
+  except (OSError, ValueError, IndexError):
+    pass
+  umask = os.umask(0)
+  os.umask(umask)
+  return umask
+
+
+_UMASK = _read_umask()
+
+
+class Error(Exception):
+  pass
+
+
+class TransferError(Error):
+  """
+  Raised if any files could not be transferred.
+
+  Attributes:
+      errors (list of str): The error messages.
+      stats (TransferStats): Statistics of the partial transfer.
+  """
+
+  def __init__(self, errors, stats):
+    self.errors = errors
+    self.stats = stats
+
+  def __str__(self):
+    return "\n".join(["{} errors in file transfer:".format(len(self.errors))]
+                     + self.errors[:20])
+
+
+class TransferStats:
+  """
+  Statistics of a transfer.
+
+  Attributes:
+      files (int): Number of non-directory entries transferred.
+      linked (int): Number of files hardlinked from a link destination.
+      copied (int): Number of files copied.
+      bytes_copied (int): Number of bytes copied.
+      elapsed (float): Elapsed time in seconds.
+  """
+
+  def __init__(self):
+    self.files = 0
+    self.linked = 0
+    self.copied = 0
+    self.bytes_copied = 0
+    self.elapsed = 0
+
+  def __repr__(self):
+    return ("{} files, {} linked, {} copied ({} bytes) in {:.2f}s"
+            .format(self.files, self.linked, self.copied,
+                    self.bytes_copied, self.elapsed))
+
+  @property
+  def bytes_written(self):
+    return self.bytes_copied
+
+  def items(self):
+    return [("engine", "native"), ("files", self.files),
+            ("linked", self.linked), ("copied", self.copied),
+            ("bytes-copied", self.bytes_copied)]
+
+
+class RsyncStats:
+  """
+  Statistics of an rsync transfer, parsed from the output of rsync
+  --stats. Statistics which rsync did not report are None.
+
+  Attributes:
+      files (int): Number of files scanned.
+      created (int): Number of files created.
+      deleted (int): Number of files deleted.
+      transferred (int): Number of regular files transferred.
+      total_size (int): Total size of the files scanned.
+      transferred_size (int): Total size of the files transferred.
+      literal_data (int): Number of bytes sent as literal data.
+      matched_data (int): Number of bytes matched against existing
+        files by the delta-transfer algorithm.
+      bytes_sent (int): Number of bytes sent.
+      bytes_received (int): Number of bytes received.
+      speedup (float): Ratio of total size to bytes sent and received.
+      elapsed (float): Elapsed time in seconds.
+
+  >>> stats = RsyncStats()
+  >>> stats.parse("Number of files: 1,234 (reg: 1,000, dir: 234)")
+  True
+  >>> stats.parse("total size is 12,345  speedup is 5,000.00")
+  False
+  >>> stats.files, stats.speedup
+  (1234, 5000.0)
+  """
+
+  _PATTERNS = [
+      ("files", r"Number of files: ([\d,]+)"),
+      ("created", r"Number of created files: ([\d,]+)"),
+      ("deleted", r"Number of deleted files: ([\d,]+)"),
+      ("transferred", r"Number of regular files transferred: ([\d,]+)"),
+      ("total_size", r"Total file size: ([\d,]+) bytes"),
+      ("transferred_size", r"Total transferred file size: ([\d,]+) bytes"),
+      ("literal_data", r"Literal data: ([\d,]+) bytes"),
+      ("matched_data", r"Matched data: ([\d,]+) bytes"),
+      ("bytes_sent", r"Total bytes sent: ([\d,]+)"),
+      ("bytes_received", r"Total bytes received: ([\d,]+)"),
+      ("speedup", r"total size is [\d,]+ +speedup is ([\d,.]+)"),
+  ]
+
+  # The block of statistics which is only printed by --stats:
+  _STATS_BLOCK = re.compile(r"^(Number of|Total|Literal data|Matched data|"
+                            r"File list)")
+
+  def __init__(self):
+    for name, _ in RsyncStats._PATTERNS:
+      setattr(self, name, None)
+    self.elapsed = 0
+
+  def __repr__(self):
+    return ("{} files, {} transferred ({} bytes) in {:.2f}s"
+            .format(self.files, self.transferred, self.literal_data,
+                    self.elapsed))
+
+  @property
+  def bytes_written(self):
+    return self.literal_data or 0
+
+  def parse(self, line):
+    """
+    Parse a line of rsync output.
+
+    Returns:
+        bool: True if the line is part of the block of statistics
+          printed by --stats, else False.
+    """
+    for name, pattern in RsyncStats._PATTERNS:
+      match = re.match(pattern, line)
+      if match:
+        value = match.group(1).replace(",", "")
+        setattr(self, name, float(value) if name == "speedup" else int(value))
+        break
+    return bool(RsyncStats._STATS_BLOCK.match(line))
+
+  def items(self):
+    return [("engine", "rsync")] + [
+        (name.replace("_", "-"), getattr(self, name))
+        for name, _ in RsyncStats._PATTERNS
+        if getattr(self, name) is not None]
+
+
+class Rule:
+  """
+  An rsync include or exclude rule.
+
+  Patterns follow rsync(1) semantics: a leading "/" anchors the
+  pattern to the root of the transfer, a trailing "/" matches only
+  directories, "*" matches any characters except "/", "**" matches
+  any characters, and "dir/***" matches a directory and its contents.
+  Unanchored patterns containing a "/" or "**" match against the end
+  of the path, and other patterns match only the final component.
+
+  >>> Rule("/.emu").matches(".emu", True)
+  True
+  >>> Rule("/.emu").matches("a/.emu", True)
+  False
+  >>> Rule("*.o").matches("a/b.o", False)
+  True
+  >>> Rule("build/").matches("build", False)
+  False
+  >>> Rule("a/*/c").matches("x/a/b/c", False)
+  True
+  >>> Rule("/x/***").matches("x/y/z", False)
+  True
+  """
+
+  def __init__(self, pattern, include=False):
+    self.pattern = pattern
+    self.include = include
+    self.dir_only = pattern.endswith("/")
+
+    pattern = pattern.rstrip("/")
+    if pattern.startswith("/"):
+      prefix, pattern = "", pattern[1:]
+      self.basename_only = False
+    elif "/" in pattern or "**" in pattern:
+      prefix = "(?:.*/)?"
+      self.basename_only = False
+    else:
+      prefix = ""
+      self.basename_only = True
+
+    self.regex = re.compile(prefix + Rule._translate(pattern), re.DOTALL)
+
+  @staticmethod
+  def _translate(pattern):
+    """
+    Translate an rsync wildcard pattern into a regular expression.
+    """
+    out, i = [], 0
+    while i < len(pattern):
+      if pattern.startswith("/***", i) and i + 4 == len(pattern):
+        out.append("(?:/.*)?")
+        i += 4
+      elif pattern.startswith("**", i):
+        out.append(".*")
+        i += 2
+      elif pattern[i] == "*":
+        out.append("[^/]*")
+        i += 1
+      elif pattern[i] == "?":
+        out.append("[^/]")
+        i += 1
+      elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+        end = pattern.index("]", i + 2)
+        cls = pattern[i + 1:end]
+        if cls.startswith("!"):
+          cls = "^" + cls[1:]
+        out.append("[" + cls.replace("\\", "\\\\") + "]")
+        i = end + 1
+      elif pattern[i] == "\\" and i + 1 < len(pattern):
+        out.append(re.escape(pattern[i + 1]))
+        i += 2
+      else:
+        out.append(re.escape(pattern[i]))
+        i += 1
+    return "".join(out)
+
+  def matches(self, path, is_dir):
+    if self.dir_only and not is_dir:
+      return False
+    if self.basename_only:
+      path = path.rsplit("/", 1)[-1]
+    return self.regex.fullmatch(path) is not None
+
+
+class Filter:
+  """
+  An ordered list of rules. The first matching rule decides whether a
+  path is excluded.
+  """
+
+  def __init__(self, rules=None):
+    self.rules = list(rules or [])
+
+  @staticmethod
+  def from_rsync(exclude=None, exclude_from=None):
+    """
+    Create a filter from rsync --exclude and --exclude-from arguments.
+
+    Arguments:
+        exclude (str or list of str, optional): Exclude patterns.
+        exclude_from (str or list of str, optional): Paths of files of
+          exclude patterns, one per line. Blank lines and lines
+          beginning with "#" or ";" are ignored, and lines beginning
+          with "+ " or "- " are include or exclude rules.
+
+    Returns:
+        Filter: The filter.
+    """
+    if isinstance(exclude, str):
+      exclude = [exclude]
+    if isinstance(exclude_from, str):
+      exclude_from = [exclude_from]
+
+    rules = [Rule(pattern) for pattern in exclude or []]
+    for path in exclude_from or []:
+      with open(path) as infile:
+        for line in infile:
+          line = line.rstrip("\r\n")
+          if not line or line[0] in "#;":
+            continue
+          elif line.startswith("+ "):
+            rules.append(Rule(line[2:], include=True))
+          elif line.startswith("- "):
+            rules.append(Rule(line[2:]))
+          else:
+            rules.append(Rule(line))
+    return Filter(rules)
+
+  def excluded(self, path, is_dir):
+    """
+    Return whether a path, relative to the transfer root, is excluded.
+    """
+    for rule in self.rules:
+      if rule.matches(path, is_dir):
+        return not rule.include
+    return False
+
+
+def _copy_data(infd, outfd):
+  """
+  Copy the contents of one file descriptor to another.
+
+  Returns:
+      int: Number of bytes copied.
+  """
+  copied = 0
+  try:
+    while True:
+      n = os.copy_file_range(infd, outfd, _COPY_CHUNK)
+      if not n:
+        return copied
+      copied += n
+  except (AttributeError, OSError) as e:
+    # Unsupported by the platform, or between these file systems:
+    if isinstance(e, OSError) and e.errno not in (
+        errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+      raise
+  while True:
+    n = os.sendfile(outfd, infd, copied, _COPY_CHUNK)
+    if not n:
+      return copied
+    copied += n
+
+
+def _clear(path):
+  """
+  Remove anything at a destination path.
+  """
+  if os.path.isdir(path) and not os.path.islink(path):
+    removal.rmtree(path)
+  elif os.path.lexists(path):
+    os.unlink(path)
+
+
+class _Transfer:
+
+  def __init__(self, src, dst, link_dests, filter, archive, owner,
+               hard_links, delete, dry_run, executor):
+    self.src = src
+    self.dst = dst
+    self.link_dests = link_dests
+    self.filter = filter
+    self.archive = archive
+    # As with rsync, ownership can only be preserved by the superuser:
+    self.owner = archive and owner and os.geteuid() == 0
+    self.hard_links = hard_links
+    self.delete = delete
+    self.dry_run = dry_run
+    self.executor = executor
+    self.umask = _UMASK
+
+    self.stats = TransferStats()
+    self.errors = []
+    self._inodes = {}  # Maps source inodes to their first destination.
+    self._deferred_links = []
+    self._dirs = []
+    self._stack = []
+    self._futures = []
+
+  def _error(self, relpath, e):
+    self.errors.append("{}: {}".format(relpath, e))
+
+  def run(self, paths=None):
+    if paths is None:
+      self._dir("", os.lstat(self.src))
+    else:
+      self._paths(paths)
+
+    while self._stack:
+      self._walk(self._stack.pop())
+
+    for future in self._futures:
+      try:
+        self.stats.bytes_copied += future.result()
+      except OSError as e:
+        self._error(os.path.relpath(e.filename or "?", self.dst), e)
+
+    # Link the remaining names of source inodes once the first has
+    # been copied:
+    for first, path, st in self._deferred_links:
+      try:
+        try:
+          os.link(first, path, follow_symlinks=False)
+        except OSError as e:
+          if e.errno != errno.EMLINK or not stat.S_ISREG(st.st_mode):
+            raise
+          # The inode has reached the maximum link count:
+          self.stats.bytes_copied += self._copy(first, path, st)
+      except OSError as e:
+        self._error(os.path.relpath(path, self.dst), e)
+
+    # Set directory metadata once their contents are complete, deepest
+    # first:
+    for path, st in reversed(self._dirs):
+      try:
+        self._set_metadata(path, st)
+      except OSError as e:
+        self._error(os.path.relpath(path, self.dst), e)
+
+  def _paths(self, paths):
+    """
+    Transfer only a list of paths, into an existing destination tree.
+    """
+    for relpath in paths:
+      components = relpath.split("/")
+      if any(self.filter.excluded("/".join(components[:i]), True)
+             for i in range(1, len(components))):
+        continue
+      try:
+        st = os.lstat(os.path.join(self.src, relpath))
+      except FileNotFoundError:
+        continue
+      if self.filter.excluded(relpath, stat.S_ISDIR(st.st_mode)):
+        continue
+      try:
+        if not self.dry_run:
+          os.makedirs(os.path.dirname(os.path.join(self.dst, relpath)),
+                      exist_ok=True)
+        self._entry(relpath, st)
+      except OSError as e:
+        self._error(relpath, e)
+
+  def _walk(self, relpath):
+    src = os.path.join(self.src, relpath)
+    names = set()
+    try:
+      with os.scandir(src) as it:
+        entries = list(it)
+    except OSError as e:
+      self._error(relpath, e)
+      return
+
+    for entry in entries:
+      child = os.path.join(relpath, entry.name) if relpath else entry.name
+      try:
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if self.filter.excluded(child, is_dir):
+          continue
+        names.add(entry.name)
+        self._entry(child, entry.stat(follow_symlinks=False))
+      except OSError as e:
+        self._error(child, e)
+
+    # Delete extraneous (and excluded) entries from the destination:
+    dst = os.path.join(self.dst, relpath)
+    if self.delete and not self.dry_run:
+      for name in os.listdir(dst):
+        if name not in names:
+          io.verbose("deleting", os.path.join(relpath, name))
+          _clear(os.path.join(dst, name))
+
+  def _entry(self, relpath, st):
+    if stat.S_ISDIR(st.st_mode):
+      return self._dir(relpath, st)
+
+    dst = os.path.join(self.dst, relpath)
+    self.stats.files += 1
+
+    if self.hard_links and st.st_nlink > 1:
+      key = (st.st_dev, st.st_ino)
+      if key in self._inodes:
+        if not self.dry_run:
+          _clear(dst)
+          self._deferred_links.append((self._inodes[key], dst, st))
+        return
+      self._inodes[key] = dst
+
+    if stat.S_ISREG(st.st_mode):
+      self._file(relpath, dst, st)
+    elif not self.archive:
+      io.verbose("skipping non-regular file", relpath)
+    elif self.dry_run:
+      io.printf(relpath)
+    elif stat.S_ISLNK(st.st_mode):
+      _clear(dst)
+      os.symlink(os.readlink(os.path.join(self.src, relpath)), dst)
+      self._set_metadata(dst, st)
+    else:
+      _clear(dst)
+      os.mknod(dst, stat.S_IFMT(st.st_mode) | 0o600, st.st_rdev)
+      self._set_metadata(dst, st)
+
+  def _dir(self, relpath, st):
+    dst = os.path.join(self.dst, relpath)
+    if not self.dry_run:
+      if not os.path.isdir(dst) or os.path.islink(dst):
+        _clear(dst)
+        os.mkdir(dst, 0o700)
+      else:
+        # Ensure that the contents can be written:
+        os.chmod(dst, stat.S_IMODE(os.lstat(dst).st_mode) | stat.S_IRWXU)
+      self._dirs.append((dst, st))
+    self._stack.append(relpath)
+
+  def _link_dest(self, relpath, st):
+    """
+    Find an unchanged copy of a file in the link destinations.
+    """
+    if not self.archive:
+      return None  # Modification times are not preserved.
+    for link_dest in self.link_dests:
+      path = os.path.join(link_dest, relpath)
+      try:
+        lst = os.lstat(path)
+      except OSError:
+        continue
+      if (stat.S_ISREG(lst.st_mode) and
+          lst.st_size == st.st_size and
+          lst.st_mtime_ns == st.st_mtime_ns and
+          lst.st_mode == st.st_mode and
+          (not self.owner or (lst.st_uid, lst.st_gid) ==
+           (st.st_uid, st.st_gid))):
+        return path
+    return None
+
+  def _file(self, relpath, dst, st):
+    link_dest = self._link_dest(relpath, st)
+    if self.dry_run:
+      if not link_dest:
+        io.printf(relpath)
+      return
+
+    _clear(dst)
+    if link_dest:
+      try:
+        os.link(link_dest, dst)
+        self.stats.linked += 1
+        return
+      except OSError as e:
+        if e.errno != errno.EMLINK:
+          raise
+        # The link destination has reached the maximum link count, so
+        # copy it instead:
+        io.debug("{}: maximum link count reached".format(link_dest))
+    self._futures.append(self.executor.submit(
+        self._copy, os.path.join(self.src, relpath), dst, st))
+    self.stats.copied += 1
+
+  def _copy(self, src, dst, st):
+    with open(src, "rb") as infile:
+      fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC,
+                   0o600)
+      try:
+        copied = _copy_data(infile.fileno(), fd)
+      finally:
+        os.close(fd)
+    self._set_metadata(dst, st)
+    return copied
+
+  def _set_metadata(self, path, st):
+    islink = stat.S_ISLNK(st.st_mode)
+    if self.owner:
+      os.chown(path, st.st_uid, st.st_gid, follow_symlinks=False)
+    if self.archive:
+      if not islink:
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+      os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns),
+               follow_symlinks=False)
+    elif not islink:
+      os.chmod(path, stat.S_IMODE(st.st_mode) & ~self.umask)
+
+
+def sync(src, dst, link_dest=None, exclude=None, exclude_from=None,
+         archive=True, owner=True, hard_links=True, delete=True,
+         paths=None, dry_run=False, jobs=None):
+  """
+  Copy a directory tree, hardlinking unchanged files.
+
+  Arguments:
+      src (str): Source directory.
+      dst (str): Destination directory.
+      link_dest (str or list of str, optional): Directories to hardlink
+        unchanged files from. The first match is used.
+      exclude (str or list of str, optional): Exclude patterns.
+      exclude_from (str or list of str, optional): Exclude files.
+      archive (bool, optional): Preserve symlinks, special files,
+        permissions, and modification times.
+      owner (bool, optional): Preserve ownership, if running as the
+        superuser.
+      hard_links (bool, optional): Preserve hardlinks within the source.
+      delete (bool, optional): Delete extraneous and excluded files from
+        the destination.
+      paths (list of str, optional): If provided, transfer only these
+        paths, relative to the source, into an existing destination.
+      dry_run (bool, optional): Print the files which would be copied,
+        without making any changes.
+      jobs (int, optional): Number of copying threads. Defaults to
+        DEFAULT_JOBS.
+
+  Returns:
+      TransferStats: Statistics of the transfer.
+
+  Raises:
+      TransferError: If any file could not be transferred.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  start_time = time.time()
+
+  if isinstance(link_dest, str):
+    link_dest = [link_dest]
+  src = os.path.abspath(src)
+  dst = os.path.abspath(dst)
+  filter = Filter.from_rsync(exclude, exclude_from)
+
+  with ThreadPoolExecutor(max_workers=jobs or DEFAULT_JOBS) as executor:
+    transfer = _Transfer(src, dst, link_dest or [], filter, archive, owner,
+                         hard_links, delete, dry_run, executor)
+    transfer.run(paths)
+
+  transfer.stats.elapsed = time.time() - start_time
+  if transfer.errors:
+    raise TransferError(transfer.errors, transfer.stats)
+  return transfer.stats
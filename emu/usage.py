@@ -0,0 +1,286 @@
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Disk usage accounting of snapshots.
+
+Unchanged files are hardlinked between snapshots, so the disk usage of
+a snapshot tree says little about the space that deleting it would
+free. Instead, each snapshot records the bytes which are exclusive to
+it, i.e. whose inodes have no links outside of the snapshot, and the
+bytes it shares with its parent and child.
+
+Usage is accounted incrementally when a snapshot is created, in the
+same walk which writes its manifest: an inode with a single link is
+exclusive to the new snapshot, and an inode at the same path in the
+parent is shared with it. An inode which was shared with the parent
+and has exactly two links was exclusive to the parent until now, so
+the parent's figures are updated in place. If only a few paths of the
+snapshot changed, see journal.stage(), then its usage is derived from
+the parent's by walking only the changed paths, see Delta. Destroying a snapshot
+changes the figures of its neighbours, which are marked stale and
+recomputed by "emu clean".
+
+Figures are in bytes of allocated blocks. Links from the dedup store
+are not counted, since store entries which are no longer linked from
+any snapshot are swept when the trash is emptied.
+"""
+from collections import namedtuple
+
+from emu import manifest
+
+
+Usage = namedtuple("Usage", ["total", "exclusive", "shared_parent",
+                             "shared_child", "stale", "directories"],
+                   defaults=[None])
+Usage.__doc__ = """
+The disk usage of a snapshot. 'total' is the size of the snapshot
+tree, 'exclusive' is the size which deleting it would free, and
+'shared_parent' and 'shared_child' are the sizes of the files which
+it shares with its parent and child. If 'stale' is True, a neighbour
+has been destroyed since the figures were computed. 'directories' is
+the size of the directories of the tree, or None if it was not
+recorded.
+"""
+
+SECTION = "Usage"
+
+
+def _size(st):
+  return st.st_blocks * 512
+
+
+def links_outside_store(st, store):
+  """
+  The number of links to an inode, not counting its dedup store entry.
+
+  Arguments:
+      st (os.stat_result): Stat result of the inode.
+      store (set of int): Inodes of the dedup store.
+  """
+  return st.st_nlink - 1 if st.st_ino in store else st.st_nlink
+
+
+class Accounting:
+  """
+  Accumulates the disk usage of a snapshot tree.
+
+  Attributes:
+      total (int): Size of the tree.
+      exclusive (int): Size of the inodes with no links outside of
+        the tree.
+      shared_parent (int): Size of the inodes shared with the parent.
+      parent_exclusive (int): Size of the shared inodes which were
+        exclusive to the parent before this snapshot was created.
+      directories (int): Size of the directories.
+  """
+
+  def __init__(self, parent=None, store=()):
+    """
+    Arguments:
+        parent (iterable of manifest.Entry, optional): Sorted entries
+          of the parent snapshot.
+        store (set of int, optional): Inodes of the dedup store, see
+          dedup.Store.inodes().
+    """
+    self.total = 0
+    self.exclusive = 0
+    self.shared_parent = 0
+    self.parent_exclusive = 0
+    self.directories = 0
+    self._parent = manifest.Cursor(parent or [])
+    self._store = store
+
+  def add(self, entry, st):
+    size = _size(st)
+    self.total += size
+    links = links_outside_store(st, self._store)
+    # Directories cannot be hardlinked:
+    if entry.type == "d":
+      self.directories += size
+    if entry.type == "d" or links == 1:
+      self.exclusive += size
+      return
+
+    parent = self._parent.get(entry.path)
+    if parent is not None and parent.ino == entry.ino:
+      self.shared_parent += size
+      if links == 2:
+        self.parent_exclusive += size
+
+  def observe(self, stream):
+    """
+    Account for a stream of entries, passing them through.
+
+    Arguments:
+        stream (iterable of Tuple(manifest.Entry, os.stat_result)):
+          Sorted entries and their stat results.
+
+    Yields:
+        manifest.Entry: Entries.
+    """
+    for entry, st in stream:
+      self.add(entry, st)
+      yield entry
+
+  def usage(self, shared_child=0):
+    return Usage(self.total, self.exclusive, self.shared_parent,
+                 shared_child, False, self.directories)
+
+
+class Delta:
+  """
+  Accumulates the disk usage of a snapshot tree which was staged from
+  its parent with only some paths changed, see journal.stage().
+
+  Entries which were carried over from the parent are hardlinked, so
+  they are all shared with the parent. Only the changed paths (and
+  their ancestors) are accounted, in both the parent and the new tree,
+  and the difference is applied to the parent's usage.
+
+  Attributes:
+      total (int): Size of the tree.
+      exclusive (int): Size of the inodes with no links outside of
+        the tree.
+      shared_parent (int): Size of the inodes shared with the parent.
+      parent_exclusive (int): Size of the parent's inodes which were
+        exclusive to the parent before this snapshot was created.
+      directories (int): Size of the directories.
+  """
+
+  def __init__(self, parent_tree, parent_usage, parent, paths, store=()):
+    """
+    Arguments:
+        parent_tree (str): Path of the parent snapshot tree.
+        parent_usage (Usage): Up to date usage of the parent, with its
+          directories recorded.
+        parent (iterable of manifest.Entry): Sorted entries of the
+          parent snapshot.
+        paths (list of str): Changed paths.
+        store (set of int, optional): Inodes of the dedup store.
+    """
+    self._parent_usage = parent_usage
+    self._new = Accounting(parent, store=store)
+    # The changed paths of the parent, which are not in the new tree
+    # unless they were linked by the transfer:
+    self._old = Accounting(store=store)
+    for entry, st in manifest.walk_paths(parent_tree, paths):
+      self._old.add(entry, st)
+
+  def add(self, entry, st):
+    # Entries carried over from the parent are passed without a stat:
+    if st is not None:
+      self._new.add(entry, st)
+
+  @property
+  def directories(self):
+    return (self._parent_usage.directories - self._old.directories +
+            self._new.directories)
+
+  @property
+  def total(self):
+    return self._parent_usage.total - self._old.total + self._new.total
+
+  @property
+  def exclusive(self):
+    # Of the carried over entries, only directories are exclusive:
+    return (self._new.exclusive + self._parent_usage.directories -
+            self._old.directories)
+
+  @property
+  def shared_parent(self):
+    parent_files = (self._parent_usage.total -
+                    self._parent_usage.directories)
+    changed_files = self._old.total - self._old.directories
+    return parent_files - changed_files + self._new.shared_parent
+
+  @property
+  def parent_exclusive(self):
+    # The parent's exclusive files which are not still exclusive to it
+    # are now linked from the new tree:
+    parent_files = (self._parent_usage.exclusive -
+                    self._parent_usage.directories)
+    changed_files = self._old.exclusive - self._old.directories
+    return max(0, parent_files - changed_files)
+
+  def usage(self, shared_child=0):
+    return Usage(self.total, self.exclusive, self.shared_parent,
+                 shared_child, False, self.directories)
+
+
+def read(node):
+  """
+  Read the usage of a snapshot from its node.
+
+  Returns:
+      Usage: Usage, or None if it was not recorded.
+  """
+  if not node.has_section(SECTION):
+    return None
+  return Usage(node.getint(SECTION, "total"),
+               node.getint(SECTION, "exclusive"),
+               node.getint(SECTION, "shared-parent"),
+               node.getint(SECTION, "shared-child"),
+               node.getboolean(SECTION, "stale", fallback=False),
+               node.getint(SECTION, "directories", fallback=None))
+
+
+def write(node, usage):
+  """
+  Record the usage of a snapshot in its node. The node is not flushed.
+  """
+  if not node.has_section(SECTION):
+    node.add_section(SECTION)
+  node.set(SECTION, "total", str(usage.total))
+  node.set(SECTION, "exclusive", str(usage.exclusive))
+  node.set(SECTION, "shared-parent", str(usage.shared_parent))
+  node.set(SECTION, "shared-child", str(usage.shared_child))
+  if usage.stale:
+    node.set(SECTION, "stale", "true")
+  else:
+    node.remove_option(SECTION, "stale")
+  if usage.directories is None:
+    node.remove_option(SECTION, "directories")
+  else:
+    node.set(SECTION, "directories", str(usage.directories))
+
+
+def account(tree, parent=None, store=()):
+  """
+  Compute the usage of an existing snapshot tree.
+
+  Arguments:
+      tree (str): Path of the snapshot tree.
+      parent (iterable of manifest.Entry, optional): Sorted entries of
+        the parent snapshot.
+      store (set of int, optional): Inodes of the dedup store.
+
+  Returns:
+      Accounting: Accounting of the tree.
+  """
+  accounting = Accounting(parent, store=store)
+  for _ in accounting.observe(manifest.walk(tree)):
+    pass
+  return accounting
+
+
+def entries(snapshot):
+  """
+  The sorted entries of a snapshot, read from its manifest if it has
+  one, else by walking its tree.
+  """
+  return manifest.entries(snapshot.sink.manifests_dir, snapshot.name,
+                          tree=snapshot.tree)
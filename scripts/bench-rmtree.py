@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmark emu.removal.rmtree() against shutil.rmtree().
+
+Builds a synthetic hardlink farm, resembling a sink of snapshots which
+share most of their files, and times the deletion of each snapshot.
+
+Usage: scripts/bench-rmtree.py [<dir>] [<files>] [<snapshots>] [<jobs>]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from emu import removal
+
+
+def make_farm(root, num_files, num_snapshots, files_per_dir=100):
+  """
+  Create 'num_snapshots' trees of 'num_files' files which share all
+  of their inodes.
+  """
+  base = os.path.join(root, "snapshot-0")
+  for i in range(num_files):
+    dirpath = os.path.join(base, "d{}".format(i // files_per_dir))
+    if not i % files_per_dir:
+      os.makedirs(dirpath)
+    with open(os.path.join(dirpath, "f{}".format(i)), "w") as outfile:
+      outfile.write("x" * (i % 4096))
+
+  for n in range(1, num_snapshots):
+    shutil.copytree(base, os.path.join(root, "snapshot-{}".format(n)),
+                    copy_function=os.link)
+
+
+def bench(name, fn, paths):
+  start = time.time()
+  for path in paths:
+    fn(path)
+  elapsed = time.time() - start
+  print("{:<24} {:>8.3f}s  {:>8.3f}s / snapshot"
+        .format(name, elapsed, elapsed / len(paths)))
+
+
+def main(argv):
+  root = argv[0] if len(argv) > 0 and argv[0] else None
+  num_files = int(argv[1]) if len(argv) > 1 else 20000
+  num_snapshots = int(argv[2]) if len(argv) > 2 else 4
+  jobs = int(argv[3]) if len(argv) > 3 else removal.DEFAULT_JOBS
+
+  with tempfile.TemporaryDirectory(dir=root) as tmpdir:
+    print("{} files x {} snapshots in {}".format(num_files, num_snapshots,
+                                                tmpdir))
+    for name, fn in [
+      ("shutil.rmtree", shutil.rmtree),
+      ("removal.rmtree jobs=1", lambda p: removal.rmtree(p, jobs=1)),
+      ("removal.rmtree jobs={}".format(jobs),
+       lambda p: removal.rmtree(p, jobs=jobs)),
+    ]:
+      farm = os.path.join(tmpdir, "farm")
+      make_farm(farm, num_files, num_snapshots)
+      paths = [os.path.join(farm, "snapshot-{}".format(n))
+               for n in range(num_snapshots)]
+      bench(name, fn, paths)
+      shutil.rmtree(farm)
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
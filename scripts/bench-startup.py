@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmark the startup time of emu commands.
+
+Times a cold start of the interpreter, of importing emu, and of the
+read-only commands "emu version" and "emu log" on a sink of
+snapshots, each in a new process. "emu log" is timed both directly
+and dispatched by the "emu" program. Commands whose median time exceeds
+the budget are reported, and the exit status is non-zero.
+
+Bytecode is written by an untimed first run of each command, so that
+compilation is not measured.
+
+Usage: scripts/bench-startup.py [<runs>] [<snapshots>]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from emu import test
+
+
+# Seconds which read-only commands should start and complete within:
+BUDGET = 0.05
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def bench(name, args, runs, cwd=None, budget=None):
+  env = dict(os.environ, PYTHONPATH=ROOT)
+  env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+  times = []
+  for _ in range(runs + 1):
+    start = time.time()
+    subprocess.run(args, cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    times.append(time.time() - start)
+  # Discard the first run, which writes bytecode:
+  times = times[1:]
+
+  median = statistics.median(times)
+  over = budget is not None and median > budget
+  print("{:<24} {:>8.1f}ms  {:>8.1f}ms min{}"
+        .format(name, median * 1000, min(times) * 1000,
+                "  OVER BUDGET" if over else ""))
+  return not over
+
+
+def main(argv):
+  runs = int(argv[0]) if len(argv) > 0 else 20
+  num_snapshots = int(argv[1]) if len(argv) > 1 else 100
+  python = sys.executable
+  bin_dir = os.path.join(ROOT, "bin")
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    source = test.make_source(tmpdir, num_snapshots=num_snapshots)
+    print("{} runs, {} snapshots, {:.0f}ms budget"
+          .format(runs, num_snapshots, BUDGET * 1000))
+    ok = all([
+      bench("python", [python, "-c", "pass"], runs),
+      bench("import emu", [python, "-c", "import emu"], runs,
+            budget=BUDGET),
+      bench("emu version", [python, os.path.join(bin_dir, "emu"), "version"],
+            runs, budget=BUDGET),
+      bench("emu log -n 10", [python, os.path.join(bin_dir, "emu-log"),
+                              "-n", "10"],
+            runs, cwd=source.path, budget=BUDGET),
+      bench("emu log -n 10 via emu", [python, os.path.join(bin_dir, "emu"),
+                                      "log", "-n", "10"],
+            runs, cwd=source.path, budget=BUDGET),
+    ])
+  return 0 if ok else 1
+
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2012-2020 Chris Cummins.
+#
+# This file is part of emu.
+#
+# Emu is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Emu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with emu.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Benchmark the native transfer engine against rsync.
+
+Builds a synthetic source tree and times an initial snapshot, a
+snapshot with no changes, and a snapshot with 1% of files changed,
+each linked against the previous snapshot, as emu push does. The
+rsync engine is skipped if rsync is not installed.
+
+Usage: scripts/bench-transfer.py [<dir>] [<files>] [<jobs>]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from emu import transfer
+
+
+def make_source(root, num_files, files_per_dir=100):
+  for i in range(num_files):
+    dirpath = os.path.join(root, "d{}".format(i // files_per_dir))
+    if not i % files_per_dir:
+      os.makedirs(dirpath)
+    with open(os.path.join(dirpath, "f{}".format(i)), "w") as outfile:
+      outfile.write("x" * (i % 16384))
+
+
+def touch_files(root, num_files, fraction, files_per_dir=100):
+  step = int(1 / fraction)
+  for i in range(0, num_files, step):
+    path = os.path.join(root, "d{}".format(i // files_per_dir),
+                        "f{}".format(i))
+    with open(path, "a") as outfile:
+      outfile.write("y")
+
+
+def rsync(src, dst, link_dest, jobs):
+  args = ["rsync", "--recursive", "--archive", "--hard-links",
+          "--keep-dirlinks", "--delete", "--delete-excluded",
+          "--exclude", "/.emu"]
+  if link_dest:
+    args += ["--link-dest", link_dest]
+  subprocess.check_call(args + [src + "/", dst])
+
+
+def native(src, dst, link_dest, jobs):
+  transfer.sync(src, dst, link_dest=link_dest, exclude="/.emu", jobs=jobs)
+
+
+def main(argv):
+  root = argv[0] if len(argv) > 0 and argv[0] else None
+  num_files = int(argv[1]) if len(argv) > 1 else 20000
+  jobs = int(argv[2]) if len(argv) > 2 else transfer.DEFAULT_JOBS
+
+  engines = [("native jobs={}".format(jobs), native)]
+  if shutil.which("rsync"):
+    engines.insert(0, ("rsync", rsync))
+  else:
+    print("rsync not found, skipping")
+
+  with tempfile.TemporaryDirectory(dir=root) as tmpdir:
+    print("{} files in {}".format(num_files, tmpdir))
+    print("{:<20} {:>10} {:>10} {:>10}".format(
+        "engine", "initial", "unchanged", "1% changed"))
+
+    for name, fn in engines:
+      src = os.path.join(tmpdir, "src")
+      sink = os.path.join(tmpdir, "sink")
+      make_source(src, num_files)
+      os.makedirs(sink)
+
+      times, head = [], None
+      for n in range(3):
+        if n == 2:
+          touch_files(src, num_files, .01)
+        dst = os.path.join(sink, str(n))
+        start = time.time()
+        fn(src, dst, head, jobs)
+        times.append(time.time() - start)
+        head = dst
+
+      print("{:<20} {:>9.3f}s {:>9.3f}s {:>9.3f}s".format(name, *times))
+      shutil.rmtree(src)
+      shutil.rmtree(sink)
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -70,17 +70,20 @@ setup(name="emu",
         (man_dir, [
           'man/emu.1',
           'man/emu-clean.1',
+          'man/emu-diff.1',
           'man/emu-init.1',
           'man/emu-log.1',
           'man/emu-prune.1',
           'man/emu-pull.1',
           'man/emu-push.1',
           'man/emu-sink.1',
+          'man/emu-watch.1',
         ])
       ],
       scripts=[
         'bin/emu',
         'bin/emu-clean',
+        'bin/emu-diff',
         'bin/emu-init',
         'bin/emu-log',
         'bin/emu-monitor',
@@ -88,6 +91,7 @@ setup(name="emu",
         'bin/emu-pull',
         'bin/emu-push',
         'bin/emu-sink',
+        'bin/emu-watch',
       ],
       test_suite="nose.collector",
       tests_require=[